@@ -2,14 +2,20 @@ import streamlit as st
 import time
 import os
 from pathlib import Path
-from utils.file_manager import save_uploaded_file, list_local_files, delete_local_file, get_file_info
+from utils.file_manager import (
+    save_uploaded_file, list_local_files, list_remote_only_files, list_expired_remote_only_files,
+    purge_expired_remote_only_files, delete_local_file, get_file_info, KEEP_LOCAL_FILES
+)
 from utils.env_manager import (
     load_notebooks, add_notebook, remove_notebook, set_active_notebook, get_active_notebook,
     add_file_to_notebook, remove_file_from_notebook, get_notebook_files,
-    find_existing_store_for_notebook, update_notebook_store_name, auto_restore_on_first_setup
+    find_existing_store_for_notebook, update_notebook_store_name, auto_restore_on_first_setup,
+    update_notebook_chunking_profile
 )
 from utils.logger import log_error
 from utils.gemini_handler import GeminiHandler
+from utils.index_journal import discard_journal
+from utils import chunking_profiles
 
 st.set_page_config(page_title="Gestione Quadernini - Quadernino", page_icon="📁")
 
@@ -108,6 +114,7 @@ if "confirm_delete" in st.session_state and st.session_state["confirm_delete"]:
                         else:
                             st.warning(f"Impossibile eliminare l'indice '{store_to_delete}'.")
                 st.session_state.pop(f"vector_store_{notebook_to_delete}", None)
+                discard_journal(notebook_to_delete)
             except Exception as e:
                 st.error(f"Errore durante la pulizia delle risorse cloud: {e}")
             if remove_notebook(notebook_to_delete):
@@ -134,9 +141,17 @@ if active_notebook:
             key=f"uploader_{st.session_state['uploader_key']}"
         )
         if uploaded_files:
+            # Senza conservazione locale i file vanno su Google direttamente dal buffer in memoria
+            direct_uploader = None
+            if not KEEP_LOCAL_FILES and st.session_state.get("api_key"):
+                direct_uploader = GeminiHandler(api_key=st.session_state.api_key)
             for file in uploaded_files:
-                path = save_uploaded_file(file)
-                if path:
+                if direct_uploader:
+                    with st.spinner(f"☁️ Upload diretto di {file.name}..."):
+                        saved = direct_uploader.upload_from_buffer(file)
+                else:
+                    saved = save_uploaded_file(file)
+                if saved:
                     if add_file_to_notebook(active_notebook["name"], file.name):
                         st.toast(f"✅ {file.name} aggiunto a '{active_notebook['name']}'")
                     else:
@@ -181,13 +196,47 @@ if active_notebook:
             st.caption(
                 f"⚠️ Il quadernino '{active_notebook['name']}' ha {len(notebook_files)} file ma non è ancora indicizzato.")
 
+        # Profilo di chunking del quadernino (vale per i file indicizzati da ora in poi)
+        with st.expander("🧩 Profilo di chunking"):
+            profile_options = [chunking_profiles.PROFILE_AUTO] + list(chunking_profiles.CHUNKING_PROFILES)
+            current_profile = active_notebook.get("chunking_profile", chunking_profiles.PROFILE_AUTO)
+            selected_profile = st.selectbox(
+                "Profilo:",
+                options=profile_options,
+                index=profile_options.index(current_profile) if current_profile in profile_options else 0,
+                format_func=lambda p: "Automatico (per tipo e dimensione del file)" if p == chunking_profiles.PROFILE_AUTO
+                else f"{chunking_profiles.CHUNKING_PROFILES[p]['label']} "
+                     f"({chunking_profiles.CHUNKING_PROFILES[p]['max_tokens_per_chunk']} token/chunk)",
+                key=f"chunking_profile_{active_notebook['name']}"
+            )
+            if selected_profile != current_profile:
+                if update_notebook_chunking_profile(active_notebook['name'], selected_profile):
+                    st.toast(f"Profilo di chunking impostato: {selected_profile}")
+                    st.rerun()
+            st.caption("Il profilo si applica ai file indicizzati da ora in poi: usa 'Rigenera Indice' per applicarlo a tutti.")
+
+            if st.button("📏 Stima chunk e costi per profilo"):
+                local_paths = [f for f in list_local_files() if Path(f).name in notebook_files]
+                report = chunking_profiles.measure_profiles(local_paths)
+                st.caption(f"{report['files']} file · ~{report['source_tokens']:,} token di testo stimati")
+                st.dataframe([
+                    {
+                        "Profilo": name,
+                        "Chunk": values["chunks"],
+                        "Token indicizzati": values["embedded_tokens"],
+                        "Costo indicizzazione ($)": values["indexing_cost_usd"],
+                        "Contesto per domanda (token)": values["context_tokens_per_query"]
+                    }
+                    for name, values in report["profiles"].items()
+                ], use_container_width=True)
+
         col_index, col_regenerate = st.columns([1, 1])
         with col_index:
             if st.button(f"🔍 Indicizza '{active_notebook['name']}'",
                          type="primary" if not is_indexed else "secondary"):
 
                 # --- INIZIO CODICE MIGLIORATO (Controllo Sincronia File) ---
-                local_files_all_paths = list_local_files()
+                local_files_all_paths = list_local_files() + list_remote_only_files()
                 local_files_names = [Path(f).name for f in local_files_all_paths]
                 notebook_files_in_env = get_notebook_files(active_notebook['name'])
 
@@ -215,13 +264,21 @@ if active_notebook:
                         try:
                             gemini = GeminiHandler(
                                 api_key=st.session_state.api_key,
-                                model_name=st.session_state.get("selected_model", "models/gemini-2.5-flash")
+                                model_name=st.session_state.get("selected_model", "models/gemini-2.5-flash"),
+                                chunking_profile=active_notebook.get("chunking_profile")
                             )
                             existing_store = find_existing_store_for_notebook(active_notebook['name'],
                                                                               st.session_state.api_key)
                             if existing_store:
                                 store_name = existing_store
-                                st.info(f"🔄 Trovato store esistente. Riutilizzo...")
+                                st.info("🔄 Trovato store esistente. Sincronizzazione incrementale...")
+                                sync_result = gemini.sync_store_with_notebook(store_name, active_notebook['name'],
+                                                                              files_to_index_paths)
+                                st.caption(
+                                    f"➕ {len(sync_result['added'])} nuovi · 🔁 {len(sync_result['updated'])} aggiornati · "
+                                    f"➖ {len(sync_result['removed'])} rimossi · ✔️ {len(sync_result['unchanged'])} invariati")
+                                if sync_result["failed"]:
+                                    st.warning(f"⚠️ File non sincronizzati: {', '.join(sync_result['failed'])}")
                             else:
                                 # Usa la lista filtrata e verificata
                                 store_name = gemini.create_vector_store_for_chapter(active_notebook['name'],
@@ -253,8 +310,9 @@ if active_notebook:
                             gemini.delete_file_search_store(store_to_delete, force=True)
 
                         st.session_state.pop(notebook_key, None)
-                        # Rimuovi anche lo store_name dal .env
+                        # Rimuovi anche lo store_name dal .env e il journal dell'indice eliminato
                         update_notebook_store_name(active_notebook['name'], "")
+                        discard_journal(active_notebook['name'])
 
                         st.success("🧹 Vecchio indice rimosso. Ora usa 'Indicizza' per crearlo nuovo!")
                         time.sleep(1)
@@ -268,7 +326,7 @@ if active_notebook:
 
 if active_notebook:
     st.subheader(f"📚 File del quadernino '{active_notebook['name']}'")
-    local_files = list_local_files()
+    local_files = list_local_files() + list_remote_only_files()
     notebook_files = get_notebook_files(active_notebook['name'])
 
     if not local_files:
@@ -288,6 +346,8 @@ if active_notebook:
                         st.write(f"📄 **{file_name}**")
                 with col2:
                     st.write(info['type'].upper())
+                    if info['remote_only']:
+                        st.caption("☁️ Solo su Google", help="Nessuna copia locale: il file remoto scade dopo circa 48 ore")
                 with col3:
                     st.write(info['size_formatted'])
                 with col4:
@@ -306,6 +366,16 @@ if active_notebook:
                                 st.success(f"❌ {file_name} rimosso da '{active_notebook['name']}'")
                                 time.sleep(1);
                                 st.rerun()
+    # File caricati senza copia locale il cui file remoto è scaduto: non più indicizzabili
+    expired_remote = list_expired_remote_only_files()
+    if expired_remote:
+        st.warning(f"⌛ File scaduti su Google (nessuna copia locale, vanno caricati di nuovo): "
+                   f"{', '.join(expired_remote)}")
+        if st.button("🧹 Dimentica i file scaduti", key="purge_expired_remote"):
+            removed = purge_expired_remote_only_files()
+            st.success(f"✅ {len(removed)} file scaduti rimossi dall'elenco")
+            time.sleep(1)
+            st.rerun()
     if notebook_files:
         st.info(f"📋 **Riepilogo quadernino '{active_notebook['name']}**: {len(notebook_files)} file")
     else:
@@ -1,6 +1,6 @@
 import streamlit as st
 from utils.gemini_handler import GeminiHandler
-from utils import file_manager
+from utils import citations, file_manager, metadata_manager
 from utils.env_manager import load_notebooks, get_active_notebook, set_active_notebook, \
     find_existing_store_for_notebook, update_notebook_store_name
 from pathlib import Path
@@ -60,7 +60,7 @@ from utils.env_manager import get_notebook_files
 
 notebook_files = get_notebook_files(active_notebook['name'])
 
-local_files = file_manager.list_local_files()
+local_files = file_manager.list_local_files() + file_manager.list_remote_only_files()
 notebook_file_paths = [f for f in local_files if Path(f).name in notebook_files]
 
 if not notebook_file_paths:
@@ -136,6 +136,43 @@ with col2:
     chat_count = len(st.session_state.chat_history) if "chat_history" in st.session_state else 0
     st.metric("💬 Messaggi", chat_count)
 
+# Ambito della domanda: la ricerca tocca solo i documenti scelti (per tag o per file)
+with st.expander("🎯 Ambito della ricerca"):
+    notebook_tags = metadata_manager.get_all_tags_for_notebook(active_notebook['name'])
+    scope_tags = st.multiselect("Tag:", options=notebook_tags,
+                                disabled=not notebook_tags,
+                                help="Cerca solo nei file con almeno uno di questi tag",
+                                key=f"scope_tags_{active_notebook['name']}")
+    scope_files = st.multiselect("File:", options=notebook_files,
+                                 help="Cerca solo in questi file",
+                                 key=f"scope_files_{active_notebook['name']}")
+
+    st.markdown("**🏷️ Tag dei file**")
+    col_tag_file, col_tag_values, col_tag_save = st.columns([2, 3, 1])
+    with col_tag_file:
+        tag_file = st.selectbox("File da etichettare:", options=notebook_files, label_visibility="collapsed")
+    with col_tag_values:
+        tag_text = st.text_input(
+            "Tag (separati da virgola):",
+            value=", ".join(metadata_manager.get_file_tags(active_notebook['name'], tag_file)) if tag_file else "",
+            placeholder="es: capitolo 1, esame",
+            label_visibility="collapsed",
+            key=f"tags_{active_notebook['name']}_{tag_file}"
+        )
+    with col_tag_save:
+        if st.button("💾 Salva", disabled=not tag_file):
+            tags = sorted({t.strip() for t in tag_text.split(",") if t.strip()})
+            if metadata_manager.update_file_tags(active_notebook['name'], tag_file, tags):
+                st.toast(f"🏷️ Tag di {tag_file} aggiornati")
+                st.rerun()
+
+metadata_filter = metadata_manager.build_metadata_filter(active_notebook['name'], scope_tags, scope_files)
+if metadata_filter == "":
+    st.warning("⚠️ Nessun file ha i tag selezionati: la ricerca userà tutti i documenti.")
+    metadata_filter = None
+elif metadata_filter:
+    st.caption(f"🎯 Ricerca limitata a: {', '.join(scope_tags + scope_files)}")
+
 st.markdown("---")
 
 # Inizializza chat_history se non esiste
@@ -144,7 +181,8 @@ if "chat_history" not in st.session_state:
 
 for message in st.session_state.chat_history:
     with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+        # Le fonti sono conservate a parte: il testo resta quello inviato al modello come cronologia
+        st.markdown(message["content"] + citations.format_footer(message.get("citations", [])))
 
 if prompt := st.chat_input("Fai una domanda ai tuoi documenti..."):
     st.session_state.chat_history.append({"role": "user", "content": prompt})
@@ -154,22 +192,45 @@ if prompt := st.chat_input("Fai una domanda ai tuoi documenti..."):
     with st.chat_message("assistant"):
         response_placeholder = st.empty()
 
-        # --- INIZIO CODICE MIGLIORATO (Spinner Immediato) ---
-        # Mostra spinner MENTRE l'API lavora (chiamata bloccante)
-        with st.spinner("🧠 Quadernino sta pensando..."):
+        if metadata_filter:
+            stream_generator = gemini.generate_response_with_metadata_filter(
+                prompt=prompt,
+                vector_store_name=active_store_name,
+                metadata_filter=metadata_filter,
+                history=st.session_state.chat_history[:-1]
+            )
+        else:
             stream_generator = gemini.generate_response_stream(
                 prompt=prompt,
                 history=st.session_state.chat_history[:-1],
                 vector_store_name=active_store_name
             )
 
-        # Ora che la chiamata è finita, esegui la simulazione di streaming
+        # Mostra lo spinner solo fino all'arrivo del primo chunk, poi streaming reale
         full_response = ""
+        with st.spinner("🧠 Quadernino sta pensando..."):
+            first_chunk = next(stream_generator, "")
+        full_response += first_chunk
+        response_placeholder.markdown(full_response + "▌")
+
         for chunk in stream_generator:
             full_response += chunk
             response_placeholder.markdown(full_response + "▌")
 
         response_placeholder.markdown(full_response)
-        # --- FINE CODICE MIGLIORATO ---
-
-    st.session_state.chat_history.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+        if gemini.last_from_cache:
+            st.caption("⚡ Risposta dalla cache locale")
+        elif gemini.last_ttft is not None:
+            st.caption(f"⚡ Primo token in {gemini.last_ttft:.2f}s")
+        history_info = gemini.last_history_info
+        if history_info and (history_info["summarized"] or history_info["dropped"]):
+            st.caption(f"🗜️ Cronologia compattata: {history_info['summarized']} messaggi riassunti, "
+                       f"~{history_info['history_tokens']} token di contesto")
+
+    # Il piè di pagina delle fonti non entra nella cronologia inviata al modello
+    sources = []
+    footer = citations.format_footer(gemini.last_citations)
+    if footer and full_response.endswith(footer):
+        full_response = full_response[:-len(footer)]
+        sources = gemini.last_citations
+    st.session_state.chat_history.append({"role": "assistant", "content": full_response, "citations": sources})
\ No newline at end of file
@@ -0,0 +1,124 @@
+import streamlit as st
+from utils.gemini_handler import GeminiHandler
+from utils import batch_qa
+from utils.env_manager import load_notebooks, get_active_notebook, set_active_notebook
+
+st.set_page_config(page_title="Domande in Blocco - Quadernino", page_icon="📝", layout="wide")
+
+st.title("📝 Domande in Blocco")
+st.caption("Esegui una banca di domande su un quadernino e scarica le risposte")
+
+if not st.session_state.get("api_key"):
+    st.warning("⚠️ Per favore, configura prima la tua Google API Key nella pagina Impostazioni.")
+    st.stop()
+
+selected_model = st.session_state.get("selected_model")
+if not selected_model:
+    st.error("⚠️ Nessun modello selezionato. Vai nelle Impostazioni per scegliere un modello.")
+    st.stop()
+
+notebooks = load_notebooks()
+active_notebook = get_active_notebook()
+if not notebooks or not active_notebook:
+    st.warning("⚠️ Nessun quadernino attivo. Seleziona o crea un quadernino nella pagina '📁 Gestione Quadernini'.")
+    st.stop()
+
+notebook_names = [nb['name'] for nb in notebooks]
+selected_notebook_name = st.selectbox(
+    "Quadernino:",
+    options=notebook_names,
+    index=notebook_names.index(active_notebook['name']) if active_notebook['name'] in notebook_names else 0
+)
+if selected_notebook_name != active_notebook['name']:
+    set_active_notebook(selected_notebook_name)
+    st.rerun()
+
+store_name = st.session_state.get(f"vector_store_{active_notebook['name']}") or active_notebook.get('store_name', '')
+if not store_name:
+    st.warning(f"⚠️ Il quadernino '{active_notebook['name']}' non è indicizzato.")
+    st.info("Vai alla pagina '📁 Gestione Quadernini' e clicca su '🔍 Indicizza'.")
+    st.stop()
+
+st.markdown("---")
+
+uploaded = st.file_uploader(
+    "Carica le domande (.txt una per riga, oppure .csv con colonna 'domanda')",
+    type=["txt", "csv"]
+)
+if not uploaded:
+    st.stop()
+
+prompts = batch_qa.parse_prompts(uploaded.getvalue(), uploaded.name)
+if not prompts:
+    st.warning("Nessuna domanda trovata nel file.")
+    st.stop()
+
+run_id = batch_qa.make_run_id(active_notebook['name'], prompts)
+previous = batch_qa.load_results(run_id)
+done_ids = {r["question_id"] for r in previous if not r.get("error")}
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.metric("❓ Domande", len(prompts))
+with col2:
+    st.metric("✅ Già completate", len(done_ids))
+with col3:
+    workers = st.number_input("Richieste parallele", min_value=1, max_value=16,
+                              value=batch_qa.DEFAULT_BATCH_WORKERS,
+                              help="Il rate limiter del modello resta comunque il limite finale")
+
+if done_ids and len(done_ids) < len(prompts):
+    st.info(f"♻️ Run interrotto trovato: verranno eseguite solo le {len(prompts) - len(done_ids)} domande mancanti.")
+
+col_run, col_reset = st.columns([1, 1])
+with col_run:
+    start = st.button("▶️ Avvia", type="primary", disabled=len(done_ids) >= len(prompts))
+with col_reset:
+    if st.button("🔄 Ricomincia da zero", disabled=not previous):
+        batch_qa.discard_run(run_id)
+        st.rerun()
+
+if start:
+    gemini = GeminiHandler(api_key=st.session_state.api_key, model_name=selected_model)
+    progress = st.progress(len(done_ids) / len(prompts), text="Esecuzione domande...")
+    completed = len(done_ids)
+    errors = 0
+
+    for record in gemini.run_batch(prompts, store_name, run_id, max_workers=int(workers)):
+        completed += 0 if record["error"] else 1
+        errors += 1 if record["error"] else 0
+        progress.progress(
+            min(1.0, (completed + errors) / len(prompts)),
+            text=f"{completed}/{len(prompts)} · ultima: {record['prompt'][:60]} ({record.get('latency_s') or 0:.1f}s)"
+        )
+    progress.empty()
+
+    if errors:
+        st.warning(f"⚠️ {errors} domande non completate: premi di nuovo 'Avvia' per ritentarle.")
+    else:
+        st.success("✅ Tutte le domande completate!")
+    previous = batch_qa.load_results(run_id)
+
+if previous:
+    st.markdown("### 📊 Risultati")
+    answered = [r for r in previous if not r.get("error")]
+    latencies = [r["latency_s"] for r in answered if r.get("latency_s") is not None]
+    tokens = sum(r.get("total_tokens") or 0 for r in answered)
+    col_a, col_b = st.columns(2)
+    with col_a:
+        st.metric("⏱️ Latenza media", f"{sum(latencies) / len(latencies):.2f}s" if latencies else "N/D")
+    with col_b:
+        st.metric("🔢 Token totali", f"{tokens:,}")
+
+    st.dataframe(
+        [{k: r.get(k) for k in ("index", "prompt", "answer", "sources", "latency_s", "total_tokens", "error")} for r in previous],
+        use_container_width=True
+    )
+
+    col_csv, col_jsonl = st.columns(2)
+    with col_csv:
+        st.download_button("⬇️ Scarica CSV", batch_qa.results_to_csv(previous),
+                           file_name=f"{run_id}.csv", mime="text/csv")
+    with col_jsonl:
+        st.download_button("⬇️ Scarica JSONL", batch_qa.results_to_jsonl(previous),
+                           file_name=f"{run_id}.jsonl", mime="application/jsonl")
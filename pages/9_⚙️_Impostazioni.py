@@ -4,6 +4,9 @@ import time
 from utils.gemini_handler import get_available_models, GeminiHandler  # Importa anche GeminiHandler
 from utils.env_manager import update_env_variable, auto_restore_on_first_setup
 from utils.google_monitor import get_google_monitor
+from utils.client_pool import get_pool_stats, release_client
+from utils.model_catalog import get_model_info, refresh_catalog
+from utils import document_browser, rate_limiter
 
 st.set_page_config(page_title="Impostazioni - Quadernino", page_icon="⚙️")
 
@@ -62,6 +65,7 @@ if env_key:
         with col1:
             if st.button("💾 Aggiorna", type="primary", disabled=not new_key.strip()):
                 if update_env_variable("GOOGLE_API_KEY", new_key.strip()):
+                    release_client(env_key)
                     st.session_state.api_key = new_key.strip()
                     _invalidate_all_vector_stores()  # --- CODICE MIGLIORATO ---
                     st.success("✅ API Key aggiornata!")
@@ -70,6 +74,7 @@ if env_key:
         with col2:
             if st.button("🗑️ Rimuovi", help="Rimuovi l'API Key dal file .env"):
                 if update_env_variable("GOOGLE_API_KEY", ""):
+                    release_client(env_key)
                     st.session_state.api_key = ""
                     _invalidate_all_vector_stores()  # --- CODICE MIGLIORATO ---
                     st.success("✅ API Key rimossa!")
@@ -122,6 +127,7 @@ available_models = []
 api_key = st.session_state.get("api_key") or os.getenv("GOOGLE_API_KEY")
 
 if api_key:
+    # Servito dalla cache su disco; la rete viene usata solo al primo avvio
     with st.spinner("Ricerca modelli..."):
         available_models = get_available_models(api_key)
 
@@ -142,7 +148,19 @@ selected_idx = 0
 if current_selection in available_models:
     selected_idx = available_models.index(current_selection)
 
-new_model = st.selectbox("Seleziona Modello", available_models, index=selected_idx)
+col_model, col_refresh_models = st.columns([5, 1])
+with col_model:
+    new_model = st.selectbox("Seleziona Modello", available_models, index=selected_idx)
+with col_refresh_models:
+    if api_key and st.button("🔄", help="Aggiorna l'elenco dei modelli da Google"):
+        with st.spinner("Aggiornamento catalogo modelli..."):
+            refresh_catalog(api_key)
+        st.rerun()
+
+if api_key and new_model:
+    model_info = get_model_info(api_key, new_model)
+    if model_info and not model_info.get("supports_file_search"):
+        st.error(f"🚫 **{new_model}** non risulta compatibile con File Search: la chat sui documenti potrebbe non funzionare.")
 
 # --- INIZIO CODICE MIGLIORATO (Logica di cambio modello) ---
 # Controlla se il modello è cambiato rispetto a quello in sessione
@@ -189,13 +207,16 @@ if st.session_state.get("api_key"):
                 import sys, platform
                 from pathlib import Path
 
+                pool_stats = get_pool_stats()
                 st.json({
                     "Sistema Operativo": platform.system(),
                     "Versione Python": f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
                     "Directory Progetto": str(Path.cwd()),
                     "File .env esiste": Path(".env").exists(),
                     "Modello Selezionato": st.session_state.get("selected_model", "N/D"),
-                    "API Key Configurata": bool(st.session_state.get("api_key"))
+                    "API Key Configurata": bool(st.session_state.get("api_key")),
+                    "Client API Condivisi": pool_stats["clients"],
+                    "Riuso Client (hit rate)": f"{pool_stats['hit_rate'] * 100:.1f}% ({pool_stats['hits']} hit / {pool_stats['misses']} miss)"
                 })
 st.divider()
 
@@ -211,6 +232,16 @@ if st.session_state.get("api_key"):
                 # Statistiche File Search
                 file_stats = monitor.get_file_search_stats()
 
+                col_age, col_refresh = st.columns([4, 1])
+                with col_age:
+                    inventory_age = monitor.inventory.age()
+                    if inventory_age is not None:
+                        st.caption(f"🗂️ Elenco store aggiornato {inventory_age:.0f}s fa")
+                with col_refresh:
+                    if st.button("🔄 Aggiorna", key="refresh_inventory", help="Rilegge l'elenco degli store da Google"):
+                        monitor.refresh_inventory()
+                        st.rerun()
+
                 if file_stats:
                     col1, col2, col3 = st.columns(3)
                     with col1:
@@ -221,9 +252,27 @@ if st.session_state.get("api_key"):
                         st.metric("🗃️ Quadernini", file_stats.get("quadernino_stores", 0))
 
                     # Occupazione memoria
-                    size_mb = file_stats.get("total_size_estimate_mb", 0)
+                    size_mb = file_stats.get("total_size_mb", 0)
                     if size_mb > 0:
-                        st.caption(f"💾 **Occupazione stimata:** {size_mb} MB")
+                        st.caption(f"💾 **Occupazione:** {size_mb} MB")
+
+                    # Occupazione per quadernino (indicizzata su Google e copie locali)
+                    notebooks_storage = file_stats.get("notebooks", {})
+                    if notebooks_storage:
+                        with st.expander("💾 Occupazione per quadernino", expanded=False):
+                            st.dataframe(
+                                [
+                                    {
+                                        "Quadernino": name,
+                                        "File": info["files"],
+                                        "Indicizzati (MB)": round(info["indexed_bytes"] / (1024 * 1024), 1),
+                                        "Locali (MB)": round(info["local_bytes"] / (1024 * 1024), 1)
+                                    }
+                                    for name, info in notebooks_storage.items()
+                                ],
+                                hide_index=True,
+                                use_container_width=True
+                            )
 
                     # Dettagli quadernini
                     quadernino_files = file_stats.get("quadernino_files", 0)
@@ -314,7 +363,7 @@ if st.session_state.get("api_key"):
                                                 with col_files:
                                                     st.metric("File", store['file_count'])
                                                 with col_size:
-                                                    st.write(f"~{store['size_estimate_mb']} MB")
+                                                    st.write(f"{store['size_mb']} MB")
                                                 with col_action:
                                                     store_key = f"del_quad_{store_hash}"
                                                     if st.button("🗑️Elimina", key=store_key, help="Elimina quadernino"):
@@ -369,7 +418,7 @@ if st.session_state.get("api_key"):
                                                 with col_files:
                                                     st.metric("File", store['file_count'])
                                                 with col_size:
-                                                    st.write(f"~{store['size_estimate_mb']} MB")
+                                                    st.write(f"{store['size_mb']} MB")
                                                 with col_action:
                                                     store_key = f"del_other_{store_hash}"
                                                     if st.button("🗑️Elimina", key=store_key, help="Elimina store"):
@@ -418,7 +467,7 @@ if st.session_state.get("api_key"):
                                 with col_info2:
                                     st.metric("📄 File Totali", selected_store["file_count"])
                                 with col_info3:
-                                    st.metric("💾 Spazio Stimato", f"~{selected_store['size_estimate_mb']} MB")
+                                    st.metric("💾 Spazio Occupato", f"{selected_store['size_mb']} MB")
 
                                 # Pulsante principale per esplorazione con icona migliorata
                                 col_explore, col_refresh = st.columns([3, 1])
@@ -433,65 +482,77 @@ if st.session_state.get("api_key"):
                                     if st.button("🔄", help="Aggiorna dati store"):
                                         st.rerun()
 
-                                # Stato di esplorazione in sessione
+                                # Stato di esplorazione in sessione: page token del server per ogni pagina già vista
                                 session_key = f"explored_store_{selected_store_id}"
-
-                                if explore_button or session_key in st.session_state:
-                                    if explore_button:
-                                        # Carica dati freschi
-                                        with st.spinner(f"🔍 Analizzando file in '{selected_store['name']}'..."):
-                                            files_details = monitor.get_store_files_detailed(selected_store_id)
-                                            st.session_state[session_key] = files_details
-                                    else:
-                                        # Usa dati in cache
-                                        files_details = st.session_state[session_key]
+                                selection_key = f"explorer_selection_{selected_store_id}"
+                                checkbox_prefix = f"select_doc_{selected_store_id}_"
+
+                                if explore_button:
+                                    # Carica dati freschi dalla prima pagina
+                                    document_browser.invalidate(selected_store_id)
+                                    st.session_state[session_key] = {"tokens": [None], "page": 0}
+                                    st.session_state[selection_key] = {}
+
+                                if session_key in st.session_state:
+                                    explorer = st.session_state[session_key]
+                                    page_index = explorer["page"]
+                                    # Le pagine già lette arrivano dalla cache: la richiesta parte solo per pagine nuove
+                                    with st.spinner(f"🔍 Lettura documenti di '{selected_store['name']}'..."):
+                                        files_details = monitor.get_store_documents_page(
+                                            selected_store_id, explorer["tokens"][page_index]
+                                        )
 
                                     if files_details.get("success"):
-                                        # Header risultati
-                                        st.success(f"✅ **{selected_store['name']}** - {files_details['total_files']} file trovati")
-
-                                        # Statistiche file
-                                        if files_details["files"]:
-                                            # Calcola statistiche sui file
+                                        documents = files_details["documents"]
+                                        next_page_token = files_details["next_page_token"]
+                                        # Selezione: document_id -> file di origine (persiste tra le pagine)
+                                        selection = st.session_state.setdefault(selection_key, {})
+                                        first_index = page_index * document_browser.DOCUMENT_PAGE_SIZE
+
+                                        if documents:
+                                            st.success(
+                                                f"✅ **{selected_store['name']}** - documenti {first_index + 1}-"
+                                                f"{first_index + len(documents)} di {selected_store['file_count']}"
+                                            )
+
+                                            # Statistiche della pagina (dimensioni reali dei documenti)
                                             file_types = {}
-                                            total_size_est = 0
-                                            for file_info in files_details["files"]:
-                                                file_type = file_info.get('type', 'Unknown')
-                                                file_types[file_type] = file_types.get(file_type, 0) + 1
-                                                # Stima dimensione (1MB per file di default)
-                                                total_size_est += 1024 * 1024
-
-                                            # Mostra statistiche file
+                                            for doc in documents:
+                                                file_types[doc['type']] = file_types.get(doc['type'], 0) + 1
+                                            page_size_mb = sum(doc['size_bytes'] for doc in documents) / (1024 * 1024)
+
                                             col_stat1, col_stat2, col_stat3 = st.columns(3)
                                             with col_stat1:
-                                                st.metric("📄 Documenti", len(files_details["files"]))
+                                                st.metric("📄 Documenti in Pagina", len(documents))
                                             with col_stat2:
                                                 st.metric("🏷️ Tipi File", len(file_types))
                                             with col_stat3:
-                                                size_mb = total_size_est // (1024 * 1024)
-                                                st.metric("💾 Spazio Totale", f"~{size_mb} MB")
+                                                st.metric("💾 Spazio Pagina", f"{page_size_mb:.1f} MB")
 
-                                            st.markdown("#### 📋 **Dettaglio File Completo**")
+                                            st.markdown("#### 📋 **Dettaglio File**")
 
-                                            # Tabella migliorata con checkboxes per selezione
+                                            # Tabella con checkboxes per selezione
                                             st.info("📌 **Seleziona i file che vuoi gestire** (ricreazione indice disponibile)")
 
-                                            selected_files = []
-                                            for i, file_info in enumerate(files_details["files"]):
-                                                # Checkbox per selezione file
+                                            for doc in documents:
                                                 col_checkbox, col_name, col_type, col_size, col_status = st.columns([0.5, 4, 1.5, 1.5, 1])
 
                                                 with col_checkbox:
-                                                    file_key = f"select_file_{selected_store_id}_{i}"
-                                                    is_selected = st.checkbox("", key=file_key, help="Seleziona per gestione")
+                                                    file_key = f"{checkbox_prefix}{doc['document_id']}"
+                                                    is_selected = st.checkbox(
+                                                        "", key=file_key, value=doc['document_id'] in selection,
+                                                        help="Seleziona per gestione"
+                                                    )
                                                     if is_selected:
-                                                        selected_files.append(file_info['name'])
+                                                        selection[doc['document_id']] = doc['source_file']
+                                                    else:
+                                                        selection.pop(doc['document_id'], None)
 
                                                 with col_name:
-                                                    file_icon = "📄" if file_info['type'] == 'PDF' else "📝" if file_info['type'] == 'Text' else "📎"
-                                                    st.write(f"{file_icon} **{file_info['name']}**")
-                                                    if len(file_info['name']) > 30:
-                                                        st.caption(file_info['name'])
+                                                    file_icon = "📄" if doc['type'] == 'PDF' else "📝" if doc['type'] == 'Text' else "📎"
+                                                    st.write(f"{file_icon} **{doc['name']}**")
+                                                    if doc['source_file'] != doc['name']:
+                                                        st.caption(f"Parte di {doc['source_file']}")
 
                                                 with col_type:
                                                     # Badge tipo file colorato
@@ -500,48 +561,87 @@ if st.session_state.get("api_key"):
                                                         'Word': '🔵',
                                                         'Text': '🟢',
                                                         'Markdown': '🟣'
-                                                    }.get(file_info['type'], '⚪')
-                                                    st.write(f"{type_color} {file_info['type']}")
+                                                    }.get(doc['type'], '⚪')
+                                                    st.write(f"{type_color} {doc['type']}")
 
                                                 with col_size:
-                                                    st.write(f"📏 {file_info['size_estimate']}")
+                                                    st.write(f"📏 {doc['size_bytes'] / (1024 * 1024):.1f} MB")
 
                                                 with col_status:
-                                                    status_icon = "✅" if file_info.get('status') == 'active' else "⚠️"
+                                                    status_icon = "✅" if doc['status'] == 'active' else "⏳" if doc['status'] == 'pending' else "⚠️"
                                                     st.write(f"{status_icon}")
 
+                                            # Navigazione tra le pagine con i page token del server
+                                            col_prev, col_page, col_next = st.columns([1, 2, 1])
+                                            with col_prev:
+                                                if st.button("◀ Precedente", disabled=page_index == 0,
+                                                             key=f"explorer_prev_{selected_store_id}", use_container_width=True):
+                                                    explorer["page"] = page_index - 1
+                                                    st.rerun()
+                                            with col_page:
+                                                st.caption(f"Pagina {page_index + 1}")
+                                            with col_next:
+                                                if st.button("Successiva ▶", disabled=not next_page_token,
+                                                             key=f"explorer_next_{selected_store_id}", use_container_width=True):
+                                                    explorer["tokens"] = explorer["tokens"][:page_index + 1] + [next_page_token]
+                                                    explorer["page"] = page_index + 1
+                                                    st.rerun()
+
+                                            selected_files = sorted(set(selection.values()))
+
                                             # Azioni sui file selezionati
                                             if selected_files:
                                                 st.markdown("#### 🛠️ **Azioni su File Selezionati**")
                                                 st.warning(f"⚠️ **{len(selected_files)} file selezionati** - Pronto per gestione avanzata")
 
+                                                rebuild_store = st.checkbox(
+                                                    "🏗️ Ricostruisci in un nuovo store (reimporta gli altri file dalle copie locali)",
+                                                    key=f"rebuild_store_{selected_store_id}",
+                                                    help="Di norma vengono eliminati solo i documenti selezionati, lasciando intatto il resto dello store"
+                                                )
+
                                                 col_action1, col_action2, col_action3 = st.columns(3)
                                                 with col_action1:
-                                                    if st.button("🔄 Ricrea Indice SENZA questi File", type="secondary", use_container_width=True):
-                                                        with st.spinner("🔄 Analisi e preparazione ricostruzione store..."):
-                                                            # Usa la nuova funzione per ricreazione selettiva
+                                                    if st.button("🗑️ Rimuovi questi File dallo Store", type="secondary", use_container_width=True):
+                                                        if rebuild_store:
+                                                            with st.spinner("🏗️ Ricostruzione store dalle copie locali..."):
+                                                                recreate_result = monitor.recreate_store_without_files(
+                                                                    selected_store_id, selected_files, rebuild=True
+                                                                )
+                                                        else:
+                                                            # Eliminazione in parallelo dei soli documenti selezionati
+                                                            removal_bar = st.progress(0.0, text="🗑️ Rimozione documenti...")
+
+                                                            def _removal_progress(done, total, result):
+                                                                removal_bar.progress(done / total, text=f"🗑️ {done}/{total} · {result['name']}")
+
                                                             recreate_result = monitor.recreate_store_without_files(
-                                                                selected_store_id, selected_files
+                                                                selected_store_id, selected_files, on_progress=_removal_progress
                                                             )
+                                                            removal_bar.empty()
 
-                                                            if recreate_result.get("success"):
-                                                                st.success(f"✅ **Store ricostruito con successo!**")
-                                                                st.json({
-                                                                    "File Originali": recreate_result["original_files"],
-                                                                    "File Mantenuti": recreate_result["kept_files"],
-                                                                    "File Rimossi": recreate_result["removed_files"],
-                                                                    "Nuovo Store ID": recreate_result["new_store_id"]
-                                                                })
-
-                                                                # Pulisci cache e aggiorna
-                                                                if session_key in st.session_state:
-                                                                    del st.session_state[session_key]
-                                                                _invalidate_all_vector_stores()
-                                                                time.sleep(2)
-                                                                st.rerun()
+                                                        if recreate_result.get("success"):
+                                                            if recreate_result["mode"] == "rebuild":
+                                                                st.success("✅ **Store ricostruito con successo!**")
                                                             else:
-                                                                st.error(f"❌ **Errore nella ricostruzione:** {recreate_result.get('error', 'Errore sconosciuto')}")
-                                                                st.info("💡 Per la rimozione completa di file, potresti dover ricaricare i documenti localmente")
+                                                                st.success(f"✅ **{recreate_result['message']}**")
+                                                            st.json({
+                                                                "Documenti Originali": recreate_result["original_files"],
+                                                                "Documenti Mantenuti": recreate_result["kept_files"],
+                                                                "Documenti Rimossi": recreate_result["removed_files"],
+                                                                "Store ID": recreate_result.get("new_store_id", recreate_result["store_id"])
+                                                            })
+
+                                                            # Pulisci selezione e cache, poi aggiorna
+                                                            st.session_state.pop(session_key, None)
+                                                            st.session_state.pop(selection_key, None)
+                                                            _invalidate_all_vector_stores()
+                                                            time.sleep(2)
+                                                            st.rerun()
+                                                        else:
+                                                            st.error(f"❌ **Errore nella rimozione:** {recreate_result.get('error', 'Errore sconosciuto')}")
+                                                            for failure in recreate_result.get("failed_files", [])[:5]:
+                                                                st.write(f"• {failure['name']}: {failure['error']}")
 
                                                 with col_action2:
                                                     if st.button("📥 Analisi Dettagliata", use_container_width=True):
@@ -554,9 +654,9 @@ if st.session_state.get("api_key"):
                                                                 with col_an1:
                                                                     st.metric("📄 File Totali", analysis["total_files"])
                                                                 with col_an2:
-                                                                    st.metric("💾 Spazio Totale", f"~{analysis['total_size_estimate_mb']} MB")
+                                                                    st.metric("💾 Spazio Totale", f"{analysis['total_size_mb']} MB")
                                                                 with col_an3:
-                                                                    st.metric("📏 Dim. Media", f"~{analysis['average_file_size_mb']} MB")
+                                                                    st.metric("📏 Dim. Media", f"{analysis['average_file_size_mb']} MB")
 
                                                                 # Tipi file
                                                                 if analysis["file_types"]:
@@ -574,10 +674,9 @@ if st.session_state.get("api_key"):
 
                                                 with col_action3:
                                                     if st.button("❌ Deseleziona Tutto", use_container_width=True):
-                                                        for i in range(len(files_details["files"])):
-                                                            file_key = f"select_file_{selected_store_id}_{i}"
-                                                            if file_key in st.session_state:
-                                                                st.session_state[file_key] = False
+                                                        selection.clear()
+                                                        for file_key in [k for k in st.session_state if k.startswith(checkbox_prefix)]:
+                                                            st.session_state.pop(file_key, None)
                                                         st.rerun()
 
                                                 # Sezione ottimizzazione store
@@ -594,8 +693,8 @@ if st.session_state.get("api_key"):
 
                                                                 # Mostra potenziale risparmio
                                                                 if suggestions["potential_savings"] > 0:
-                                                                    st.info(f"💰 **Risparmio potenziale:** ~{suggestions['potential_savings']:.1f} MB")
-                                                                    st.write(f"📉 **Dimensione stimata dopo ottimizzazione:** ~{suggestions['estimated_new_size']:.1f} MB")
+                                                                    st.info(f"💰 **Risparmio potenziale:** {suggestions['potential_savings']:.1f} MB")
+                                                                    st.write(f"📉 **Dimensione dopo ottimizzazione:** {suggestions['estimated_new_size']:.1f} MB")
 
                                                                 # Lista azioni consigliate
                                                                 for i, action in enumerate(suggestions["actions"]):
@@ -613,21 +712,21 @@ if st.session_state.get("api_key"):
                                                 with col_debug1:
                                                     st.json({
                                                         "store_id": selected_store_id,
-                                                        "store_name": files_details.get("store_name"),
-                                                        "total_files": files_details.get("total_files"),
-                                                        "api_file_count": files_details.get("file_count_from_api"),
-                                                        "extracted_files": len(files_details.get("files", [])),
+                                                        "page": page_index + 1,
+                                                        "page_size": document_browser.DOCUMENT_PAGE_SIZE,
+                                                        "page_token": explorer["tokens"][page_index],
+                                                        "next_page_token": next_page_token,
+                                                        "documents_in_page": len(documents),
                                                         "success": files_details.get("success")
                                                     })
                                                 with col_debug2:
                                                     st.json({
                                                         "is_quadernino": selected_store["is_quadernino"],
                                                         "created_time": selected_store.get("created_time", "unknown"),
-                                                        "store_size_mb": selected_store.get("size_estimate_mb", 0),
-                                                        "file_count_discrepancy": (
-                                                            files_details.get("file_count_from_api", 0) -
-                                                            len(files_details.get("files", []))
-                                                        )
+                                                        "store_size_mb": selected_store.get("size_mb", 0),
+                                                        "size_source": selected_store.get("size_source", "none"),
+                                                        "api_file_count": selected_store["file_count"],
+                                                        "selected_documents": len(selection)
                                                     })
 
                                         else:
@@ -637,8 +736,7 @@ if st.session_state.get("api_key"):
 
                                         # Opzione di retry
                                         if st.button("🔄 Riprova Esplorazione", type="secondary"):
-                                            if session_key in st.session_state:
-                                                del st.session_state[session_key]
+                                            document_browser.invalidate(selected_store_id)
                                             st.rerun()
 
                             else:
@@ -649,46 +747,43 @@ if st.session_state.get("api_key"):
                             if cleanup_info.get("count", 0) > 0:
                                 st.markdown("### 🧽 **Cleanup Automatico**")
                                 st.write(f"🗑️ **{cleanup_info['count']}** store non Quadernino trovati")
-                                st.write(f"💰 Risparmio potenziale: **~{cleanup_info['potential_savings_mb']} MB**")
+                                st.write(f"💰 Spazio liberabile: **{cleanup_info['potential_savings_mb']} MB**")
 
                                 if st.button("🧽 Esegui Cleanup Automatico", type="secondary"):
-                                    # Esegui cleanup automatico effettivo
-                                    with st.spinner("🧹 Pulizia store non Quadernino in corso..."):
-                                        deleted_count = 0
-                                        errors = []
-
-                                        all_stores = monitor.get_all_stores_detailed()
-                                        non_quad_stores = [s for s in all_stores.get("stores", []) if not s["is_quadernino"]]
-
-                                        for store in non_quad_stores:
-                                            try:
-                                                result = monitor.delete_store(store["store_id"], force=True)
-                                                if result.get("success"):
-                                                    deleted_count += 1
-                                                    log_info(f"Store non quadernino eliminato: {store['name']}")
-                                                else:
-                                                    errors.append(f"{store['name']}: {result.get('error', 'Errore')}")
-                                            except Exception as e:
-                                                errors.append(f"{store['name']}: {str(e)}")
-
-                                        # Mostra risultati
-                                        if deleted_count > 0:
-                                            st.success(f"✅ Eliminati {deleted_count} store non Quadernino!")
-                                            if errors:
-                                                st.warning(f"Attenzione: {len(errors)} errori durante il cleanup:")
-                                                for error in errors[:5]:  # Mostra primi 5 errori
-                                                    st.write(f"• {error}")
-                                        else:
-                                            st.error("❌ Nessuno store eliminato")
-                                            if errors:
-                                                st.error("Errori riscontrati:")
-                                                for error in errors:
-                                                    st.write(f"• {error}")
-
-                                        # Invalida session store per forzare ricaricamento
-                                        _invalidate_all_vector_stores()
-                                        time.sleep(2)
-                                        st.rerun()
+                                    # Eliminazione in parallelo: la barra avanza a ogni store completato
+                                    store_labels = {s["store_id"]: s["name"] for s in cleanup_info["old_stores"]}
+                                    progress_bar = st.progress(0.0, text="🧹 Pulizia store non Quadernino in corso...")
+
+                                    def _cleanup_progress(done, total, result):
+                                        label = store_labels.get(result.get("store_id"), result.get("store_id"))
+                                        status = "eliminato" if result.get("success") else "errore"
+                                        progress_bar.progress(done / total, text=f"🧹 {done}/{total} · {label}: {status}")
+
+                                    report = monitor.cleanup_non_quadernino_stores(on_progress=_cleanup_progress)
+                                    progress_bar.empty()
+
+                                    deleted_count = len(report["deleted"])
+                                    errors = report["errors"]
+
+                                    # Mostra risultati
+                                    if deleted_count > 0:
+                                        st.success(f"✅ Eliminati {deleted_count}/{report['requested']} store non Quadernino "
+                                                   f"in {report['elapsed_s']}s!")
+                                        if errors:
+                                            st.warning(f"Attenzione: {len(errors)} errori durante il cleanup:")
+                                            for error in errors[:5]:  # Mostra primi 5 errori
+                                                st.write(f"• {error}")
+                                    else:
+                                        st.error("❌ Nessuno store eliminato")
+                                        if errors:
+                                            st.error("Errori riscontrati:")
+                                            for error in errors:
+                                                st.write(f"• {error}")
+
+                                    # Invalida session store per forzare ricaricamento
+                                    _invalidate_all_vector_stores()
+                                    time.sleep(2)
+                                    st.rerun()
                 else:
                     st.warning("⚠️ Impossibile caricare le statistiche File Search")
 
@@ -717,15 +812,55 @@ if st.session_state.get("api_key"):
                         </div>
                         """, unsafe_allow_html=True)
 
-                        # Limiti API
+                        # Limiti API e margine rispetto al picco reale dell'ultima ora
+                        api_limits = usage_info["api_limits"]
                         col_a, col_b = st.columns(2)
                         with col_a:
-                            st.metric("🚀 Limite Richieste/min", usage_info["api_limits"]["rpm_limit"])
+                            st.metric("🚀 Limite Richieste/min", api_limits["rpm_limit"],
+                                      delta=f"picco {api_limits['peak_rpm']} · margine {api_limits['rpm_headroom']}",
+                                      delta_color="off")
                         with col_b:
-                            st.metric("📝 Limite Token/min", f"{usage_info['api_limits']['tpm_limit']:,}")
-
-                        # Costi stimati
-                        st.caption(f"💰 **Costo mensile stimato:** ${usage_info['costs']['estimated_monthly_cost']}")
+                            st.metric("📝 Limite Token/min", f"{api_limits['tpm_limit']:,}",
+                                      delta=f"picco {api_limits['peak_tpm']:,} · margine {api_limits['tpm_headroom']:,}",
+                                      delta_color="off")
+
+                        # Utilizzo reale registrato (usage_ledger)
+                        st.caption(f"📊 **Oggi:** {api_limits['requests_today']} richieste · "
+                                   f"{api_limits['tokens_today']:,} token · ${usage_info['costs']['cost_today']} "
+                                   f"(media ultimi {monitor.USAGE_TREND_DAYS} giorni: {api_limits['daily_requests_avg']} "
+                                   f"richieste/giorno)")
+
+                        # Stato del rate limiter condiviso (capacità residua e richieste in coda)
+                        limiter_status = rate_limiter.get_status().get(rate_limiter.model_limits_key(selected_model))
+                        if limiter_status:
+                            fill_pct = int(limiter_status["fill_level"] * 100)
+                            st.progress(fill_pct / 100, text=f"🚦 Capacità disponibile: {fill_pct}%")
+                            st.caption(f"⏳ In coda: {limiter_status['queue_depth']} richieste · "
+                                       f"attesa media {limiter_status['avg_wait_s']}s "
+                                       f"su {limiter_status['total_calls']} chiamate")
+
+                        # Costi dai token reali
+                        st.caption(f"💰 **Ultimi 30 giorni:** ${usage_info['costs']['cost_last_30_days']} · "
+                                   f"**Proiezione mensile:** ${usage_info['costs']['estimated_monthly_cost']}")
+
+                        usage_history = usage_info.get("usage", {})
+                        if usage_history.get("by_day"):
+                            with st.expander("📅 Utilizzo per giorno e per quadernino", expanded=False):
+                                st.bar_chart(usage_history["by_day"], x="day", y="total_tokens",
+                                             x_label="Giorno", y_label="Token")
+                                st.dataframe(
+                                    [
+                                        {
+                                            "Quadernino": n["notebook"],
+                                            "Richieste": n["requests"],
+                                            "Token": n["total_tokens"],
+                                            "Costo ($)": round(n["cost"], 4)
+                                        }
+                                        for n in usage_history["by_notebook"]
+                                    ],
+                                    hide_index=True,
+                                    use_container_width=True
+                                )
 
                         # Health status
                         health = usage_info.get("health_status", {})
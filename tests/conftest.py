@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# I test importano i moduli come fa l'app: `from utils import ...` dalla radice del progetto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    """I file di stato (journal, manifest, cache) vengono scritti in una cartella temporanea."""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_registries(monkeypatch):
+    """Circuit breaker e inventari degli store non passano da un test all'altro."""
+    from utils import resilience, store_inventory
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(store_inventory, "_inventories", {})
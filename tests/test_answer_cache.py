@@ -0,0 +1,31 @@
+import json
+import time
+
+from utils import answer_cache
+
+
+def test_cached_answer_keeps_citations_separate():
+    sources = [{"source": "cap1.pdf", "pages": [3], "chunks": 2, "snippet": "..."}]
+    key = answer_cache.make_key("fileSearchStores/a", "v1", "gemini", "istruzioni", "Chi era Dante?")
+    assert answer_cache.put(key, "fileSearchStores/a", "Un poeta.", sources)
+
+    cached = answer_cache.get(answer_cache.make_key("fileSearchStores/a", "v1", "gemini", "istruzioni", "chi era dante"))
+    assert cached == {"answer": "Un poeta.", "citations": sources}
+
+
+def test_entries_without_citations_are_ignored():
+    key = answer_cache.make_key("fileSearchStores/a", "v1", "gemini", "istruzioni", "domanda")
+    # Voce scritta prima che le citazioni fossero salvate a parte (fonti nel testo)
+    now = time.time()
+    answer_cache.CACHE_FILE.write_text(json.dumps({key: {
+        "store_name": "fileSearchStores/a", "answer": "Risposta\n\n---\n📚 Fonti: **a.pdf**",
+        "size": 10, "created_at": now, "last_access": now, "hits": 0
+    }}), encoding="utf-8")
+    assert answer_cache.get(key) is None
+
+
+def test_invalidate_store_drops_its_answers():
+    key = answer_cache.make_key("fileSearchStores/a", "v1", "gemini", "istruzioni", "domanda")
+    answer_cache.put(key, "fileSearchStores/a", "Risposta", [])
+    assert answer_cache.invalidate_store("fileSearchStores/a") == 1
+    assert answer_cache.get(key) is None
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import batch_qa, gemini_handler
+
+
+def test_text_prompts_skip_blank_lines_and_duplicates():
+    data = "Chi era Dante?\n\n   \n  Chi era Dante?  \r\nDove nacque?\n".encode("utf-8")
+    assert batch_qa.parse_prompts(data, "domande.txt") == ["Chi era Dante?", "Dove nacque?"]
+
+
+def test_csv_prompts_use_the_known_column_and_skip_short_rows():
+    data = ('\ufeffid,Domanda\n1,Chi era Dante?\n2\n3,"Una domanda, con virgola"\n4,Chi era Dante?\n,\n'
+            ).encode("utf-8")
+    assert batch_qa.parse_prompts(data, "domande.CSV") == ["Chi era Dante?", "Una domanda, con virgola"]
+
+
+def test_csv_without_known_header_uses_the_first_column():
+    data = b'Chi era Dante?,nota\n"Riga ""citata""",x\n"virgolette non chiuse\n'
+    assert batch_qa.parse_prompts(data, "domande.csv") == [
+        "Chi era Dante?", 'Riga "citata"', "virgolette non chiuse"
+    ]
+    assert batch_qa.parse_prompts(b"", "vuoto.csv") == []
+    # Byte non UTF-8: la domanda resta, con il carattere sostituito
+    assert batch_qa.parse_prompts(b"Citt\xe0?\n", "domande.txt") == ["Citt�?"]
+
+
+def test_truncated_lines_and_repeated_ids_keep_the_last_result():
+    qid = batch_qa.question_id("Chi?")
+    batch_qa.append_result("run", {"index": 0, "question_id": qid, "prompt": "Chi?", "error": "HTTP 503"})
+    batch_qa.append_result("run", {"index": 0, "question_id": qid, "prompt": "Chi?", "answer": "Dante", "error": None})
+    with open(batch_qa.BATCH_DIR / "run.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"index": 1, "question_id": "tronc')
+
+    results = batch_qa.load_results("run")
+
+    assert [(r["question_id"], r["answer"]) for r in results] == [(qid, "Dante")]
+    assert batch_qa.completed_ids("run") == {qid}
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(gemini_handler, "get_client", lambda api_key: SimpleNamespace())
+    return gemini_handler.GeminiHandler("chiave", "gemini-2.5-flash")
+
+
+def test_resume_skips_questions_already_answered(handler, monkeypatch):
+    prompts = ["Chi?", "Dove?", "Quando?"]
+    batch_qa.append_result("run", {"index": 0, "question_id": batch_qa.question_id("Chi?"), "answer": "Dante"})
+    batch_qa.append_result("run", {"index": 1, "question_id": batch_qa.question_id("Dove?"), "error": "HTTP 503"})
+    asked = []
+    monkeypatch.setattr(handler, "answer_question",
+                        lambda prompt, store, metadata_filter=None: asked.append(prompt) or {"answer": prompt})
+
+    records = list(handler.run_batch(prompts, "fileSearchStores/a", "run"))
+
+    # Le domande fallite vengono ripetute, quelle riuscite no
+    assert sorted(asked) == ["Dove?", "Quando?"]
+    assert sorted(r["index"] for r in records) == [1, 2]
+    assert batch_qa.completed_ids("run") == {batch_qa.question_id(p) for p in prompts}
+    assert list(handler.run_batch(prompts, "fileSearchStores/a", "run")) == []
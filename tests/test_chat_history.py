@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from utils import chat_history, rate_limiter
+
+
+class _FakeModels:
+    def generate_content(self, model, contents, config):
+        return SimpleNamespace(text="Riassunto.", usage_metadata=SimpleNamespace(total_token_count=42))
+
+
+def test_summary_settles_rate_limiter_with_real_usage(monkeypatch):
+    settled = []
+    monkeypatch.setattr(rate_limiter, "settle_model", lambda *args: settled.append(args))
+    client = SimpleNamespace(models=_FakeModels())
+    older = [{"role": "user", "content": "Chi era Dante?"}, {"role": "assistant", "content": "Un poeta."}]
+
+    assert chat_history._summarize(client, "gemini-2.5-flash", older) == "Riassunto."
+    assert len(settled) == 1
+    model_name, estimated, actual = settled[0]
+    assert model_name == "gemini-2.5-flash"
+    assert estimated > chat_history.SUMMARY_MAX_OUTPUT_TOKENS
+    assert actual == 42
+
+
+def _client(counts, summary="Riassunto."):
+    """Client finto: count_tokens restituisce i valori di `counts` nell'ordine."""
+    def _count_tokens(model, contents):
+        return SimpleNamespace(total_tokens=counts.pop(0))
+
+    def _generate_content(model, contents, config):
+        return SimpleNamespace(text=summary, usage_metadata=None)
+
+    return SimpleNamespace(models=SimpleNamespace(count_tokens=_count_tokens, generate_content=_generate_content))
+
+
+def _turns(*roles, size=400):
+    return [{"role": role, "content": f"{role} {i} " + "x" * size} for i, role in enumerate(roles)]
+
+
+def test_dropped_turns_are_scaled_to_the_exact_count_and_recounted():
+    history = _turns("user", "assistant", "user", "assistant")
+    estimated = chat_history._estimate_contents([chat_history._to_content(m) for m in history])
+    budget = int(estimated / chat_history.RECENT_SHARE) + 4
+    # Il conteggio esatto supera il budget: il primo turno utente e la risposta che lo
+    # segue vengono scartati, poi il conteggio viene ripetuto
+    counts = [budget + 50, 150]
+    contents, info = chat_history.build_contents(_client(counts), "gemini-2.5-flash", "Domanda?", history,
+                                                 token_budget=budget)
+
+    assert counts == []
+    assert info["history_tokens"] == 150
+    assert info["dropped"] == 2 and info["recent"] == 2
+    assert [c.role for c in contents] == ["user", "model", "user"]
+
+
+def test_leading_model_turn_is_dropped_after_the_summary_pair(monkeypatch):
+    monkeypatch.setattr(chat_history, "COMPACTION_STEP", 1)
+    history = _turns("user", "assistant", "user", "assistant", "user", "assistant")
+    # Quota recente: entrano solo gli ultimi tre messaggi, il primo dei quali è del modello
+    budget = int((chat_history.estimate_tokens(history[-1]["content"]) * 3 + 1) / chat_history.RECENT_SHARE)
+    contents, info = chat_history.build_contents(_client([]), "gemini-2.5-flash", "Domanda?", history,
+                                                 token_budget=budget)
+
+    assert info["summarized"] == 3
+    assert info["dropped"] == 1 and info["recent"] == 2
+    roles = [c.role for c in contents]
+    assert roles == ["user", "model", "user", "model", "user"]
+    assert contents[0].parts[0].text.endswith("Riassunto.")
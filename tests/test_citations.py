@@ -0,0 +1,77 @@
+from google.genai import types
+
+from utils import citations
+
+
+def _chunk(title=None, page=None, text=None, **metadata):
+    custom = [types.GroundingChunkCustomMetadata(key=key, string_value=value) for key, value in metadata.items()]
+    return types.GroundingChunk(retrieved_context=types.GroundingChunkRetrievedContext(
+        title=title, page_number=page, text=text, custom_metadata=custom or None
+    ))
+
+
+def _grounding(chunks, supports=()):
+    return types.GroundingMetadata(
+        grounding_chunks=chunks,
+        grounding_supports=[types.GroundingSupport(grounding_chunk_indices=list(indices)) for indices in supports]
+    )
+
+
+def test_chunks_are_grouped_by_source_with_sorted_pages():
+    grounding = _grounding([
+        _chunk("a.pdf", page=7, text="Primo   estratto\ndi a"),
+        _chunk("b.md", text="Estratto di b"),
+        _chunk("a.pdf", page=3, text="Secondo estratto di a"),
+        _chunk("a.pdf", page=7),
+    ], supports=[[1], [0, 2]])
+
+    result = citations.extract_citations([grounding])
+
+    # Le fonti citate dai segmenti della risposta vengono prima, nel loro ordine
+    assert [c["source"] for c in result] == ["b.md", "a.pdf"]
+    assert result[1] == {"source": "a.pdf", "pages": [3, 7], "chunks": 3, "snippet": "Primo estratto di a"}
+    assert citations.format_footer(result) == "\n\n---\n📚 Fonti: **b.md** · **a.pdf** (p. 3, 7)"
+
+
+def test_streaming_chunks_are_deduplicated_across_groundings():
+    first = _grounding([_chunk("a.pdf", page=1)])
+    second = _grounding([_chunk("a.pdf", page=1), _chunk("b.md")])
+
+    result = citations.extract_citations([first, second])
+
+    assert [(c["source"], c["pages"], c["chunks"]) for c in result] == [("a.pdf", [1], 2), ("b.md", [], 1)]
+
+
+def test_chunks_without_retrieved_context_are_skipped():
+    grounding = _grounding([
+        types.GroundingChunk(web=types.GroundingChunkWeb(uri="https://example.com")),
+        _chunk("a.pdf"),
+    ], supports=[[0, 1]])
+
+    assert [c["source"] for c in citations.extract_citations([grounding])] == ["a.pdf"]
+    assert citations.extract_citations([types.GroundingMetadata()]) == []
+
+
+def test_split_parts_cite_the_parent_file_without_part_pages():
+    grounding = _grounding([
+        _chunk("manuale_part2.pdf", page=4, parent_file="manuale.pdf", file_name="manuale_part2.pdf"),
+        _chunk("capitolo_7.pdf", page=2, file_name="capitolo.pdf"),
+    ])
+
+    result = citations.extract_citations([grounding])
+
+    assert [(c["source"], c["pages"]) for c in result] == [("manuale.pdf", []), ("capitolo.pdf", [])]
+
+
+def test_resolve_source_is_used_only_without_custom_metadata():
+    grounding = _grounding([_chunk("documents/abc"), _chunk("documents/xyz", file_name="b.md")])
+    resolved = []
+
+    def _resolve(title):
+        resolved.append(title)
+        return {"documents/abc": "a.pdf"}.get(title)
+
+    result = citations.extract_citations([grounding], resolve_source=_resolve)
+
+    assert [c["source"] for c in result] == ["a.pdf", "b.md"]
+    assert resolved == ["documents/abc"]
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import batch_qa, gemini_handler, resilience
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(gemini_handler, "get_client", lambda api_key: SimpleNamespace())
+    return gemini_handler.GeminiHandler("chiave", "gemini-2.5-flash")
+
+
+def test_import_runs_within_the_indexing_deadline(handler, monkeypatch):
+    seen = []
+    monkeypatch.setattr(handler, "_import_files",
+                        lambda store, chapter, paths, summary: seen.append(resilience.remaining()) or summary)
+
+    handler.import_files_to_store("fileSearchStores/a", "Storia", ["a.md"])
+
+    assert seen and 0 < seen[0] <= gemini_handler.INDEXING_TIMEOUT
+    assert resilience.current_deadline() is None
+
+
+def test_batch_workers_share_the_run_deadline(handler, monkeypatch):
+    seen = []
+
+    def _answer(prompt, vector_store_name, metadata_filter=None):
+        seen.append(resilience.remaining())
+        return {"answer": "ok"}
+
+    monkeypatch.setattr(handler, "answer_question", _answer)
+    records = list(handler.run_batch(["Chi?", "Dove?"], "fileSearchStores/a", "run1"))
+
+    assert len(records) == 2 and len(seen) == 2
+    assert all(0 < left <= gemini_handler.BATCH_TIMEOUT for left in seen)
+    # Il generatore non lascia la scadenza attiva nel thread del chiamante
+    assert resilience.current_deadline() is None
+    assert batch_qa.completed_ids("run1") == {batch_qa.question_id("Chi?"), batch_qa.question_id("Dove?")}
@@ -0,0 +1,21 @@
+import json
+
+from utils import doc_splitter, hash_manifest
+
+
+def test_existing_parts_reused_only_with_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_splitter, "TEXT_PART_BYTES", 100)
+    source = tmp_path / "manuale.txt"
+    source.write_text("\n\n".join("riga di testo " * 10 for _ in range(6)), encoding="utf-8")
+    sha256 = hash_manifest.compute_file_hash(source)
+
+    parts = doc_splitter.split_document(str(source), sha256)
+    assert len(parts) > 1
+    assert all(part["sha256"] for part in parts)
+    assert doc_splitter.split_document(str(source), sha256) == parts
+
+    # Indice scritto da una versione precedente, senza hash delle parti: si rigenera
+    index_path = doc_splitter.SPLIT_DIR / sha256[:16] / doc_splitter.PARTS_INDEX
+    legacy = [{k: v for k, v in part.items() if k != "sha256"} for part in parts]
+    index_path.write_text(json.dumps(legacy), encoding="utf-8")
+    assert doc_splitter.split_document(str(source), sha256) == parts
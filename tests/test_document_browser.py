@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+from google.genai import pagers, types
+
+from utils import document_browser
+
+
+def _document(index):
+    return types.Document(
+        name=f"fileSearchStores/a/documents/doc{index}",
+        display_name=f"doc{index}.pdf",
+        state=types.DocumentState.STATE_ACTIVE,
+        size_bytes=100,
+        custom_metadata=[types.CustomMetadata(key="content_sha256", string_value=f"sha{index}")]
+    )
+
+
+class FakeDocuments:
+    """documents.list finto con pager dell'SDK: il token della pagina successiva è in pager.config."""
+
+    def __init__(self, total):
+        self.documents = [_document(i) for i in range(total)]
+        self.requests = []
+
+    def list(self, parent, config):
+        self.requests.append(dict(config))
+        start = int(config.get('page_token') or 0)
+        end = start + config['page_size']
+        response = SimpleNamespace(documents=self.documents[start:end],
+                                   next_page_token=str(end) if end < len(self.documents) else None)
+        return pagers.Pager('documents', lambda config: None, response, config)
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    monkeypatch.setattr(document_browser, "_pages", {})
+    fake = FakeDocuments(5)
+    client = SimpleNamespace(file_search_stores=SimpleNamespace(documents=fake))
+    monkeypatch.setattr(document_browser, "get_client", lambda api_key: client)
+    return fake
+
+
+def test_pages_follow_the_server_page_token(documents):
+    first = document_browser.fetch_page("chiave", "fileSearchStores/a", page_size=2)
+    second = document_browser.fetch_page("chiave", "fileSearchStores/a", first["next_page_token"], page_size=2)
+    last = document_browser.fetch_page("chiave", "fileSearchStores/a", "4", page_size=2)
+
+    assert [d["name"] for d in first["documents"]] == ["doc0.pdf", "doc1.pdf"]
+    assert first["next_page_token"] == "2"
+    assert [d["name"] for d in second["documents"]] == ["doc2.pdf", "doc3.pdf"]
+    assert last == {"documents": [document_browser.document_info(documents.documents[4])], "next_page_token": None}
+    assert documents.requests[1] == {"page_size": 2, "page_token": "2"}
+
+
+def test_document_info_reads_state_and_metadata(documents):
+    info = document_browser.fetch_page("chiave", "fileSearchStores/a", page_size=1)["documents"][0]
+
+    assert info["status"] == "active"
+    assert info["content_sha256"] == "sha0"
+    assert info["source_file"] == "doc0.pdf"
+    assert info["document_id"] == "fileSearchStores/a/documents/doc0"
+
+
+def test_iter_documents_reads_every_page_once(documents):
+    names = [d["name"] for d in document_browser.iter_documents("chiave", "fileSearchStores/a", page_size=2)]
+
+    assert names == [f"doc{i}.pdf" for i in range(5)]
+    assert len(documents.requests) == 3
+
+    # Le pagine restano in cache finché lo store non viene invalidato
+    list(document_browser.iter_documents("chiave", "fileSearchStores/a", page_size=2))
+    assert len(documents.requests) == 3
+    document_browser.invalidate("fileSearchStores/a")
+    list(document_browser.iter_documents("chiave", "fileSearchStores/a", page_size=2))
+    assert len(documents.requests) == 6
+
+
+def test_cached_pages_expire_after_the_ttl(documents, monkeypatch):
+    document_browser.fetch_page("chiave", "fileSearchStores/a", page_size=2)
+    monkeypatch.setattr(document_browser, "PAGE_CACHE_TTL_SECONDS", 0)
+    document_browser.fetch_page("chiave", "fileSearchStores/a", page_size=2)
+
+    assert len(documents.requests) == 2
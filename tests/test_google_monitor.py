@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import google_monitor, rate_limiter, resilience, store_inventory
+
+
+class FakeAPIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeStores:
+    """file_search_stores con eliminazione che può fallire per alcuni store."""
+
+    def __init__(self, names, failing=()):
+        self.stores = {name: SimpleNamespace(name=f"fileSearchStores/{i}", display_name=name, size_bytes=1024,
+                                             active_documents_count=1)
+                       for i, name in enumerate(names)}
+        self.failing = set(failing)
+        self.list_calls = 0
+
+    def list(self):
+        self.list_calls += 1
+        return list(self.stores.values())
+
+    def _find(self, store_id):
+        return next((k for k, s in self.stores.items() if s.name == store_id), None)
+
+    def get(self, name):
+        key = self._find(name)
+        if key is None:
+            raise FakeAPIError(404)
+        return self.stores[key]
+
+    def delete(self, name, config=None):
+        key = self._find(name)
+        if key is None:
+            raise FakeAPIError(404)
+        if key in self.failing:
+            raise FakeAPIError(403)
+        self.stores.pop(key, None)
+
+
+@pytest.fixture(autouse=True)
+def _no_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "acquire_management", lambda timeout=None: 0.0)
+    monkeypatch.setattr(resilience, "_backoff_delay", lambda attempt: 0.0)
+
+
+def _monitor(monkeypatch, stores):
+    client = SimpleNamespace(file_search_stores=stores)
+    monkeypatch.setattr(store_inventory, "get_client", lambda api_key: client)
+    monkeypatch.setattr(google_monitor, "get_client", lambda api_key: client)
+    return google_monitor.GoogleMonitor("chiave")
+
+
+def test_delete_stores_reports_partial_failure(monkeypatch):
+    stores = FakeStores(["a", "b", "c"], failing={"b"})
+    monitor = _monitor(monkeypatch, stores)
+    progress = []
+
+    report = monitor.delete_stores(["fileSearchStores/0", "fileSearchStores/1", "fileSearchStores/2"],
+                                   on_progress=lambda done, total, result: progress.append((done, total)))
+
+    assert sorted(report["deleted"]) == ["fileSearchStores/0", "fileSearchStores/2"]
+    assert [f["store_id"] for f in report["failed"]] == ["fileSearchStores/1"]
+    assert report["requested"] == 3
+    assert report["partial"] and not report["success"]
+    assert sorted(progress) == [(1, 3), (2, 3), (3, 3)]
+    assert list(stores.stores) == ["b"]
+
+
+def test_delete_store_already_gone_counts_as_deleted(monkeypatch):
+    monitor = _monitor(monkeypatch, FakeStores([]))
+    result = monitor.delete_store("fileSearchStores/99", force=True)
+    assert result["success"] and result["already_deleted"]
+
+
+def test_cleanup_removes_only_non_quadernino_stores(monkeypatch):
+    stores = FakeStores(["Quadernino - Storia", "vecchio test", "bozza"], failing={"bozza"})
+    monitor = _monitor(monkeypatch, stores)
+
+    report = monitor.cleanup_non_quadernino_stores()
+
+    assert report["deleted"] == ["fileSearchStores/1"]
+    assert report["errors"] and report["errors"][0].startswith("bozza: ")
+    assert sorted(stores.stores) == ["Quadernino - Storia", "bozza"]
+    # La fotografia condivisa non riporta più lo store eliminato
+    assert [s.display_name for s in monitor.inventory.stores()] == ["Quadernino - Storia", "bozza"]
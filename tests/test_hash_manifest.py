@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from utils import doc_splitter, hash_manifest
+
+
+def test_split_file_counted_once_in_storage_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_splitter, "TEXT_PART_BYTES", 100)
+    source = tmp_path / "manuale.txt"
+    source.write_text("\n\n".join("riga di testo " * 10 for _ in range(6)), encoding="utf-8")
+
+    parent_sha = hash_manifest.get_file_hash(source)
+    parts = doc_splitter.split_document(str(source), parent_sha)
+    assert len(parts) > 1
+    assert all(part["sha256"] for part in parts)
+
+    store = "fileSearchStores/a"
+    for part in parts:
+        hash_manifest.record_store_document(store, part["sha256"], source.name, parent_sha256=parent_sha)
+    hash_manifest.record_store_document(store, parent_sha, source.name)
+
+    summary = hash_manifest.get_storage_summary()
+    # Le parti non entrano nel manifest dei file locali
+    assert summary["files"] == {"manuale.txt": source.stat().st_size}
+    assert summary["stores"][store] == source.stat().st_size
+
+
+def test_expired_remote_only_files_are_hidden_and_purged():
+    future = (datetime.now(timezone.utc) + timedelta(hours=40)).isoformat()
+    past = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    hash_manifest.record_remote_file("sha-valido", "files/a", future)
+    hash_manifest.record_remote_file("sha-scaduto", "files/b", past)
+    hash_manifest.record_remote_only_file("valido.pdf", "sha-valido", 10)
+    hash_manifest.record_remote_only_file("scaduto.pdf", "sha-scaduto", 10)
+    hash_manifest.record_remote_only_file("senza_remoto.pdf", "sha-mai-caricato", 10)
+
+    assert list(hash_manifest.list_remote_only_files()) == ["valido.pdf"]
+    assert len(hash_manifest.list_remote_only_files(include_expired=True)) == 3
+    assert hash_manifest.list_expired_remote_only_files() == ["scaduto.pdf", "senza_remoto.pdf"]
+
+    assert sorted(hash_manifest.purge_expired_remote_only_files()) == ["scaduto.pdf", "senza_remoto.pdf"]
+    assert hash_manifest.list_expired_remote_only_files() == []
+    assert hash_manifest.get_local_file_entry("valido.pdf")
+
+
+def test_remote_only_file_expires_after_ttl_without_reported_expiry(monkeypatch):
+    hash_manifest.record_remote_file("sha", "files/a", None)
+    hash_manifest.record_remote_only_file("doc.pdf", "sha", 10)
+    assert list(hash_manifest.list_remote_only_files()) == ["doc.pdf"]
+
+    monkeypatch.setattr(hash_manifest, "REMOTE_FILE_TTL_HOURS", 0)
+    assert hash_manifest.list_remote_only_files() == {}
@@ -0,0 +1,33 @@
+from utils import index_journal
+
+
+def test_journal_records_file_progress():
+    assert index_journal.load_journal("Storia") is None
+    index_journal.start_journal("Storia", "fileSearchStores/a")
+    index_journal.update_file("Storia", "cap1.pdf", index_journal.FILE_UPLOADED, sha256="abc", remote_file="files/1")
+
+    journal = index_journal.get_incomplete_journal("Storia")
+    entry = index_journal.get_file_entry(journal, "cap1.pdf", "abc")
+    assert entry["state"] == index_journal.FILE_UPLOADED
+    assert entry["remote_file"] == "files/1"
+    # Contenuto cambiato: la voce non vale più
+    assert index_journal.get_file_entry(journal, "cap1.pdf", "def") is None
+
+
+def test_restart_on_same_store_keeps_entries():
+    index_journal.start_journal("Storia", "fileSearchStores/a")
+    index_journal.update_file("Storia", "cap1.pdf", index_journal.FILE_ACTIVE, sha256="abc")
+    index_journal.start_journal("Storia", "fileSearchStores/a")
+    assert "cap1.pdf" in index_journal.load_journal("Storia")["files"]
+
+    index_journal.start_journal("Storia", "fileSearchStores/b")
+    assert index_journal.load_journal("Storia")["files"] == {}
+
+
+def test_completed_journal_is_not_resumed():
+    index_journal.start_journal("Storia", "fileSearchStores/a")
+    index_journal.complete_journal("Storia")
+    assert index_journal.get_incomplete_journal("Storia") is None
+
+    assert index_journal.discard_journal("Storia")
+    assert index_journal.load_journal("Storia") is None
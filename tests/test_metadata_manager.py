@@ -0,0 +1,30 @@
+from utils import metadata_manager
+
+
+def test_no_scope_means_no_filter():
+    assert metadata_manager.build_metadata_filter("Storia") is None
+    assert metadata_manager.build_metadata_filter("Storia", tags=[], file_names=[]) is None
+
+
+def test_tags_without_files_give_an_empty_filter():
+    metadata_manager.update_file_tags("Storia", "a.pdf", ["roma"])
+    assert metadata_manager.build_metadata_filter("Storia", tags=["grecia"]) == ""
+
+
+def test_tagged_and_selected_files_are_combined_once():
+    metadata_manager.update_file_tags("Storia", "b.pdf", ["roma"])
+    metadata_manager.update_file_tags("Storia", "a.pdf", ["roma", "impero"])
+    metadata_manager.update_file_tags("Storia", "c.pdf", ["grecia"])
+
+    expression = metadata_manager.build_metadata_filter("Storia", tags=["roma"], file_names=["a.pdf", "d.md"])
+
+    assert expression == 'file_name = "a.pdf" OR file_name = "b.pdf" OR file_name = "d.md"'
+
+
+def test_quotes_backslashes_and_newlines_are_escaped():
+    names = ['citazione "famosa".pdf', 'C:\\appunti.md', 'riga\nnuova.txt']
+    expression = metadata_manager.build_metadata_filter("Storia", file_names=names)
+
+    assert expression == ('file_name = "C:\\\\appunti.md" OR '
+                          'file_name = "citazione \\"famosa\\".pdf" OR '
+                          'file_name = "riga\\nnuova.txt"')
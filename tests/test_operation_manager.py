@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import operation_manager
+from utils.operation_manager import OperationManager
+
+
+class FakeAPIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeClock:
+    """Orologio finto: sleep fa avanzare monotonic senza attendere."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(operation_manager, "time", clock)
+    return clock
+
+
+def _operations_get(timeline):
+    """operations.get finto: ogni operazione percorre la propria sequenza di stati."""
+    def _get(operation):
+        return timeline[operation.name].pop(0)
+    return _get
+
+
+def _op(name, done=False, error=None):
+    return SimpleNamespace(name=name, done=done, error=error)
+
+
+def test_done_and_failed_operations_are_reported_once(clock):
+    timeline = {
+        "a": [_op("a"), _op("a", done=True)],
+        "b": [_op("b", done=True, error={"message": "file non valido"})],
+    }
+    completed = []
+    manager = OperationManager(_operations_get(timeline), jitter=0)
+    manager.add("a", _op("a"))
+    manager.add("b", _op("b"))
+    manager.add("c", _op("c", done=True))
+
+    results = manager.wait_all(timeout=60, on_complete=lambda key, status, op, error: completed.append((key, status)))
+
+    assert completed == [("c", "done"), ("b", "failed"), ("a", "done")]
+    assert results["b"]["error"] == "{'message': 'file non valido'}"
+    assert results["a"]["error"] is None
+    assert manager.pending_count == 0
+
+
+def test_operations_still_pending_at_the_deadline_time_out(clock):
+    manager = OperationManager(lambda operation: operation, initial_delay=2, jitter=0)
+    manager.add("lenta", _op("lenta"))
+
+    results = manager.wait_all(timeout=10)
+
+    assert results["lenta"]["status"] == operation_manager.STATUS_TIMEOUT
+    assert clock.now == pytest.approx(10)
+
+
+def test_backoff_grows_up_to_the_cap(clock):
+    manager = OperationManager(lambda operation: operation, initial_delay=1, max_delay=4, multiplier=2, jitter=0)
+    manager.add("lenta", _op("lenta"))
+
+    manager.wait_all(timeout=30)
+
+    assert clock.sleeps[:5] == [1, 2, 4, 4, 4]
+    assert max(clock.sleeps) == 4
+
+
+def test_refresh_errors_fail_fast_only_when_not_retryable(clock):
+    def _get(operation):
+        raise FakeAPIError(503 if operation.name == "transitoria" else 404)
+
+    manager = OperationManager(_get, max_refresh_errors=3, jitter=0)
+    manager.add("transitoria", _op("transitoria"))
+    manager.add("inesistente", _op("inesistente"))
+
+    results = manager.wait_all(timeout=60)
+
+    assert results["inesistente"]["status"] == operation_manager.STATUS_FAILED
+    assert results["transitoria"]["status"] == operation_manager.STATUS_FAILED
+    assert results["transitoria"]["error"] == "HTTP 503"
+    # L'errore 404 chiude subito l'operazione, il 503 dopo tre tentativi
+    assert len(clock.sleeps) == 3
@@ -0,0 +1,38 @@
+import pytest
+
+from utils import rate_limiter
+
+
+def test_model_limits_key():
+    assert rate_limiter.model_limits_key("models/gemini-2.5-pro") == "gemini_2.5_pro"
+    assert rate_limiter.model_limits_key("gemini-2.5-flash-lite") == "gemini_2.5_flash"
+    assert rate_limiter.model_limits_key("sconosciuto") == rate_limiter.DEFAULT_LIMITS_KEY
+
+
+def test_acquire_within_capacity_does_not_wait():
+    limiter = rate_limiter.ModelLimiter("test", rpm_limit=5, tpm_limit=1000)
+    for _ in range(5):
+        assert limiter.acquire(tokens=100, timeout=0.5) < 0.1
+    assert limiter.status()["total_calls"] == 5
+
+
+def test_acquire_times_out_when_requests_are_exhausted():
+    limiter = rate_limiter.ModelLimiter("test", rpm_limit=1, tpm_limit=0)
+    limiter.acquire(timeout=0.5)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.1)
+    assert limiter.status()["queue_depth"] == 0
+
+
+def test_acquire_times_out_when_tokens_are_exhausted():
+    limiter = rate_limiter.ModelLimiter("test", rpm_limit=100, tpm_limit=1000)
+    limiter.acquire(tokens=1000, timeout=0.5)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(tokens=500, timeout=0.1)
+
+
+def test_settle_refunds_overestimated_tokens():
+    limiter = rate_limiter.ModelLimiter("test", rpm_limit=100, tpm_limit=1000)
+    limiter.acquire(tokens=1000, timeout=0.5)
+    limiter.settle(estimated_tokens=1000, actual_tokens=200)
+    assert limiter.acquire(tokens=500, timeout=0.5) < 0.1
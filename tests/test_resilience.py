@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+
+from utils import rate_limiter, resilience
+
+
+class FakeAPIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.fixture(autouse=True)
+def _no_limits(monkeypatch):
+    """Rate limiter senza attese e backoff immediato."""
+    monkeypatch.setattr(rate_limiter, "acquire_management", lambda timeout=None: 0.0)
+    monkeypatch.setattr(rate_limiter, "acquire_model", lambda model_name, tokens=0, timeout=None: 0.0)
+    monkeypatch.setattr(resilience, "_backoff_delay", lambda attempt: 0.0)
+
+
+def _open_breaker(endpoint):
+    breaker = resilience.get_breaker(endpoint)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_classify_error():
+    assert resilience.classify_error(FakeAPIError(429)) == resilience.ERROR_RETRYABLE
+    assert resilience.classify_error(FakeAPIError(503)) == resilience.ERROR_RETRYABLE
+    assert resilience.classify_error(FakeAPIError(404)) == resilience.ERROR_NOT_FOUND
+    assert resilience.classify_error(FakeAPIError(403)) == resilience.ERROR_PERMISSION
+    assert resilience.classify_error(FakeAPIError(400)) == resilience.ERROR_INVALID
+    assert resilience.classify_error(ValueError("x")) == resilience.ERROR_FATAL
+
+
+def test_call_retries_transient_errors():
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeAPIError(503)
+        return "ok"
+
+    assert resilience.call("test.retry", fn) == "ok"
+    assert len(attempts) == 3
+
+
+def test_call_does_not_retry_request_errors():
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise FakeAPIError(400)
+
+    with pytest.raises(FakeAPIError):
+        resilience.call("test.no_retry", fn)
+    assert len(attempts) == 1
+    assert resilience.get_breaker("test.no_retry").state == "closed"
+
+
+def test_retries_reserve_tokens_once(monkeypatch):
+    charged = []
+    monkeypatch.setattr(rate_limiter, "acquire_model",
+                        lambda model_name, tokens=0, timeout=None: charged.append(tokens) or 0.0)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeAPIError(503)
+        return "ok"
+
+    assert resilience.call("test.tokens", fn, model_name="gemini-2.5-flash", tokens=500) == "ok"
+    assert charged == [500, 0, 0]
+
+
+def test_request_error_in_half_open_trial_does_not_close_breaker():
+    breaker = _open_breaker("test.half_open_4xx")
+    breaker.reset_timeout = 0.0
+
+    def fn():
+        raise FakeAPIError(400)
+
+    with pytest.raises(FakeAPIError):
+        resilience.call("test.half_open_4xx", fn)
+    assert breaker.state == "half_open"
+    assert breaker._trial_running is False
+
+
+def test_breaker_opens_and_rejects():
+    breaker = _open_breaker("test.open")
+    assert breaker.state == "open"
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.call("test.open", lambda: "ok")
+
+
+def test_half_open_trial_closes_breaker_on_success():
+    breaker = _open_breaker("test.half_open")
+    breaker.reset_timeout = 0.0
+    assert breaker.state == "half_open"
+    assert resilience.call("test.half_open", lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_rate_limit_timeout_releases_half_open_trial(monkeypatch):
+    breaker = _open_breaker("test.trial_timeout")
+    breaker.reset_timeout = 0.0
+
+    def _timeout(timeout=None):
+        raise TimeoutError("coda piena")
+
+    monkeypatch.setattr(rate_limiter, "acquire_management", _timeout)
+    with pytest.raises(resilience.DeadlineExceeded):
+        resilience.call("test.trial_timeout", lambda: "ok")
+    assert breaker._trial_running is False
+
+    # La prova successiva deve poter partire e richiudere il breaker
+    monkeypatch.setattr(rate_limiter, "acquire_management", lambda timeout=None: 0.0)
+    assert resilience.call("test.trial_timeout", lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_expired_deadline_stops_before_calling():
+    called = []
+    with resilience.deadline(0):
+        with pytest.raises(resilience.DeadlineExceeded):
+            resilience.call("test.deadline", lambda: called.append(1))
+    assert not called
+
+
+def test_nested_deadline_keeps_the_tighter_one():
+    with resilience.deadline(1):
+        with resilience.deadline(60):
+            assert resilience.remaining() <= 1
+    assert resilience.current_deadline() is None
+
+
+def test_inherit_deadline_in_worker_thread():
+    seen = {}
+    with resilience.deadline(5):
+        absolute = resilience.current_deadline()
+
+        def worker():
+            with resilience.inherit_deadline(absolute):
+                seen["left"] = resilience.remaining()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    assert 0 < seen["left"] <= 5
+
+
+def test_deadline_in_keeps_the_tighter_deadline():
+    with resilience.deadline(5):
+        assert resilience.deadline_in(60) == resilience.current_deadline()
+    assert resilience.deadline_in(60) > resilience.deadline_in(1)
@@ -0,0 +1,93 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils import hash_manifest, store_inventory
+
+
+class FakeStores:
+    """file_search_stores.list finto che conta le letture."""
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.calls = 0
+
+    def list(self):
+        self.calls += 1
+        return iter(list(self.stores))
+
+
+@pytest.fixture
+def env(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(store_inventory, "time", SimpleNamespace(time=lambda: clock.now))
+    stores = FakeStores([
+        SimpleNamespace(name="fileSearchStores/a", size_bytes=500, active_documents_count=2),
+        SimpleNamespace(name="fileSearchStores/b", size_bytes=None, active_documents_count=None),
+    ])
+    monkeypatch.setattr(store_inventory, "get_client",
+                        lambda api_key: SimpleNamespace(file_search_stores=stores))
+    return SimpleNamespace(clock=clock, stores=stores,
+                           inventory=store_inventory.StoreInventory("chiave", ttl=60))
+
+
+def test_snapshot_is_reused_until_the_ttl_expires(env):
+    assert len(env.inventory.stores()) == 2
+    env.clock.now += 59
+    assert env.inventory.get("fileSearchStores/b") is not None
+    assert env.inventory.age() == 59
+    assert env.stores.calls == 1
+
+    env.clock.now += 1
+    env.inventory.stores()
+    assert env.stores.calls == 2
+    env.inventory.stores(force=True)
+    assert env.stores.calls == 3
+    assert env.inventory.refresh_count == 3
+
+
+def test_invalidate_and_forget_update_the_snapshot(env):
+    env.inventory.stores()
+    env.inventory.forget("fileSearchStores/a")
+    assert [s.name for s in env.inventory.stores()] == ["fileSearchStores/b"]
+    assert env.stores.calls == 1
+
+    env.inventory.invalidate()
+    assert env.inventory.age() is None
+    assert len(env.inventory.stores()) == 2
+    assert env.stores.calls == 2
+
+
+def test_storage_is_computed_once_per_snapshot(env, monkeypatch):
+    monkeypatch.setenv("QUADERNINI", json.dumps([
+        {"name": "Storia", "store_name": "fileSearchStores/a", "files": ["a.pdf"]},
+        {"name": "Fisica", "store_name": "fileSearchStores/b", "files": []},
+    ]))
+    # Lo store b non riporta size_bytes: i byte vengono dal manifest locale
+    hash_manifest.record_local_hash("a.pdf", "sha-a", 300, 0.0)
+    hash_manifest.record_local_hash("b.pdf", "sha-b", 200, 0.0)
+    hash_manifest.record_store_document("fileSearchStores/b", "sha-b", "b.pdf")
+    summaries = []
+    original = hash_manifest.get_storage_summary
+    monkeypatch.setattr(hash_manifest, "get_storage_summary", lambda: summaries.append(1) or original())
+
+    storage = env.inventory.storage()
+
+    assert storage["stores"]["fileSearchStores/a"] == {"bytes": 500, "source": "api", "documents": 2}
+    assert storage["stores"]["fileSearchStores/b"] == {"bytes": 200, "source": "manifest", "documents": 0}
+    assert storage["notebooks"]["Storia"] == {"store_id": "fileSearchStores/a", "indexed_bytes": 500,
+                                              "local_bytes": 300, "files": 1}
+    assert storage["total_bytes"] == 700
+    assert env.inventory.storage() is storage
+    assert len(summaries) == 1
+
+    env.clock.now += 60
+    assert env.inventory.storage() is not storage
+    assert len(summaries) == 2
+
+
+def test_registry_shares_one_inventory_per_api_key(env):
+    first = store_inventory.get_inventory("chiave")
+    assert store_inventory.get_inventory("chiave") is first
+    assert store_inventory.get_inventory("altra") is not first
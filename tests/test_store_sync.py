@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import gemini_handler, hash_manifest, rate_limiter
+
+STORE = "fileSearchStores/storia"
+
+
+def _document(doc_id, file_name, sha256=None, state="STATE_ACTIVE", **extra):
+    metadata = [SimpleNamespace(key="file_name", string_value=file_name, numeric_value=None)]
+    if sha256:
+        metadata.append(SimpleNamespace(key="content_sha256", string_value=sha256, numeric_value=None))
+    for key, value in extra.items():
+        numeric = isinstance(value, int)
+        metadata.append(SimpleNamespace(key=key, string_value=None if numeric else value,
+                                        numeric_value=value if numeric else None))
+    return SimpleNamespace(name=f"{STORE}/documents/{doc_id}", display_name=file_name,
+                           state=SimpleNamespace(name=state), custom_metadata=metadata)
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "acquire_management", lambda timeout=None: 0.0)
+    documents = []
+    client = SimpleNamespace(file_search_stores=SimpleNamespace(
+        documents=SimpleNamespace(list=lambda parent: list(documents))
+    ))
+    monkeypatch.setattr(gemini_handler, "get_client", lambda api_key: client)
+    handler = gemini_handler.GeminiHandler("chiave", "gemini-2.5-flash")
+    handler.documents = documents
+    handler.imported, handler.deleted = [], []
+
+    def _import(store_name, chapter_name, paths):
+        names = [p.rsplit("/", 1)[-1] for p in paths]
+        handler.imported.extend(names)
+        return {"imported": names, "skipped": [], "failed": []}
+
+    def _delete(document_name):
+        handler.deleted.append(document_name.rsplit("/", 1)[-1])
+        return True
+
+    monkeypatch.setattr(handler, "import_files_to_store", _import)
+    monkeypatch.setattr(handler, "delete_store_document", _delete)
+    return handler
+
+
+def _local(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path), hash_manifest.get_file_hash(path)
+
+
+def test_sync_imports_new_and_changed_files_and_removes_deleted_ones(handler, tmp_path):
+    same, same_sha = _local(tmp_path, "invariato.md", "uguale")
+    changed, _ = _local(tmp_path, "modificato.md", "nuova versione")
+    new, _ = _local(tmp_path, "nuovo.md", "mai indicizzato")
+    handler.documents.extend([
+        _document("d1", "invariato.md", same_sha),
+        _document("d2", "modificato.md", "sha-vecchio"),
+        _document("d3", "rimosso.md", "sha-rimosso"),
+    ])
+
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [same, changed, new])
+
+    assert summary["unchanged"] == ["invariato.md"]
+    assert summary["updated"] == ["modificato.md"]
+    assert summary["added"] == ["nuovo.md"]
+    assert summary["removed"] == ["rimosso.md"]
+    assert sorted(handler.imported) == ["modificato.md", "nuovo.md"]
+    assert sorted(handler.deleted) == ["d2", "d3"]
+
+
+def test_documents_without_hash_are_matched_by_name(handler, tmp_path):
+    kept, _ = _local(tmp_path, "capitolo.pdf", "contenuto")
+    handler.documents.extend([
+        _document("d1", "capitolo.pdf"),
+        _document("d2", "vecchio.pdf"),
+    ])
+
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [kept])
+
+    assert summary["unchanged"] == ["capitolo.pdf"]
+    assert handler.imported == []
+    assert handler.deleted == ["d2"]
+    assert summary["removed"] == ["vecchio.pdf"]
+
+
+def test_pending_documents_count_as_present(handler, tmp_path):
+    path, sha256 = _local(tmp_path, "capitolo.pdf", "contenuto")
+    handler.documents.append(_document("d1", "capitolo.pdf", sha256, state="STATE_PENDING"))
+
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [path])
+
+    assert summary["unchanged"] == ["capitolo.pdf"]
+    assert handler.imported == [] and handler.deleted == []
+    assert hash_manifest.get_store_documents(STORE)[sha256]["state"] == hash_manifest.DOC_STATE_PENDING
+
+
+def test_failed_documents_are_replaced(handler, tmp_path):
+    path, sha256 = _local(tmp_path, "capitolo.pdf", "contenuto")
+    handler.documents.append(_document("d1", "capitolo.pdf", sha256, state="STATE_FAILED"))
+
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [path])
+
+    assert handler.imported == ["capitolo.pdf"]
+    assert handler.deleted == ["d1"]
+    assert summary["updated"] == ["capitolo.pdf"] and summary["removed"] == []
+
+
+def test_split_file_is_unchanged_only_when_all_parts_are_present(handler, tmp_path):
+    path, sha256 = _local(tmp_path, "manuale.pdf", "contenuto")
+    handler.documents.extend([
+        _document("p1", "manuale.pdf", "sha-p1", parent_file="manuale.pdf", parent_sha256=sha256, part_count=2),
+        _document("p2", "manuale.pdf", "sha-p2", state="STATE_PENDING",
+                  parent_file="manuale.pdf", parent_sha256=sha256, part_count=2),
+    ])
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [path])
+    assert summary["unchanged"] == ["manuale.pdf"]
+
+    handler.documents.pop()
+    summary = handler.sync_store_with_notebook(STORE, "Storia", [path])
+    assert handler.imported == ["manuale.pdf"]
+
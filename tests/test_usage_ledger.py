@@ -0,0 +1,73 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from utils import usage_ledger
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    """Registro in tmp_path, con orologio controllato dal test."""
+    monkeypatch.setattr(usage_ledger, "LEDGER_FILE", tmp_path / "usage_ledger.sqlite3")
+    monkeypatch.setattr(usage_ledger, "_schema_ready", False)
+    clock = SimpleNamespace(now=datetime(2026, 3, 2, 10, 0, 5).timestamp())
+    monkeypatch.setattr(usage_ledger, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def _usage(prompt, candidates, cached=0):
+    return SimpleNamespace(prompt_token_count=prompt, candidates_token_count=candidates,
+                           cached_content_token_count=cached, total_token_count=prompt + candidates)
+
+
+def test_rollup_groups_by_day_and_model(ledger):
+    usage_ledger.record("chat", "models/gemini-2.5-flash", _usage(100, 20, cached=50), 1.0, notebook="Storia")
+    usage_ledger.record("chat", "gemini-2.5-flash", _usage(200, 40), 3.0, notebook="Storia")
+    usage_ledger.record("chat", "gemini-2.5-pro", _usage(10, 5), 2.0, notebook="Fisica")
+    ledger.now += 86400
+    usage_ledger.record("batch", "gemini-2.5-flash", _usage(1, 1), None)
+    assert not usage_ledger.record("chat", "gemini-2.5-flash", None)
+
+    rows = usage_ledger.rollup(("day", "model"))
+
+    assert [(r["day"], r["model"], r["requests"], r["total_tokens"]) for r in rows] == [
+        ("2026-03-02", "gemini-2.5-flash", 2, 360),
+        ("2026-03-02", "gemini-2.5-pro", 1, 15),
+        ("2026-03-03", "gemini-2.5-flash", 1, 2),
+    ]
+    assert rows[0]["cached_tokens"] == 50
+    assert rows[0]["avg_latency_s"] == pytest.approx(2.0)
+
+
+def test_rollup_filters_by_day_and_model(ledger):
+    usage_ledger.record("chat", "gemini-2.5-flash", _usage(100, 20), 1.0, notebook="Storia")
+    ledger.now += 86400
+    usage_ledger.record("chat", "gemini-2.5-flash", _usage(10, 2), 1.0, notebook="Storia")
+    usage_ledger.record("chat", "gemini-2.5-pro", _usage(10, 2), 1.0, notebook="Fisica")
+
+    rows = usage_ledger.rollup(("notebook", "nonexistent_column"), since="2026-03-03", model="models/gemini-2.5-flash")
+
+    assert rows == [{"notebook": "Storia", "requests": 1, "prompt_tokens": 10, "candidates_tokens": 2,
+                     "tool_use_tokens": 0, "cached_tokens": 0, "thoughts_tokens": 0, "total_tokens": 12,
+                     "avg_latency_s": 1.0}]
+    # Senza colonne di raggruppamento: un totale unico, vuoto se non ci sono righe
+    assert usage_ledger.rollup((), since="2026-03-04") == []
+    assert usage_ledger.rollup(())[0]["requests"] == 3
+
+
+def test_peak_minute_takes_the_busiest_minute(ledger):
+    start = ledger.now
+    for offset, tokens in ((0, 100), (20, 100), (50, 500), (65, 10), (70, 10), (75, 10)):
+        ledger.now = start + offset
+        usage_ledger.record("chat", "gemini-2.5-flash", _usage(tokens, 0))
+    usage_ledger.record("chat", "gemini-2.5-pro", _usage(10000, 0))
+
+    assert usage_ledger.peak_minute("gemini-2.5-flash", start) == {"requests": 3, "tokens": 700}
+    assert usage_ledger.peak_minute("gemini-2.5-flash", start + 60) == {"requests": 3, "tokens": 30}
+    assert usage_ledger.peak_minute("gemini-2.5-flash", start + 3600) == {"requests": 0, "tokens": 0}
+
+
+def test_missing_ledger_reads_as_empty(ledger):
+    assert usage_ledger.rollup() == []
+    assert usage_ledger.peak_minute("gemini-2.5-flash", 0) == {"requests": 0, "tokens": 0}
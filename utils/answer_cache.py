@@ -0,0 +1,150 @@
+"""
+Cache persistente delle risposte della chat.
+La chiave combina store, versione dei contenuti dello store, modello, istruzioni
+di sistema e domanda normalizzata. Eviction LRU con scadenza (TTL) e limite di dimensione.
+Ogni voce conserva il testo della risposta e, separatamente, le sue citazioni.
+"""
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from filelock import FileLock, Timeout
+from utils.logger import log_info, log_error
+
+CACHE_FILE = Path("answer_cache.json")
+CACHE_LOCK = Path("answer_cache.json.lock")
+
+# Limiti della cache
+CACHE_TTL_SECONDS = 7 * 24 * 3600  # una settimana
+CACHE_MAX_ENTRIES = 500
+CACHE_MAX_BYTES = 5 * 1024 * 1024  # 5 MB di testo
+
+
+def _read_unlocked() -> Dict:
+    if not CACHE_FILE.exists():
+        return {}
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, json.JSONDecodeError) as e:
+        log_error(f"Errore lettura answer_cache.json: {e}")
+        return {}
+
+
+def _write_unlocked(data: Dict):
+    with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalizza una domanda: minuscole, spazi compattati, punteggiatura finale rimossa."""
+    text = re.sub(r'\s+', ' ', prompt.strip().lower())
+    return text.rstrip(' ?!.;:')
+
+
+def make_key(store_name: str, store_version: str, model_name: str,
+             system_instruction: str, prompt: str, metadata_filter: str = "") -> str:
+    """Costruisce la chiave di cache per una domanda (e l'eventuale filtro metadati)."""
+    instruction_hash = hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()[:16]
+    parts = [store_name, store_version, model_name, instruction_hash, normalize_prompt(prompt)]
+    if metadata_filter:
+        parts.append(metadata_filter)
+    raw = json.dumps(parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _evict(data: Dict, now: float):
+    """Rimuove le voci scadute, poi le meno usate finché i limiti non sono rispettati."""
+    for key in [k for k, v in data.items() if now - v.get("created_at", 0) > CACHE_TTL_SECONDS]:
+        del data[key]
+
+    total_bytes = sum(v.get("size", 0) for v in data.values())
+    if len(data) <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+        return
+
+    for key in sorted(data, key=lambda k: data[k].get("last_access", 0)):
+        if len(data) <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+            break
+        total_bytes -= data[key].get("size", 0)
+        del data[key]
+
+
+def get(key: str) -> Optional[Dict]:
+    """Risposta in cache per la chiave, {answer, citations} (aggiorna l'ordine LRU), o None."""
+    if not CACHE_FILE.exists():
+        return None
+    lock = FileLock(str(CACHE_LOCK), timeout=5)
+    try:
+        with lock:
+            data = _read_unlocked()
+            entry = data.get(key)
+            # Le voci senza citazioni separate hanno le fonti nel testo: non più valide
+            if not entry or "citations" not in entry:
+                return None
+            now = time.time()
+            if now - entry.get("created_at", 0) > CACHE_TTL_SECONDS:
+                del data[key]
+                _write_unlocked(data)
+                return None
+            entry["last_access"] = now
+            entry["hits"] = entry.get("hits", 0) + 1
+            _write_unlocked(data)
+            return {"answer": entry["answer"], "citations": entry["citations"]}
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su answer_cache.json per la lettura")
+        return None
+    except IOError as e:
+        log_error(f"Errore accesso answer_cache.json: {e}")
+        return None
+
+
+def put(key: str, store_name: str, answer: str, citations: Optional[List[Dict]] = None) -> bool:
+    """Salva una risposta (e le sue citazioni) in cache applicando TTL e limiti di dimensione."""
+    lock = FileLock(str(CACHE_LOCK), timeout=5)
+    try:
+        with lock:
+            data = _read_unlocked()
+            now = time.time()
+            data[key] = {
+                "store_name": store_name,
+                "answer": answer,
+                "citations": citations or [],
+                "size": len(answer.encode('utf-8')),
+                "created_at": now,
+                "last_access": now,
+                "hits": 0
+            }
+            _evict(data, now)
+            _write_unlocked(data)
+            return True
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su answer_cache.json per la scrittura")
+        return False
+    except IOError as e:
+        log_error(f"Errore scrittura answer_cache.json: {e}")
+        return False
+
+
+def invalidate_store(store_name: str) -> int:
+    """Elimina tutte le risposte di uno store (chiamata quando lo store viene reindicizzato)."""
+    if not CACHE_FILE.exists():
+        return 0
+    lock = FileLock(str(CACHE_LOCK), timeout=5)
+    try:
+        with lock:
+            data = _read_unlocked()
+            keys = [k for k, v in data.items() if v.get("store_name") == store_name]
+            for key in keys:
+                del data[key]
+            if keys:
+                _write_unlocked(data)
+                log_info(f"Cache risposte: invalidate {len(keys)} voci per {store_name}")
+            return len(keys)
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su answer_cache.json per l'invalidazione")
+        return 0
+    except IOError as e:
+        log_error(f"Errore scrittura answer_cache.json: {e}")
+        return 0
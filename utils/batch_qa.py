@@ -0,0 +1,151 @@
+"""
+Esecuzione di domande in blocco su un quadernino (es. banche di domande d'esame).
+I risultati vengono accodati a un file JSONL per esecuzione: un run interrotto
+riprende saltando le domande già completate.
+"""
+import csv
+import hashlib
+import io
+import json
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+from filelock import FileLock, Timeout
+from utils.logger import log_info, log_error
+
+BATCH_DIR = Path("batch_runs")
+
+# Concorrenza di default per le domande in blocco (il rate limiter resta il vincolo finale)
+DEFAULT_BATCH_WORKERS = 4
+
+# Nomi di colonna riconosciuti nei CSV di domande
+PROMPT_COLUMNS = ("domanda", "question", "prompt", "testo")
+
+RESULT_FIELDS = ["index", "question_id", "prompt", "answer", "sources", "latency_s",
+                 "prompt_tokens", "output_tokens", "total_tokens", "model", "error", "completed_at"]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def question_id(prompt: str) -> str:
+    """Identificativo stabile di una domanda (per la ripresa)."""
+    return hashlib.sha256(prompt.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def make_run_id(notebook_name: str, prompts: List[str]) -> str:
+    """
+    Identificativo di un run: stesso quadernino e stesse domande danno lo stesso id,
+    così ricaricare il file dopo un'interruzione riprende il run esistente.
+    """
+    slug = re.sub(r'[^a-z0-9]+', '-', notebook_name.lower()).strip('-') or "quadernino"
+    digest = hashlib.sha256("\n".join(prompts).encode('utf-8')).hexdigest()[:10]
+    return f"{slug}-{digest}"
+
+
+def parse_prompts(data: bytes, file_name: str) -> List[str]:
+    """
+    Estrae le domande da un file caricato: una per riga (.txt) oppure dalla colonna
+    'domanda'/'question'/'prompt' di un CSV (in mancanza, la prima colonna).
+    Righe vuote e duplicati vengono ignorati.
+    """
+    text = data.decode('utf-8-sig', errors='replace')
+    prompts = []
+    if file_name.lower().endswith('.csv'):
+        rows = list(csv.reader(io.StringIO(text)))
+        if not rows:
+            return []
+        header = [h.strip().lower() for h in rows[0]]
+        column = next((header.index(c) for c in PROMPT_COLUMNS if c in header), None)
+        body = rows[1:] if column is not None else rows
+        column = column or 0
+        prompts = [row[column] for row in body if len(row) > column]
+    else:
+        prompts = text.splitlines()
+
+    seen = set()
+    result = []
+    for prompt in (p.strip() for p in prompts):
+        if prompt and prompt not in seen:
+            seen.add(prompt)
+            result.append(prompt)
+    return result
+
+
+def _run_path(run_id: str) -> Path:
+    return BATCH_DIR / f"{run_id}.jsonl"
+
+
+def load_results(run_id: str) -> List[Dict]:
+    """Risultati già registrati per un run (l'ultimo per ogni domanda)."""
+    path = _run_path(run_id)
+    if not path.exists():
+        return []
+    results = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Riga troncata da un'interruzione: viene ignorata
+                    continue
+                results[record["question_id"]] = record
+    except IOError as e:
+        log_error(f"Errore lettura risultati batch {run_id}: {e}")
+    return sorted(results.values(), key=lambda r: r.get("index", 0))
+
+
+def completed_ids(run_id: str) -> set:
+    """Domande già risposte senza errori (da saltare alla ripresa)."""
+    return {r["question_id"] for r in load_results(run_id) if not r.get("error")}
+
+
+def append_result(run_id: str, record: Dict) -> bool:
+    """Accoda un risultato al file JSONL del run."""
+    BATCH_DIR.mkdir(exist_ok=True)
+    path = _run_path(run_id)
+    lock = FileLock(str(path) + ".lock", timeout=10)
+    record = dict(record, completed_at=record.get("completed_at") or _now())
+    try:
+        with lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return True
+    except Timeout:
+        log_error(f"Timeout: Impossibile acquisire il lock sui risultati batch {run_id}")
+        return False
+    except IOError as e:
+        log_error(f"Errore scrittura risultati batch {run_id}: {e}")
+        return False
+
+
+def discard_run(run_id: str) -> bool:
+    """Elimina i risultati di un run (per ripartire da zero)."""
+    path = _run_path(run_id)
+    try:
+        if path.exists():
+            path.unlink()
+            log_info(f"Risultati batch {run_id} eliminati")
+        return True
+    except OSError as e:
+        log_error(f"Errore eliminazione risultati batch {run_id}: {e}")
+        return False
+
+
+def results_to_jsonl(results: List[Dict]) -> bytes:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results).encode('utf-8')
+
+
+def results_to_csv(results: List[Dict]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for record in results:
+        writer.writerow(record)
+    return buffer.getvalue().encode('utf-8-sig')
@@ -0,0 +1,229 @@
+"""
+Gestione della cronologia multi-turno della chat entro un budget di token.
+I turni più recenti vengono inviati così come sono; quelli più vecchi vengono
+compattati in un riassunto progressivo, riusato tra una domanda e l'altra.
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from google.genai import types
+from utils import rate_limiter, resilience, usage_ledger
+from utils.logger import log_info, log_warning
+
+# Budget di default (token) per la cronologia inviata con ogni domanda
+DEFAULT_HISTORY_TOKEN_BUDGET = 4000
+
+# I turni vecchi vengono compattati a blocchi di questi messaggi,
+# così i prefissi riassunti si ripetono e il riassunto viene riusato
+COMPACTION_STEP = 4
+
+# Quota del budget riservata ai turni recenti (il resto va al riassunto)
+RECENT_SHARE = 0.75
+
+# Oltre questa frazione del budget la stima locale viene verificata con count_tokens
+VERIFY_THRESHOLD = 0.6
+
+# Risposte dell'app (errori, avvisi) escluse dalla cronologia inviata
+NON_CONVERSATION_PREFIXES = ("❌", "⚠️")
+
+SUMMARY_MAX_OUTPUT_TOKENS = 512
+SUMMARY_CACHE_SIZE = 200
+
+SUMMARY_INSTRUCTION = """
+Riassumi in italiano, in modo conciso, la conversazione di studio seguente.
+Conserva domande dell'utente, concetti chiave, definizioni e conclusioni delle risposte.
+Non aggiungere informazioni nuove.
+"""
+
+_summary_cache: "OrderedDict[str, str]" = OrderedDict()
+_summary_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima locale veloce (circa 4 caratteri per token)."""
+    return len(text) // 4 + 1
+
+
+def count_tokens(client, model_name: str, contents) -> Optional[int]:
+    """Conteggio esatto dei token tramite API, o None se non disponibile."""
+    try:
+        return resilience.call(
+            "models.count_tokens",
+            lambda: client.models.count_tokens(model=model_name, contents=contents).total_tokens,
+            max_attempts=2
+        )
+    except Exception as e:
+        log_warning(f"count_tokens non disponibile, uso la stima locale: {e}")
+        return None
+
+
+def _estimate_contents(contents: List[types.Content]) -> int:
+    """Stima locale dei token di una lista di `types.Content`."""
+    return sum(estimate_tokens(part.text or "") for content in contents for part in content.parts)
+
+
+def _to_content(message: Dict) -> types.Content:
+    role = "model" if message.get("role") == "assistant" else "user"
+    return types.Content(role=role, parts=[types.Part(text=message.get("content", ""))])
+
+
+def _messages_key(messages: List[Dict]) -> str:
+    raw = json.dumps([[m.get("role"), m.get("content")] for m in messages], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cache_summary(key: str, summary: str):
+    with _summary_lock:
+        _summary_cache[key] = summary
+        _summary_cache.move_to_end(key)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+
+
+def _cached_summary(key: str) -> Optional[str]:
+    with _summary_lock:
+        summary = _summary_cache.get(key)
+        if summary is not None:
+            _summary_cache.move_to_end(key)
+        return summary
+
+
+def _summarize(client, model_name: str, older: List[Dict]) -> str:
+    """
+    Riassunto progressivo dei messaggi `older`: parte dal riassunto in cache del
+    prefisso più lungo e aggiunge solo i messaggi successivi.
+    """
+    key = _messages_key(older)
+    summary = _cached_summary(key)
+    if summary is not None:
+        return summary
+
+    previous_summary, start = "", 0
+    for cut in range(len(older) - COMPACTION_STEP, 0, -COMPACTION_STEP):
+        cached = _cached_summary(_messages_key(older[:cut]))
+        if cached is not None:
+            previous_summary, start = cached, cut
+            break
+
+    transcript = "\n".join(
+        f"{'Utente' if m.get('role') == 'user' else 'Quadernino'}: {m.get('content', '')}"
+        for m in older[start:]
+    )
+    request = (f"Riassunto precedente:\n{previous_summary}\n\nNuovi messaggi:\n{transcript}"
+               if previous_summary else transcript)
+
+    estimated_tokens = estimate_tokens(request) + SUMMARY_MAX_OUTPUT_TOKENS
+    start_time = time.time()
+    response = resilience.call(
+        "models.generate_content",
+        lambda: client.models.generate_content(
+            model=model_name,
+            contents=request,
+            config=types.GenerateContentConfig(
+                system_instruction=SUMMARY_INSTRUCTION,
+                max_output_tokens=SUMMARY_MAX_OUTPUT_TOKENS
+            )
+        ),
+        model_name=model_name, tokens=estimated_tokens
+    )
+    usage = getattr(response, 'usage_metadata', None)
+    rate_limiter.settle_model(model_name, estimated_tokens, getattr(usage, 'total_token_count', None))
+    usage_ledger.record("chat_history.summary", model_name, usage, time.time() - start_time)
+    summary = (response.text or "").strip()
+    _cache_summary(key, summary)
+    log_info(f"Cronologia compattata: {len(older)} messaggi riassunti ({estimate_tokens(summary)} token stimati)")
+    return summary
+
+
+def build_contents(client, model_name: str, prompt: str, history: Optional[List[Dict]],
+                   token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET) -> Tuple[list, Dict]:
+    """
+    Costruisce i `contents` da inviare: riassunto dei turni vecchi, turni recenti
+    e domanda corrente. I token della cronologia restano entro `token_budget`.
+    Ritorna (contents, info) con info = {history_tokens, summarized, dropped, recent}.
+    """
+    info = {"history_tokens": 0, "summarized": 0, "dropped": 0, "recent": 0}
+    # Gli avvisi e gli errori mostrati in chat non fanno parte della conversazione
+    messages = [m for m in (history or [])
+                if m.get("content") and not m["content"].startswith(NON_CONVERSATION_PREFIXES)]
+    if not messages:
+        return prompt, info
+
+    # 1. Turni recenti: dal più nuovo all'indietro finché entrano nella loro quota
+    recent_budget = int(token_budget * RECENT_SHARE)
+    used, cut = 0, len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens = estimate_tokens(messages[i]["content"])
+        if used + tokens > recent_budget:
+            break
+        used += tokens
+        cut = i
+
+    # Il taglio viene allineato ai blocchi di compattazione (arrotondando verso l'alto)
+    if cut > 0:
+        cut = min(len(messages), int(math.ceil(cut / COMPACTION_STEP)) * COMPACTION_STEP)
+    older, recent = messages[:cut], messages[cut:]
+
+    # 2. Turni vecchi: riassunto progressivo (se fallisce, vengono scartati)
+    summary = ""
+    if older:
+        try:
+            summary = _summarize(client, model_name, older)
+            info["summarized"] = len(older)
+        except Exception as e:
+            log_warning(f"Compattazione cronologia fallita, turni vecchi scartati: {e}")
+            info["dropped"] = len(older)
+
+    def _assemble(recent_messages):
+        contents = []
+        if summary:
+            contents.append(types.Content(role="user", parts=[
+                types.Part(text=f"Riassunto della conversazione precedente:\n{summary}")
+            ]))
+            contents.append(types.Content(role="model", parts=[types.Part(text="Ricevuto.")]))
+        contents.extend(_to_content(m) for m in recent_messages)
+        return contents
+
+    # La conversazione inviata deve iniziare con un turno utente e alternare i ruoli:
+    # dopo la coppia del riassunto (che termina con un turno del modello) non può
+    # seguire un altro turno del modello
+    def _drop_leading_model_turns(recent_messages):
+        while recent_messages and recent_messages[0].get("role") != "user":
+            recent_messages = recent_messages[1:]
+            info["dropped"] += 1
+        return recent_messages
+
+    # 3. Conteggio prima dell'invio: si scartano i turni recenti più vecchi se si sfora.
+    # Le stime dei turni scartati vengono riportate sulla scala del conteggio esatto,
+    # che viene ripetuto quando la stima torna entro il budget
+    recent = _drop_leading_model_turns(recent)
+    history_contents = _assemble(recent)
+    history_tokens = _estimate_contents(history_contents)
+    scale, exact = 1.0, False
+    if history_tokens > token_budget * VERIFY_THRESHOLD and history_contents:
+        counted = count_tokens(client, model_name, history_contents)
+        if counted is not None:
+            scale, exact = counted / max(1, history_tokens), True
+            history_tokens = counted
+    while history_tokens > token_budget and recent:
+        kept = _drop_leading_model_turns(recent[1:])
+        info["dropped"] += 1
+        removed = [_to_content(m) for m in recent[:len(recent) - len(kept)]]
+        history_tokens -= int(math.ceil(_estimate_contents(removed) * scale))
+        recent = kept
+        history_contents = _assemble(recent)
+        if exact and history_tokens <= token_budget and history_contents:
+            counted = count_tokens(client, model_name, history_contents)
+            if counted is not None:
+                history_tokens = counted
+    if not history_contents:
+        history_tokens = 0
+
+    info["history_tokens"] = max(0, history_tokens)
+    info["recent"] = len(recent)
+    contents = history_contents + [types.Content(role="user", parts=[types.Part(text=prompt)])]
+    return contents, info
@@ -0,0 +1,199 @@
+"""
+Profili di chunking per l'indicizzazione File Search.
+Il profilo viene scelto per quadernino (fisso) oppure automaticamente per ogni
+documento in base a statistiche locali (tipo, dimensione, pagine, testo stimato).
+Include un harness che stima numero di chunk e costo di indicizzazione per profilo.
+
+Uso da riga di comando:
+    python -m utils.chunking_profiles uploaded_files/*.pdf
+"""
+import math
+import re
+import sys
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PROFILE_AUTO = "auto"
+
+# Profili disponibili (token per chunk / token di sovrapposizione)
+CHUNKING_PROFILES = {
+    "slides": {
+        "label": "Slide e appunti densi",
+        "max_tokens_per_chunk": 120,
+        "max_overlap_tokens": 15
+    },
+    "standard": {
+        "label": "Standard",
+        "max_tokens_per_chunk": 200,
+        "max_overlap_tokens": 20
+    },
+    "long_form": {
+        "label": "Libri e dispense lunghe",
+        "max_tokens_per_chunk": 512,
+        "max_overlap_tokens": 64
+    }
+}
+
+DEFAULT_PROFILE = "standard"
+
+# Soglie della selezione automatica
+LONG_FORM_MIN_TOKENS = 100_000     # testo stimato oltre cui un documento è "lungo"
+LONG_FORM_MIN_PAGES = 150
+SLIDES_MIN_BYTES_PER_PAGE = 150 * 1024   # PDF pesanti per pagina: tipicamente slide con immagini
+SLIDES_NAME_PATTERN = re.compile(r'slide|lucidi|presentazion|deck', re.IGNORECASE)
+
+# Stime per i PDF, il cui testo è compresso e non leggibile senza librerie esterne
+PDF_TOKENS_PER_PAGE = 500
+
+# Costo di indicizzazione (embedding) di File Search, USD per milione di token
+EMBEDDING_COST_PER_1M = 0.15
+
+# Chunk recuperati in media per domanda (per stimare il contesto inviato al modello)
+RETRIEVED_CHUNKS_PER_QUERY = 5
+
+_PDF_PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?!s)')
+_XML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def chunking_config(profile: str) -> Dict:
+    """Configurazione `chunking_config` per l'import File Search del profilo indicato."""
+    values = CHUNKING_PROFILES.get(profile, CHUNKING_PROFILES[DEFAULT_PROFILE])
+    return {
+        'white_space_config': {
+            'max_tokens_per_chunk': values["max_tokens_per_chunk"],
+            'max_overlap_tokens': values["max_overlap_tokens"]
+        }
+    }
+
+
+def pdf_page_count(path: Path) -> Optional[int]:
+    """Conta le pagine di un PDF cercando gli oggetti /Type /Page (stima, senza dipendenze)."""
+    try:
+        count = 0
+        tail = b""
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                data = tail + block
+                # Le occorrenze già contate interamente nella coda del blocco precedente vengono saltate
+                count += sum(1 for m in _PDF_PAGE_PATTERN.finditer(data) if m.end() > len(tail))
+                tail = data[-32:]
+        return count or None
+    except OSError:
+        return None
+
+
+def _docx_token_estimate(path: Path) -> Optional[int]:
+    """Stima dei token di un DOCX leggendo il testo di word/document.xml."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            xml = archive.read('word/document.xml').decode('utf-8', errors='ignore')
+        text = _XML_TAG_PATTERN.sub(' ', xml)
+        return len(text.split()) * 4 // 3
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def file_stats(file_path: str) -> Dict:
+    """Statistiche locali di un documento: tipo, dimensione, pagine e token stimati."""
+    path = Path(file_path)
+    ext = path.suffix.lower().lstrip('.')
+    size = path.stat().st_size if path.exists() else 0
+    pages = None
+    tokens = None
+
+    if ext == 'pdf':
+        pages = pdf_page_count(path)
+        tokens = (pages or max(1, size // (100 * 1024))) * PDF_TOKENS_PER_PAGE
+    elif ext == 'docx':
+        tokens = _docx_token_estimate(path)
+    if tokens is None:
+        # Testo semplice (o fallback): circa 4 byte per token
+        tokens = size // 4
+
+    return {"name": path.name, "type": ext, "size": size, "pages": pages, "tokens": tokens}
+
+
+def select_profile(file_path: str, notebook_profile: Optional[str] = None, stats: Optional[Dict] = None) -> str:
+    """
+    Profilo da usare per un documento: quello del quadernino se fissato,
+    altrimenti scelto automaticamente dalle statistiche locali.
+    """
+    if notebook_profile and notebook_profile != PROFILE_AUTO and notebook_profile in CHUNKING_PROFILES:
+        return notebook_profile
+
+    stats = stats or file_stats(file_path)
+    pages = stats["pages"]
+
+    if stats["type"] == 'pdf':
+        if SLIDES_NAME_PATTERN.search(stats["name"]):
+            return "slides"
+        if pages and stats["size"] / pages >= SLIDES_MIN_BYTES_PER_PAGE and pages < LONG_FORM_MIN_PAGES:
+            return "slides"
+        if pages and pages >= LONG_FORM_MIN_PAGES:
+            return "long_form"
+
+    if stats["tokens"] >= LONG_FORM_MIN_TOKENS:
+        return "long_form"
+    return DEFAULT_PROFILE
+
+
+def estimate_chunks(tokens: int, profile: str) -> int:
+    """Numero di chunk stimato per un documento di `tokens` token."""
+    values = CHUNKING_PROFILES[profile]
+    size = values["max_tokens_per_chunk"]
+    step = max(1, size - values["max_overlap_tokens"])
+    if tokens <= size:
+        return 1 if tokens > 0 else 0
+    return 1 + math.ceil((tokens - size) / step)
+
+
+def measure_profiles(file_paths: List[str], profiles: Optional[List[str]] = None) -> Dict:
+    """
+    Harness di misura: per ogni profilo (più 'auto') stima chunk, token indicizzati,
+    costo di indicizzazione e token di contesto per domanda sui documenti indicati.
+    """
+    stats = [file_stats(p) for p in file_paths]
+    profiles = list(profiles or CHUNKING_PROFILES) + [PROFILE_AUTO]
+    report = {"files": len(stats), "source_tokens": sum(s["tokens"] for s in stats), "profiles": {}}
+
+    for profile in profiles:
+        chunks = 0
+        embedded_tokens = 0
+        context_tokens = 0
+        per_file = {}
+        for path, s in zip(file_paths, stats):
+            chosen = select_profile(path, stats=s) if profile == PROFILE_AUTO else profile
+            file_chunks = estimate_chunks(s["tokens"], chosen)
+            overlap = CHUNKING_PROFILES[chosen]["max_overlap_tokens"]
+            chunks += file_chunks
+            embedded_tokens += s["tokens"] + max(0, file_chunks - 1) * overlap
+            context_tokens = max(context_tokens, CHUNKING_PROFILES[chosen]["max_tokens_per_chunk"])
+            per_file[s["name"]] = {"profile": chosen, "chunks": file_chunks}
+
+        report["profiles"][profile] = {
+            "chunks": chunks,
+            "embedded_tokens": embedded_tokens,
+            "indexing_cost_usd": round(embedded_tokens * EMBEDDING_COST_PER_1M / 1_000_000, 4),
+            "context_tokens_per_query": context_tokens * RETRIEVED_CHUNKS_PER_QUERY,
+            "files": per_file
+        }
+    return report
+
+
+def _print_report(report: Dict):
+    print(f"{report['files']} file, ~{report['source_tokens']:,} token di testo")
+    print(f"{'profilo':<12}{'chunk':>10}{'token indicizzati':>20}{'costo USD':>12}{'contesto/domanda':>18}")
+    for name, values in report["profiles"].items():
+        print(f"{name:<12}{values['chunks']:>10,}{values['embedded_tokens']:>20,}"
+              f"{values['indexing_cost_usd']:>12}{values['context_tokens_per_query']:>18,}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python -m utils.chunking_profiles <file> [<file> ...]")
+        sys.exit(1)
+    _print_report(measure_profiles(sys.argv[1:]))
@@ -0,0 +1,141 @@
+"""
+Citazioni strutturate dalle risposte con File Search.
+I grounding chunk della risposta vengono raggruppati per documento di origine
+(le parti di un file diviso rimandano al file originale) e mostrati come piè di
+pagina compatto, senza chiedere al modello di elencare le fonti nel testo.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Lunghezza massima dell'estratto conservato per ogni fonte
+MAX_SNIPPET_CHARS = 200
+
+# Fonti mostrate al massimo nel piè di pagina
+MAX_FOOTER_SOURCES = 8
+
+# Validità della mappa documento -> file di origine di uno store
+SOURCE_MAP_TTL_SECONDS = 600
+
+_source_maps: Dict[tuple, tuple] = {}
+_source_maps_lock = threading.Lock()
+
+
+def _metadata_value(items, key: str):
+    for item in items or []:
+        if getattr(item, 'key', None) == key:
+            value = getattr(item, 'string_value', None)
+            return value if value is not None else getattr(item, 'numeric_value', None)
+    return None
+
+
+def metadata_value(document, key: str):
+    """Valore (stringa o numerico) di una voce di custom_metadata, o None."""
+    return _metadata_value(getattr(document, 'custom_metadata', None), key)
+
+
+def document_source(document) -> Optional[str]:
+    """File di origine di un documento dello store (o di un retrieved context)."""
+    metadata = getattr(document, 'custom_metadata', None)
+    return _metadata_value(metadata, "parent_file") or _metadata_value(metadata, "file_name")
+
+
+def get_source_map(store_name: str, store_version: str, loader: Callable[[], List]) -> Dict[str, str]:
+    """
+    Mappa nome/titolo di documento -> file di origine per uno store, in cache
+    per versione dei contenuti: l'elenco dei documenti viene letto una sola volta.
+    """
+    key = (store_name, store_version)
+    now = time.time()
+    with _source_maps_lock:
+        cached = _source_maps.get(key)
+        if cached and now - cached[0] < SOURCE_MAP_TTL_SECONDS:
+            return cached[1]
+
+    mapping = {}
+    for document in loader():
+        source = document_source(document) or getattr(document, 'display_name', None)
+        if not source:
+            continue
+        for name in (getattr(document, 'display_name', None), getattr(document, 'name', None)):
+            if name:
+                mapping[name] = source
+
+    with _source_maps_lock:
+        _source_maps[key] = (now, mapping)
+    return mapping
+
+
+def extract_citations(grounding_list: List, resolve_source: Optional[Callable[[str], Optional[str]]] = None) -> List[Dict]:
+    """
+    Citazioni dai grounding_metadata di una risposta (uno per chunk di streaming):
+    lista di {source, pages, chunks, snippet}, una voce per documento di origine,
+    nell'ordine in cui le fonti sostengono la risposta.
+    """
+    citations: Dict[str, Dict] = {}
+    order: List[str] = []
+
+    for grounding in grounding_list:
+        chunks = getattr(grounding, 'grounding_chunks', None) or []
+        sources = []
+        for chunk in chunks:
+            context = getattr(chunk, 'retrieved_context', None)
+            if context is None:
+                sources.append(None)
+                continue
+            title = getattr(context, 'title', None) or getattr(context, 'uri', None)
+            source = document_source(context)
+            if not source and title and resolve_source:
+                source = resolve_source(title)
+            source = source or title
+            sources.append(source)
+            if not source:
+                continue
+
+            entry = citations.setdefault(source, {"source": source, "pages": [], "chunks": 0, "snippet": None})
+            entry["chunks"] += 1
+            # Le pagine di una parte sono relative alla parte: mostrate solo per i file interi
+            page = getattr(context, 'page_number', None)
+            if page and source == title and page not in entry["pages"]:
+                entry["pages"].append(page)
+            text = getattr(context, 'text', None)
+            if text and not entry["snippet"]:
+                entry["snippet"] = " ".join(text.split())[:MAX_SNIPPET_CHARS]
+
+        # Le fonti citate dai segmenti della risposta vengono prima, nel loro ordine
+        for support in getattr(grounding, 'grounding_supports', None) or []:
+            for index in getattr(support, 'grounding_chunk_indices', None) or []:
+                if 0 <= index < len(sources) and sources[index] and sources[index] not in order:
+                    order.append(sources[index])
+        for source in sources:
+            if source and source not in order:
+                order.append(source)
+
+    result = []
+    for source in order:
+        entry = citations[source]
+        entry["pages"].sort()
+        result.append(entry)
+    return result
+
+
+def format_footer(citations: List[Dict]) -> str:
+    """Piè di pagina Markdown con le fonti, es. '📚 Fonti: a.pdf (p. 3, 7) · b.md'."""
+    if not citations:
+        return ""
+    items = []
+    for citation in citations[:MAX_FOOTER_SOURCES]:
+        pages = citation["pages"]
+        label = f"**{citation['source']}**"
+        if pages:
+            label += f" (p. {', '.join(str(p) for p in pages)})"
+        items.append(label)
+    extra = len(citations) - MAX_FOOTER_SOURCES
+    if extra > 0:
+        items.append(f"+{extra}")
+    return "\n\n---\n📚 Fonti: " + " · ".join(items)
+
+
+def sources_text(citations: List[Dict]) -> str:
+    """Elenco compatto delle fonti per gli export (es. 'a.pdf; b.md')."""
+    return "; ".join(c["source"] for c in citations)
@@ -0,0 +1,75 @@
+"""
+Registro condiviso dei client Google GenAI.
+Un solo client per API key nell'intero processo: i rerun di Streamlit e le sessioni
+concorrenti riusano lo stesso pool di connessioni HTTP (keep-alive, sessioni TLS).
+"""
+import threading
+from typing import Dict
+from utils.logger import log_info
+
+# Limiti del pool di connessioni HTTP condiviso da ogni client
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 120  # secondi
+
+_clients: Dict[str, object] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _http_options() -> Dict:
+    """Opzioni HTTP con connessioni persistenti; vuote se httpx non è importabile."""
+    try:
+        import httpx
+    except ImportError:
+        return {}
+    return {
+        'client_args': {
+            'limits': httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
+        }
+    }
+
+
+def get_client(api_key: str):
+    """
+    Restituisce il client condiviso per l'API key, creandolo alla prima richiesta.
+    Thread-safe: più sessioni Streamlit possono chiamarlo contemporaneamente.
+    """
+    with _lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _stats["hits"] += 1
+            return client
+
+        from google import genai
+        http_options = _http_options()
+        if http_options:
+            client = genai.Client(api_key=api_key, http_options=http_options)
+        else:
+            client = genai.Client(api_key=api_key)
+        _clients[api_key] = client
+        _stats["misses"] += 1
+        log_info(f"Client pool: creato nuovo client ({len(_clients)} totali)")
+        return client
+
+
+def release_client(api_key: str):
+    """Rimuove il client di una API key (es. quando la chiave viene cambiata o rimossa)."""
+    with _lock:
+        _clients.pop(api_key, None)
+
+
+def get_pool_stats() -> Dict:
+    """Statistiche del registro: client attivi, hit, miss e hit rate."""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            "clients": len(_clients),
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0
+        }
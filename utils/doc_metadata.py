@@ -0,0 +1,280 @@
+"""
+Estrazione locale dei metadati dei documenti (PDF, DOCX, TXT, MD).
+L'estrazione gira in un pool di processi durante l'indicizzazione, in parallelo
+agli upload; i risultati sono salvati in cache per hash del contenuto, così una
+reindicizzazione non li ricalcola mai.
+"""
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from filelock import FileLock, Timeout
+from utils import hash_manifest
+from utils.chunking_profiles import pdf_page_count
+from utils.logger import log_info, log_warning, log_error
+
+CACHE_FILE = Path("metadata_cache.json")
+CACHE_LOCK = Path("metadata_cache.json.lock")
+
+# Limite di voci custom_metadata per documento imposto da File Search
+MAX_CUSTOM_METADATA = 20
+
+# Testo analizzato per titolo e lingua (il conteggio parole usa tutto il testo)
+LANGUAGE_SAMPLE_WORDS = 5000
+MAX_TITLE_LENGTH = 120
+
+# Parole frequenti per il riconoscimento della lingua
+STOPWORDS = {
+    "it": {"il", "lo", "la", "di", "che", "e", "è", "un", "una", "per", "non", "con", "del", "della", "sono", "nel"},
+    "en": {"the", "of", "and", "to", "in", "is", "that", "for", "it", "with", "as", "was", "on", "are", "be", "this"},
+    "fr": {"le", "la", "les", "de", "des", "et", "est", "un", "une", "que", "pour", "dans", "pas", "du", "sur", "au"},
+    "es": {"el", "la", "los", "las", "de", "que", "y", "en", "un", "una", "es", "por", "con", "para", "del", "se"},
+    "de": {"der", "die", "das", "und", "ist", "nicht", "ein", "eine", "zu", "den", "mit", "von", "sich", "auf", "für", "im"}
+}
+
+_XML_TAG_PATTERN = re.compile(r'<[^>]+>')
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_pypdf_warned = False
+_PDF_TITLE_PATTERN = re.compile(rb'/Title\s*\(((?:[^()\\]|\\.){1,300})\)')
+
+
+def detect_language(text: str) -> Optional[str]:
+    """Lingua prevalente (it/en/fr/es/de) in base alle parole più frequenti, o None."""
+    words = [w.lower() for w in _WORD_PATTERN.findall(text)[:LANGUAGE_SAMPLE_WORDS]]
+    if len(words) < 20:
+        return None
+    scores = {lang: sum(1 for w in words if w in stops) for lang, stops in STOPWORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] >= len(words) * 0.03 else None
+
+
+def _clean_title(title: Optional[str]) -> Optional[str]:
+    if not title:
+        return None
+    title = re.sub(r'\s+', ' ', title).strip().lstrip('#').strip()
+    return title[:MAX_TITLE_LENGTH] or None
+
+
+def _pdf_metadata(path: Path) -> Dict:
+    """
+    Pagine, titolo e testo di un PDF (testo solo se pypdf è installato).
+    Senza pypdf il risultato è marcato 'partial': non va in cache, così viene
+    ricalcolato per intero appena la dipendenza è disponibile.
+    """
+    global _pypdf_warned
+    result = {"page_count": pdf_page_count(path), "title": None, "text": None}
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+        result["partial"] = True
+        if not _pypdf_warned:
+            _pypdf_warned = True
+            log_warning("pypdf non installato: lingua e conteggio parole dei PDF non disponibili "
+                        "(pip install -r requirements.txt)")
+
+    if PdfReader is not None:
+        try:
+            reader = PdfReader(str(path))
+            result["page_count"] = len(reader.pages)
+            info = reader.metadata
+            result["title"] = getattr(info, 'title', None) if info else None
+            result["text"] = "\n".join(page.extract_text() or "" for page in reader.pages)
+            return result
+        except Exception as e:
+            log_warning(f"Lettura PDF con pypdf fallita per {path.name}: {e}")
+
+    # Senza pypdf: titolo dal dizionario Info, se in chiaro
+    with open(path, 'rb') as f:
+        head = f.read(256 * 1024)
+        f.seek(max(0, path.stat().st_size - 256 * 1024))
+        tail = f.read()
+    match = _PDF_TITLE_PATTERN.search(tail) or _PDF_TITLE_PATTERN.search(head)
+    if match:
+        raw = match.group(1)
+        if not raw.startswith(b'\xfe\xff'):
+            result["title"] = raw.decode('latin-1', errors='ignore').replace('\\(', '(').replace('\\)', ')')
+    return result
+
+
+def _docx_metadata(path: Path) -> Dict:
+    """Pagine, titolo e testo di un DOCX letti direttamente dall'archivio."""
+    result = {"page_count": None, "title": None, "text": None}
+    with zipfile.ZipFile(path) as archive:
+        names = set(archive.namelist())
+        if 'word/document.xml' in names:
+            xml = archive.read('word/document.xml').decode('utf-8', errors='ignore')
+            xml = xml.replace('</w:p>', '\n')
+            result["text"] = _XML_TAG_PATTERN.sub('', xml)
+        if 'docProps/core.xml' in names:
+            core = archive.read('docProps/core.xml').decode('utf-8', errors='ignore')
+            match = re.search(r'<dc:title>(.*?)</dc:title>', core, re.DOTALL)
+            result["title"] = match.group(1) if match else None
+        if 'docProps/app.xml' in names:
+            app = archive.read('docProps/app.xml').decode('utf-8', errors='ignore')
+            match = re.search(r'<Pages>(\d+)</Pages>', app)
+            result["page_count"] = int(match.group(1)) if match else None
+    return result
+
+
+def _text_metadata(path: Path) -> Dict:
+    """Titolo (prima intestazione o prima riga) e testo di un file TXT/MD."""
+    text = path.read_text(encoding='utf-8', errors='replace')
+    title = None
+    for line in text.splitlines():
+        if line.strip():
+            title = line
+            break
+    heading = re.search(r'^#\s+(.+)$', text, re.MULTILINE)
+    if heading:
+        title = heading.group(1)
+    return {"page_count": None, "title": title, "text": text}
+
+
+def extract_metadata(file_path: str) -> Dict:
+    """
+    Metadati di un documento: page_count, title, language, size_bytes, word_count
+    (più 'partial' se l'estrazione è incompleta per una dipendenza mancante).
+    Funzione di modulo (serializzabile) eseguita nei processi del pool.
+    """
+    path = Path(file_path)
+    ext = path.suffix.lower()
+    if ext == '.pdf':
+        raw = _pdf_metadata(path)
+    elif ext == '.docx':
+        raw = _docx_metadata(path)
+    elif ext in ('.txt', '.md'):
+        raw = _text_metadata(path)
+    else:
+        raw = {"page_count": None, "title": None, "text": None}
+
+    text = raw.get("text")
+    metadata = {
+        "page_count": raw.get("page_count"),
+        "title": _clean_title(raw.get("title")),
+        "language": detect_language(text) if text else None,
+        "size_bytes": path.stat().st_size,
+        "word_count": len(_WORD_PATTERN.findall(text)) if text else None
+    }
+    if raw.get("partial"):
+        metadata["partial"] = True
+    return metadata
+
+
+def _read_cache() -> Dict:
+    if not CACHE_FILE.exists():
+        return {}
+    lock = FileLock(str(CACHE_LOCK), timeout=5)
+    try:
+        with lock:
+            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su metadata_cache.json per la lettura")
+        return {}
+    except (IOError, json.JSONDecodeError) as e:
+        log_error(f"Errore lettura metadata_cache.json: {e}")
+        return {}
+
+
+def _write_cache_entries(entries: Dict[str, Dict]):
+    lock = FileLock(str(CACHE_LOCK), timeout=5)
+    try:
+        with lock:
+            data = {}
+            if CACHE_FILE.exists():
+                try:
+                    with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (IOError, json.JSONDecodeError):
+                    data = {}
+            data.update(entries)
+            with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su metadata_cache.json per la scrittura")
+    except IOError as e:
+        log_error(f"Errore scrittura metadata_cache.json: {e}")
+
+
+class MetadataExtraction:
+    """
+    Estrazione dei metadati di un gruppo di file: i risultati in cache sono subito
+    disponibili, gli altri vengono calcolati in un pool di processi.
+    Usabile come context manager; `get(path)` attende il risultato del singolo file.
+    `hashes` (percorso -> sha256) evita di ricalcolare hash già noti, come quelli delle parti.
+    """
+
+    def __init__(self, file_paths: List[str], max_workers: Optional[int] = None,
+                 hashes: Optional[Dict[str, str]] = None):
+        self._results: Dict[str, Dict] = {}
+        self._futures = {}
+        self._hashes: Dict[str, str] = {}
+        self._executor = None
+
+        cache = _read_cache()
+        missing = []
+        for file_path in file_paths:
+            sha256 = (hashes or {}).get(file_path) or hash_manifest.get_file_hash(file_path)
+            self._hashes[file_path] = sha256
+            if sha256 in cache:
+                self._results[file_path] = cache[sha256]
+            else:
+                missing.append(file_path)
+
+        if not missing:
+            return
+
+        workers = max(1, min(max_workers or os.cpu_count() or 1, len(missing)))
+        try:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            self._futures = {p: self._executor.submit(extract_metadata, p) for p in missing}
+        except (OSError, NotImplementedError, RuntimeError) as e:
+            # Ambienti senza multiprocessing: ripiego su thread
+            log_warning(f"Pool di processi non disponibile, estrazione metadati su thread: {e}")
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+            self._futures = {p: self._executor.submit(extract_metadata, p) for p in missing}
+        log_info(f"Estrazione metadati: {len(file_paths) - len(missing)} in cache, {len(missing)} da calcolare")
+
+    def get(self, file_path: str, timeout: Optional[float] = None) -> Dict:
+        """Metadati di un file (vuoti se l'estrazione fallisce)."""
+        if file_path in self._results:
+            return self._results[file_path]
+        future = self._futures.get(file_path)
+        if future is None:
+            return {}
+        try:
+            metadata = future.result(timeout=timeout)
+        except Exception as e:
+            log_warning(f"Estrazione metadati fallita per {Path(file_path).name}: {e}")
+            metadata = {}
+        self._results[file_path] = metadata
+        if metadata and not metadata.get("partial") and self._hashes.get(file_path):
+            _write_cache_entries({self._hashes[file_path]: metadata})
+        return metadata
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def to_custom_metadata(metadata: Dict) -> List[Dict]:
+    """Converte i metadati estratti in voci custom_metadata di File Search."""
+    entries = []
+    for key in ("page_count", "size_bytes", "word_count"):
+        if metadata.get(key) is not None:
+            entries.append({"key": key, "numeric_value": metadata[key]})
+    for key in ("title", "language"):
+        if metadata.get(key):
+            entries.append({"key": key, "string_value": metadata[key]})
+    return entries
@@ -0,0 +1,195 @@
+"""
+Suddivisione dei documenti molto grandi in parti indicizzabili in parallelo.
+Un unico PDF da centinaia di pagine diventa una sola operazione di import, che
+domina il tempo di indicizzazione; diviso in parti, ogni parte viene importata
+in concorrenza con le altre e porta nei custom_metadata il file di origine.
+
+Le parti sono salvate in `split_parts/<hash del file>/` e riusate finché il
+contenuto del file originale non cambia.
+"""
+import json
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+from utils.chunking_profiles import pdf_page_count
+from utils.hash_manifest import compute_file_hash
+from utils.logger import log_info, log_warning, log_error
+
+SPLIT_DIR = Path("split_parts")
+PARTS_INDEX = "parts.json"
+
+# Soglie oltre cui un documento viene diviso (sovrascrivibili da .env)
+try:
+    SPLIT_THRESHOLD_MB = float(os.getenv("SPLIT_THRESHOLD_MB", 40))
+except ValueError:
+    SPLIT_THRESHOLD_MB = 40.0
+
+try:
+    SPLIT_MAX_PAGES = int(os.getenv("SPLIT_MAX_PAGES", 300))
+except ValueError:
+    SPLIT_MAX_PAGES = 300
+
+# Dimensione massima di ogni parte
+PAGES_PER_PART = 100
+TEXT_PART_BYTES = 8 * 1024 * 1024
+
+# Oltre questo margine una parte di testo viene tagliata anche senza riga vuota
+TEXT_HARD_LIMIT_FACTOR = 1.25
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+
+
+def _threshold_bytes() -> int:
+    return int(SPLIT_THRESHOLD_MB * 1024 * 1024)
+
+
+def needs_split(file_path: str) -> bool:
+    """True se il documento supera la soglia di dimensione (o di pagine, per i PDF)."""
+    path = Path(file_path)
+    ext = path.suffix.lower()
+    if (ext != '.pdf' and ext not in TEXT_EXTENSIONS) or not path.exists():
+        return False
+    size = path.stat().st_size
+    if size > _threshold_bytes():
+        return True
+    if ext == '.pdf':
+        pages = pdf_page_count(path)
+        return bool(pages and pages > SPLIT_MAX_PAGES)
+    return False
+
+
+def part_display_name(file_name: str, index: int, count: int) -> str:
+    """Nome visualizzato di una parte, es. 'Manuale (parte 2 di 8).pdf'."""
+    path = Path(file_name)
+    return f"{path.stem} (parte {index} di {count}){path.suffix}"
+
+
+def _part_file_name(file_name: str, index: int, count: int) -> str:
+    path = Path(file_name)
+    return f"{path.stem}.part{index:02d}-of-{count:02d}{path.suffix}"
+
+
+def _load_existing_parts(parts_dir: Path) -> Optional[List[Dict]]:
+    """Parti già generate per questo contenuto, se complete (e con il loro hash)."""
+    index_path = parts_dir / PARTS_INDEX
+    if not index_path.exists():
+        return None
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            parts = json.load(f)
+    except (IOError, json.JSONDecodeError):
+        return None
+    if parts and all(Path(p["path"]).exists() and p.get("sha256") for p in parts):
+        return parts
+    return None
+
+
+def _split_pdf(path: Path, parts_dir: Path) -> List[Path]:
+    """Divide un PDF in parti di al più PAGES_PER_PART pagine (richiede pypdf)."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(str(path))
+    total_pages = len(reader.pages)
+    # Numero di parti sufficiente a rispettare sia il limite di pagine sia quello di dimensione
+    count = max(
+        math.ceil(total_pages / PAGES_PER_PART),
+        math.ceil(path.stat().st_size / max(_threshold_bytes(), 1))
+    )
+    count = max(1, min(count, total_pages))
+    pages_per_part = math.ceil(total_pages / count)
+    count = math.ceil(total_pages / pages_per_part)
+
+    outputs = []
+    for index in range(count):
+        writer = PdfWriter()
+        for page in reader.pages[index * pages_per_part:(index + 1) * pages_per_part]:
+            writer.add_page(page)
+        out_path = parts_dir / _part_file_name(path.name, index + 1, count)
+        with open(out_path, 'wb') as f:
+            writer.write(f)
+        outputs.append(out_path)
+    return outputs
+
+
+def _split_text(path: Path, parts_dir: Path) -> List[Path]:
+    """
+    Divide un file di testo in parti di circa TEXT_PART_BYTES, tagliando su una
+    riga vuota (fine paragrafo) appena superata la dimensione obiettivo.
+    """
+    chunks = []
+    current = []
+    current_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            current.append(line)
+            current_size += len(line)
+            at_paragraph_end = not line.strip()
+            if (current_size >= TEXT_PART_BYTES and at_paragraph_end) or \
+                    current_size >= TEXT_PART_BYTES * TEXT_HARD_LIMIT_FACTOR:
+                chunks.append(current)
+                current, current_size = [], 0
+    if current:
+        chunks.append(current)
+
+    outputs = []
+    for index, lines in enumerate(chunks):
+        out_path = parts_dir / _part_file_name(path.name, index + 1, len(chunks))
+        with open(out_path, 'wb') as f:
+            f.writelines(lines)
+        outputs.append(out_path)
+    return outputs
+
+
+def split_document(file_path: str, sha256: str) -> List[Dict]:
+    """
+    Divide un documento in parti e ritorna la lista delle parti
+    ({path, sha256, part_index, part_count, display_name}); lista vuota se il
+    documento non va (o non può essere) diviso e deve essere importato per intero.
+    L'hash delle parti resta in parts.json, fuori dal manifest dei file locali.
+    """
+    path = Path(file_path)
+    parts_dir = SPLIT_DIR / sha256[:16]
+    existing = _load_existing_parts(parts_dir)
+    if existing:
+        return existing
+
+    ext = path.suffix.lower()
+    try:
+        parts_dir.mkdir(parents=True, exist_ok=True)
+        if ext == '.pdf':
+            try:
+                outputs = _split_pdf(path, parts_dir)
+            except ImportError:
+                log_warning(f"{path.name} supera la soglia di divisione ma pypdf non è installato: importato per intero")
+                return []
+        elif ext in TEXT_EXTENSIONS:
+            outputs = _split_text(path, parts_dir)
+        else:
+            return []
+    except Exception as e:
+        log_error(f"Errore divisione di {path.name} in parti: {e}")
+        return []
+
+    if len(outputs) < 2:
+        return []
+
+    count = len(outputs)
+    parts = [
+        {
+            "path": str(out_path),
+            "sha256": compute_file_hash(out_path),
+            "part_index": index + 1,
+            "part_count": count,
+            "display_name": part_display_name(path.name, index + 1, count)
+        }
+        for index, out_path in enumerate(outputs)
+    ]
+    try:
+        with open(parts_dir / PARTS_INDEX, 'w', encoding='utf-8') as f:
+            json.dump(parts, f, indent=4)
+    except IOError as e:
+        log_warning(f"Impossibile salvare l'indice delle parti di {path.name}: {e}")
+
+    log_info(f"{path.name} diviso in {count} parti")
+    return parts
@@ -0,0 +1,100 @@
+"""
+Esplorazione paginata dei documenti di un File Search Store.
+I documenti vengono letti una pagina alla volta con i page token del server
+(nessun elenco completo in memoria) e ogni pagina resta in cache per un breve
+periodo: aprire uno store con migliaia di documenti costa una sola richiesta.
+"""
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from utils import resilience
+from utils.citations import document_source, metadata_value
+from utils.client_pool import get_client
+
+# Documenti per pagina (il massimo accettato da documents.list è 20)
+DOCUMENT_PAGE_SIZE = 20
+
+# Validità di una pagina in cache e numero massimo di pagine conservate
+PAGE_CACHE_TTL_SECONDS = 120
+PAGE_CACHE_MAX_PAGES = 500
+
+_pages: Dict[tuple, tuple] = {}
+_pages_lock = threading.Lock()
+
+
+def _document_state(document) -> str:
+    """Stato del documento in forma breve ('active', 'pending', 'failed')."""
+    state = getattr(document, 'state', None)
+    if state is None:
+        return "unknown"
+    label = getattr(state, 'name', None) or str(state)
+    return label.replace("STATE_", "").lower()
+
+
+def document_info(document) -> Dict:
+    """Dati essenziali di un documento dello store per la visualizzazione."""
+    display_name = getattr(document, 'display_name', None) or getattr(document, 'name', '')
+    create_time = getattr(document, 'create_time', None)
+    return {
+        "name": display_name,
+        "document_id": getattr(document, 'name', None),
+        "source_file": document_source(document) or display_name,
+        "content_sha256": metadata_value(document, "content_sha256"),
+        "parent_sha256": metadata_value(document, "parent_sha256"),
+        "status": _document_state(document),
+        "size_bytes": int(getattr(document, 'size_bytes', None) or 0),
+        "mime_type": getattr(document, 'mime_type', None),
+        "create_time": create_time.isoformat() if hasattr(create_time, 'isoformat') else create_time
+    }
+
+
+def fetch_page(api_key: str, store_name: str, page_token: Optional[str] = None,
+               page_size: int = DOCUMENT_PAGE_SIZE) -> Dict:
+    """
+    Una pagina di documenti dello store: {documents, next_page_token}.
+    `next_page_token` è None sull'ultima pagina. Le pagine sono in cache per token.
+    """
+    key = (store_name, page_size, page_token or "")
+    now = time.time()
+    with _pages_lock:
+        cached = _pages.get(key)
+        if cached and now - cached[0] < PAGE_CACHE_TTL_SECONDS:
+            return cached[1]
+
+    client = get_client(api_key)
+    config = {'page_size': page_size}
+    if page_token:
+        config['page_token'] = page_token
+    pager = resilience.call(
+        "documents.list",
+        lambda: client.file_search_stores.documents.list(parent=store_name, config=config)
+    )
+    page = {
+        "documents": [document_info(d) for d in pager.page],
+        "next_page_token": pager.config.get('page_token') or None
+    }
+
+    with _pages_lock:
+        _pages[key] = (now, page)
+        if len(_pages) > PAGE_CACHE_MAX_PAGES:
+            for old_key in sorted(_pages, key=lambda k: _pages[k][0])[:len(_pages) - PAGE_CACHE_MAX_PAGES]:
+                del _pages[old_key]
+    return page
+
+
+def iter_documents(api_key: str, store_name: str, page_size: int = DOCUMENT_PAGE_SIZE) -> Iterator[Dict]:
+    """Tutti i documenti dello store, letti pagina per pagina solo quando servono."""
+    page_token = None
+    while True:
+        page = fetch_page(api_key, store_name, page_token, page_size)
+        yield from page["documents"]
+        page_token = page["next_page_token"]
+        if not page_token:
+            return
+
+
+def invalidate(store_name: str):
+    """Scarta le pagine in cache di uno store (dopo import o eliminazione di documenti)."""
+    with _pages_lock:
+        for key in [k for k in _pages if k[0] == store_name]:
+            del _pages[key]
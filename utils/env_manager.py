@@ -3,6 +3,7 @@ import os
 import ast
 from typing import List, Dict
 from utils.logger import log_info, log_error, log_warning
+from utils.store_inventory import get_inventory
 from filelock import FileLock, Timeout
 
 ENV_PATH = Path(".env")
@@ -306,9 +307,8 @@ def find_existing_store_for_notebook(notebook_name: str, api_key: str) -> str:
     (Non tocca .env, non serve lock)
     """
     try:
-        from google import genai
-        client = genai.Client(api_key=api_key)
-        for store in client.file_search_stores.list():
+        stores = get_inventory(api_key).stores()
+        for store in stores:
             store_display = getattr(store, 'display_name', '')
             if f'Quadernino - {notebook_name}' in store_display:
                 log_info(f"Store esistente trovato per '{notebook_name}': {store.name}")
@@ -326,12 +326,10 @@ def restore_notebooks_from_api(api_key: str) -> int:
     (Chiama save_notebooks, che è lockato)
     """
     try:
-        from google import genai
         import json
         log_info("Iniziando ripristino automatico quadernini da Google API")
-        client = genai.Client(api_key=api_key)
         restored_notebooks = []
-        stores = list(client.file_search_stores.list())
+        stores = get_inventory(api_key).stores(force=True)
         log_info(f"Trovati {len(stores)} File Search stores totali")
 
         for store in stores:
@@ -422,4 +420,21 @@ def update_notebook_store_name(notebook_name: str, store_name: str) -> bool:
         return save_notebooks(notebooks)
     except Exception as e:
         log_error(f"Errore aggiornamento store quadernino: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def update_notebook_chunking_profile(notebook_name: str, profile: str) -> bool:
+    """
+    Imposta il profilo di chunking di un quadernino ('auto' per la scelta automatica).
+    (Eredita la sicurezza dal lock in save_notebooks)
+    """
+    try:
+        notebooks = load_notebooks()
+        for notebook in notebooks:
+            if notebook["name"] == notebook_name:
+                notebook["chunking_profile"] = profile
+                break
+        return save_notebooks(notebooks)
+    except Exception as e:
+        log_error(f"Errore aggiornamento profilo chunking quadernino: {e}")
+        return False
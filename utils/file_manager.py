@@ -1,11 +1,17 @@
 import os
 import shutil
+import hashlib
 from pathlib import Path
 import streamlit as st
+from utils import hash_manifest
 
 # Usa percorso assoluto per evitare problemi con working directory
 UPLOAD_DIR = Path(__file__).parent.parent / "uploaded_files"
 
+# Conservazione delle copie locali dei file caricati (sovrascrivibile da .env).
+# Se disattivata, i file vengono caricati su Google direttamente dal buffer in memoria.
+KEEP_LOCAL_FILES = os.getenv("KEEP_LOCAL_FILES", "true").strip().lower() not in ("0", "false", "no")
+
 #
 # --- FUNZIONI DI ESTRAZIONE TESTO RIMOSSE ---
 # _extract_from_text, _extract_from_pdf, _extract_from_docx
@@ -16,15 +22,24 @@ UPLOAD_DIR = Path(__file__).parent.parent / "uploaded_files"
 def save_uploaded_file(uploaded_file):
     """
     Salva un file caricato tramite Streamlit nella directory locale.
+    Calcola lo SHA-256 durante la scrittura e lo registra nel manifest.
     Ritorna il percorso completo del file salvato.
     """
     try:
         UPLOAD_DIR.mkdir(exist_ok=True)
         file_path = UPLOAD_DIR / uploaded_file.name
 
-        # Scrive il buffer del file su disco
+        # Scrive il buffer del file su disco a blocchi, aggiornando l'hash
+        buffer = uploaded_file.getbuffer()
+        sha = hashlib.sha256()
         with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+            for offset in range(0, len(buffer), hash_manifest.HASH_CHUNK_SIZE):
+                block = buffer[offset:offset + hash_manifest.HASH_CHUNK_SIZE]
+                sha.update(block)
+                f.write(block)
+
+        stat = file_path.stat()
+        hash_manifest.record_local_hash(file_path.name, sha.hexdigest(), stat.st_size, stat.st_mtime)
 
         return str(file_path)
     except Exception as e:
@@ -39,13 +54,35 @@ def list_local_files():
     return [str(f) for f in UPLOAD_DIR.iterdir() if f.is_file() and f.name != ".gitkeep"]
 
 
+def list_remote_only_files():
+    """
+    Percorsi (non esistenti su disco) dei file caricati senza copia locale:
+    l'indicizzazione li importa dal file remoto registrato nel manifest.
+    I file il cui file remoto è scaduto (~48 ore) non sono più elencati.
+    """
+    return [str(UPLOAD_DIR / name) for name in hash_manifest.list_remote_only_files() if not (UPLOAD_DIR / name).exists()]
+
+
+def list_expired_remote_only_files():
+    """Nomi dei file caricati senza copia locale il cui file remoto è scaduto."""
+    return [name for name in hash_manifest.list_expired_remote_only_files() if not (UPLOAD_DIR / name).exists()]
+
+
+def purge_expired_remote_only_files():
+    """Dimentica i file senza copia locale ormai scaduti; ritorna i nomi rimossi."""
+    return hash_manifest.purge_expired_remote_only_files()
+
+
 def delete_local_file(file_name):
-    """Elimina un file specifico dalla directory locale."""
+    """Elimina un file dalla directory locale (o la voce di un file caricato senza copia locale)."""
     try:
         file_path = UPLOAD_DIR / file_name
         if file_path.exists():
             os.remove(file_path)
             return True
+        entry = hash_manifest.get_local_file_entry(file_name)
+        if entry and entry.get("remote_only"):
+            return hash_manifest.forget_local_file(file_name)
     except Exception as e:
         st.error(f"Errore durante l'eliminazione del file: {e}")
     return False
@@ -54,10 +91,15 @@ def delete_local_file(file_name):
 def get_file_info(file_path):
     """Ritorna informazioni base su un file (dimensione formattata, estensione)."""
     path = Path(file_path)
-    if not path.exists():
-        return None
-
-    size_bytes = path.stat().st_size
+    remote_only = False
+    if path.exists():
+        size_bytes = path.stat().st_size
+    else:
+        entry = hash_manifest.get_local_file_entry(path.name)
+        if not entry or not entry.get("remote_only"):
+            return None
+        size_bytes = entry.get("size", 0)
+        remote_only = True
 
     # Logica per unità di misura dinamica
     if size_bytes < 1024:
@@ -70,5 +112,6 @@ def get_file_info(file_path):
     return {
         "name": path.name,
         "size_formatted": size_str,
-        "type": path.suffix.lower()
+        "type": path.suffix.lower(),
+        "remote_only": remote_only
     }
\ No newline at end of file
@@ -1,75 +1,159 @@
-from google import genai
 from google.genai import types
 import streamlit as st
+import itertools
+import mimetypes
+import os
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import sys
 from utils.logger import log_info, log_warning, log_error, log_error_with_context, log_api_call
+from utils import (
+    answer_cache, batch_qa, chat_history, chunking_profiles, citations, doc_metadata, doc_splitter,
+    document_browser, hash_manifest, index_journal, rate_limiter, resilience, store_inventory, usage_ledger
+)
+from utils.client_pool import get_client
+from utils.env_manager import load_notebooks
+from utils.model_catalog import get_model_catalog
+from utils.operation_manager import (
+    OperationManager, STATUS_PENDING, STATUS_DONE, STATUS_FAILED, STATUS_TIMEOUT
+)
 
 
 # NON importiamo più file_manager per l'estrazione del testo.
 # Fa tutto Google sui suoi server.
 
-def get_available_models(api_key):
-    """Recupera dinamicamente la lista dei modelli Gemini disponibili."""
-    if not api_key:
-        return []
-    try:
-        # Usa il nuovo client per listare i modelli
-        client = genai.Client(api_key=api_key)
-        models = client.models.list()
+# Numero di file caricati/importati in parallelo (sovrascrivibile da .env)
+DEFAULT_UPLOAD_WORKERS = 4
+
+# Lunghezza massima del nome di un file remoto (limite API Google)
+MAX_REMOTE_NAME_LENGTH = 40
+
+# Scadenza globale (secondi) per l'elaborazione/indicizzazione di TUTTI i file
+INDEXING_TIMEOUT = 600
+
+# Scadenza (secondi) per preparare una risposta della chat e riceverne il primo chunk
+GENERATION_TIMEOUT = 120
+
+# Scadenza globale (secondi) di un'esecuzione di domande in blocco
+BATCH_TIMEOUT = 1800
+
+# Istruzioni di sistema condivise da tutte le modalità di generazione
+SYSTEM_INSTRUCTION = """
+Sei Quadernino, un assistente di studio intelligente e preciso.
+Il tuo compito è rispondere alle domande dell'utente basandoti ESCLUSIVAMENTE sui documenti forniti nello strumento di ricerca (File Search).
+NON usare la tua conoscenza generale. Se la risposta non si trova nei documenti, dillo chiaramente: "Non ho trovato questa informazione nei documenti caricati."
+"""
+
 
-        # Filtra i modelli che supportano generateContent e contengono "gemini"
-        gemini_models = []
+def _make_remote_file_name(file_name):
+    """
+    Genera un nome remoto univoco e valido per l'API Google (max 40 caratteri,
+    solo minuscole, cifre e trattini). Il suffisso casuale evita collisioni
+    anche quando più file partono nello stesso secondo.
+    """
+    safe_file_name = file_name.lower()
+    safe_file_name = ''.join(c if c.isalnum() and c.isascii() else '-' for c in safe_file_name)
+    safe_file_name = '-'.join(filter(None, safe_file_name.split('-')))
 
-        for model in models:
-            # Controlla sia supported_generation_methods (vecchio) che supported_actions (nuovo)
-            has_generate_content = False
+    suffix = uuid.uuid4().hex[:8]
+    max_base_length = MAX_REMOTE_NAME_LENGTH - len(suffix) - 1  # 1 = trattino
+    safe_file_name = safe_file_name[:max_base_length].strip('-')
 
-            if hasattr(model, 'supported_generation_methods'):
-                if 'generateContent' in model.supported_generation_methods:
-                    has_generate_content = True
-            elif hasattr(model, 'supported_actions'):
-                if 'generateContent' in model.supported_actions:
-                    has_generate_content = True
+    return f"{safe_file_name}-{suffix}" if safe_file_name else suffix
 
-            if has_generate_content:
-                if hasattr(model, 'name') and 'gemini' in model.name:
-                    gemini_models.append(model.name)
 
-        return sorted(gemini_models, reverse=True)
+def _format_rate(bytes_per_second):
+    """Formatta una velocità di trasferimento in B/s, KB/s o MB/s."""
+    if bytes_per_second < 1024:
+        return f"{bytes_per_second:.0f} B/s"
+    elif bytes_per_second < 1024 * 1024:
+        return f"{bytes_per_second / 1024:.1f} KB/s"
+    return f"{bytes_per_second / (1024 * 1024):.2f} MB/s"
+
+
+def _generation_error_message(error):
+    """Messaggio per la chat quando la generazione fallisce anche dopo i retry."""
+    if isinstance(error, resilience.CircuitOpenError) or resilience.is_retryable(error):
+        return "⚠️ Il servizio Google è momentaneamente sovraccarico. Riprova tra qualche secondo."
+    return f"❌ Errore durante la generazione: {str(error)}"
+
+
+def get_available_models(api_key):
+    """
+    Recupera la lista dei modelli Gemini che supportano generateContent.
+    Servita dal catalogo su disco, aggiornato in background quando scade.
+    """
+    if not api_key:
+        return []
+    try:
+        catalog = get_model_catalog(api_key)
+        return [m["name"] for m in catalog if m["supports_generate_content"]]
     except Exception as e:
         log_error_with_context(e, "get_available_models", {"api_key_present": bool(api_key)})
         return []
 
 
 class GeminiHandler:
-    def __init__(self, api_key, model_name=None, chunk_size=200, overlap=20):
+    def __init__(self, api_key, model_name=None, chunk_size=None, overlap=None, max_workers=None,
+                 history_token_budget=None, chunking_profile=None):
         self.api_key = api_key
 
+        # Dimensione del pool di upload/import concorrenti
+        if max_workers is None:
+            try:
+                max_workers = int(os.getenv("UPLOAD_WORKERS", DEFAULT_UPLOAD_WORKERS))
+            except ValueError:
+                max_workers = DEFAULT_UPLOAD_WORKERS
+        self.max_workers = max(1, max_workers)
+
+        # Budget di token per la cronologia della chat inviata con ogni domanda
+        if history_token_budget is None:
+            try:
+                history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", chat_history.DEFAULT_HISTORY_TOKEN_BUDGET))
+            except ValueError:
+                history_token_budget = chat_history.DEFAULT_HISTORY_TOKEN_BUDGET
+        self.history_token_budget = max(0, history_token_budget)
+
         # Se non viene passato un modello, usa vuoto per forzare la selezione dall'utente
         if model_name:
             self.model_name = f"models/{model_name}" if not model_name.startswith("models/") else model_name
         else:
             self.model_name = ""
 
-        # Configurazione chunking per ottimizzare la ricerca
-        self.chunking_config = {
-            'white_space_config': {
-                'max_tokens_per_chunk': chunk_size,
-                'max_overlap_tokens': overlap
+        # Configurazione chunking: dimensioni esplicite valgono per tutti i file,
+        # altrimenti il profilo (del quadernino o 'auto') viene scelto per ogni documento
+        self.chunking_profile = chunking_profile or chunking_profiles.PROFILE_AUTO
+        self.chunking_config = None
+        if chunk_size is not None:
+            default = chunking_profiles.CHUNKING_PROFILES[chunking_profiles.DEFAULT_PROFILE]
+            self.chunking_config = {
+                'white_space_config': {
+                    'max_tokens_per_chunk': chunk_size,
+                    'max_overlap_tokens': overlap if overlap is not None else default["max_overlap_tokens"]
+                }
             }
-        }
 
         self.is_configured = False
 
+        # Time-to-first-token (secondi) dell'ultima risposta in streaming
+        self.last_ttft = None
+        # True se l'ultima risposta è stata servita dalla cache locale
+        self.last_from_cache = False
+        # Dettagli della cronologia inviata con l'ultima domanda (token, turni riassunti/scartati)
+        self.last_history_info = None
+        # Citazioni strutturate dell'ultima risposta (vedi utils.citations)
+        self.last_citations = []
+        # grounding_metadata ricevuti con l'ultima risposta in streaming
+        self.last_grounding = []
+
         # Nome univoco per il File Store (sarà generato per ogni capitolo)
         self.file_store_name = None  # Sarà impostato dinamicamente per ogni capitolo
 
         if self.api_key:
             try:
-                # Usa il client come da documentazione ufficiale
-                self.client = genai.Client(api_key=api_key)
+                # Client condiviso dal registro di processo (connessioni riusate tra i rerun)
+                self.client = get_client(api_key)
                 self.is_configured = True
             except Exception as e:
                 st.error(f"Configurazione API Key fallita: {e}")
@@ -93,32 +177,33 @@ class GeminiHandler:
                 file_name = Path(file_path).name
                 my_bar.progress((i + 1) / len(local_file_paths), text=f"Upload di {file_name}...")
 
-                uploaded_file = genai.upload_file(path=file_path)
+                uploaded_file = resilience.call("files.upload", lambda: self.client.files.upload(
+                    file=file_path,
+                    config={'name': _make_remote_file_name(file_name), 'display_name': file_name}
+                ))
                 google_files.append(uploaded_file)
 
             my_bar.progress(100, text="Upload completato. Attesa elaborazione...")
 
-            timeout = 300  # 5 minuti
-            start_time = time.time()
+            # Un unico ciclo di polling per tutti i file caricati
+            manager = OperationManager(
+                refresh_fn=self._refresh_file,
+                status_fn=self._file_status
+            )
+            for gfile in google_files:
+                manager.add(gfile.name, gfile)
+
+            processed = []
+
+            def _on_file_ready(key, status, gfile, error):
+                processed.append(key)
+                my_bar.progress(len(processed) / len(google_files), text=f"Processato {gfile.display_name}...")
+
+            results = manager.wait_all(timeout=INDEXING_TIMEOUT, on_complete=_on_file_ready)
 
-            for i, gfile in enumerate(google_files):
-                while (time.time() - start_time) < timeout:
-                    my_bar.progress((i + 1) / len(google_files), text=f"Processando {gfile.display_name}...")
-
-                    # Aggiunto un try/except per il get_file, che a volte fallisce
-                    try:
-                        file_state = genai.get_file(gfile.name).state.name
-                    except Exception as e:
-                        log_warning(f"Controllo stato fallito per {gfile.display_name}, riprovo... ({e})")
-                        st.warning(f"Controllo stato fallito per {gfile.display_name}, riprovo...")
-                        time.sleep(2)
-                        continue
-
-                    if file_state == "ACTIVE":
-                        break
-                    if file_state == "FAILED":
-                        raise Exception(f"Elaborazione fallita per {gfile.display_name}")
-                    time.sleep(3)  # Polling
+            not_ready = [r["operation"].display_name for r in results.values() if r["status"] != STATUS_DONE]
+            if not_ready:
+                raise Exception(f"Elaborazione fallita o scaduta per: {', '.join(not_ready)}")
 
             my_bar.empty()
             return [f.name for f in google_files]
@@ -129,11 +214,75 @@ class GeminiHandler:
             # Pulizia dei file già caricati se l'upload fallisce a metà
             for gfile in google_files:
                 try:
-                    genai.delete_file(gfile.name)
+                    resilience.call("files.delete", lambda: self.client.files.delete(name=gfile.name))
                 except:
                     pass
             return []
 
+    def upload_from_buffer(self, uploaded_file):
+        """
+        Carica un file di Streamlit direttamente dal buffer in memoria, senza copia
+        su disco: l'hash è calcolato sul memoryview e il file remoto viene registrato
+        nel manifest, così l'indicizzazione lo importa senza un nuovo upload.
+        Ritorna lo SHA-256 del contenuto, o None in caso di errore.
+        """
+        if not self.is_configured:
+            return None
+
+        file_name = uploaded_file.name
+        with uploaded_file.getbuffer() as buffer:
+            sha256 = hash_manifest.compute_buffer_hash(buffer)
+            size = len(buffer)
+
+        if not hash_manifest.get_remote_file(sha256):
+            mime_type = getattr(uploaded_file, 'type', None) or mimetypes.guess_type(file_name)[0] \
+                or 'application/octet-stream'
+
+            def _upload():
+                uploaded_file.seek(0)
+                return self.client.files.upload(
+                    file=uploaded_file,
+                    config={
+                        'name': _make_remote_file_name(file_name),
+                        'display_name': file_name,
+                        'mime_type': mime_type
+                    }
+                )
+
+            start_time = time.time()
+            try:
+                remote = resilience.call("files.upload", _upload)
+            except Exception as e:
+                log_error_with_context(e, "upload diretto da buffer", {"file": file_name})
+                st.error(f"❌ Upload di {file_name} fallito: {str(e)}")
+                return None
+            expiration = getattr(remote, 'expiration_time', None)
+            hash_manifest.record_remote_file(
+                sha256, remote.name, expiration.isoformat() if hasattr(expiration, 'isoformat') else None
+            )
+            log_api_call("files.upload_buffer", file_name, time.time() - start_time)
+
+        hash_manifest.record_remote_only_file(file_name, sha256, size)
+        return sha256
+
+    def _refresh_file(self, gfile):
+        """Stato aggiornato di un file caricato (polling con rate limit e retry)."""
+        return resilience.call("files.get", lambda: self.client.files.get(name=gfile.name))
+
+    def _refresh_operation(self, operation):
+        """Stato aggiornato di un'operazione di import (polling con rate limit e retry)."""
+        return resilience.call("operations.get", lambda: self.client.operations.get(operation))
+
+    @staticmethod
+    def _file_status(gfile):
+        """Classifica lo stato di un file caricato (PROCESSING / ACTIVE / FAILED)."""
+        state = getattr(getattr(gfile, 'state', None), 'name', '')
+        if state == "ACTIVE":
+            return STATUS_DONE
+        if state == "FAILED":
+            return STATUS_FAILED
+        return STATUS_PENDING
+
     def create_vector_store_for_chapter(self, chapter_name, local_file_paths):
         """
         Crea un File Search Store specifico per un capitolo.
@@ -146,112 +295,503 @@ class GeminiHandler:
         self.file_store_name = f"quadernino_cap_{chapter_name.lower().replace(' ', '-').replace('_', '-')}_{timestamp}"
 
         try:
-            # 1. Crea il File Search store per il capitolo
-            with st.spinner(f"Creazione File Search Store per '{chapter_name}'..."):
-                file_search_store = self.client.file_search_stores.create(
-                    config={'display_name': f'Quadernino - {chapter_name}'}
-                )
+            # 1. Riprende un'indicizzazione interrotta o crea un nuovo store per il capitolo
+            store_name = None
+            journal = index_journal.get_incomplete_journal(chapter_name)
+            if journal:
+                existing_store = self.get_file_search_store(journal["store_name"])
+                if existing_store and not isinstance(existing_store, dict):
+                    store_name = journal["store_name"]
+                    done = sum(1 for f in journal["files"].values() if f.get("state") == index_journal.FILE_ACTIVE)
+                    st.info(f"♻️ Ripresa indicizzazione interrotta: {done} file già indicizzati in {store_name}")
+
+            if not store_name:
+                with st.spinner(f"Creazione File Search Store per '{chapter_name}'..."):
+                    file_search_store = resilience.call(
+                        "file_search_stores.create",
+                        lambda: self.client.file_search_stores.create(
+                            config={'display_name': f'Quadernino - {chapter_name}'}
+                        )
+                    )
+                store_name = file_search_store.name
+                store_inventory.invalidate(self.api_key)
+                st.toast(f"Creato File Search Store per '{chapter_name}': {store_name}")
 
-            st.toast(f"Creato File Search Store per '{chapter_name}': {file_search_store.name}")
+            # 2-3. Upload, import e attesa indicizzazione
+            summary = self.import_files_to_store(store_name, chapter_name, local_file_paths)
+            if not summary["imported"] and not summary["skipped"]:
+                st.error("Nessun file è stato caricato correttamente.")
+                return None
 
-            # 2. Upload e import dei file con chunking configuration
-            uploaded_operations = []
-            my_bar = st.progress(0, text=f"Upload e indicizzazione file per '{chapter_name}'...")
+            st.success(f"✅ Capitolo '{chapter_name}' creato con {len(summary['imported']) + len(summary['skipped'])} file!")
+            st.caption(f"📊 Chunking: {self._chunking_description()}")
+            return store_name
 
-            for i, file_path in enumerate(local_file_paths):
-                file_name = Path(file_path).name
-                my_bar.progress((i + 1) / len(local_file_paths), text=f"Processando {file_name}...")
+        except Exception as e:
+            st.error(f"❌ Errore durante la creazione del File Search Store per '{chapter_name}': {str(e)}")
+            return None
 
+    def import_files_to_store(self, store_name, chapter_name, local_file_paths):
+        """
+        Carica e importa i file in uno store esistente, saltando quelli il cui
+        contenuto (SHA-256) è già attivo nello store. Ogni passaggio viene
+        registrato nel journal del quadernino, da cui un'esecuzione interrotta riprende.
+        I documenti molto grandi vengono divisi in parti (vedi utils.doc_splitter).
+        Tutte le chiamate (anche nei worker) condividono la scadenza INDEXING_TIMEOUT.
+        Ritorna un riepilogo con le liste 'imported', 'skipped' e 'failed'.
+        """
+        summary = {"imported": [], "skipped": [], "failed": []}
+        if not self.is_configured or not local_file_paths:
+            return summary
+
+        with resilience.deadline(INDEXING_TIMEOUT):
+            return self._import_files(store_name, chapter_name, local_file_paths, summary)
+
+    def _import_files(self, store_name, chapter_name, local_file_paths, summary):
+        """Corpo di import_files_to_store, eseguito entro la scadenza dell'indicizzazione."""
+        index_journal.start_journal(chapter_name, store_name)
+        journal = index_journal.load_journal(chapter_name)
+
+        # 1. I documenti oltre soglia vengono divisi in parti importate in parallelo
+        with st.spinner("Preparazione dei documenti..."):
+            items = self._plan_import_items(store_name, local_file_paths)
+        parents = {Path(item["path"]).name: item for item in items}
+
+        def _mark(kind, file_name):
+            # Il riepilogo riporta sempre il file originale, non la singola parte
+            parent_file = parents[file_name]["parent_file"]
+            if parent_file not in summary[kind]:
+                summary[kind].append(parent_file)
+
+        # 2. Upload e import dei file in parallelo (pool limitato di worker)
+        uploaded_operations = []
+        file_hashes = {}
+        total_files = len(items)
+        my_bar = st.progress(0, text=f"Upload e indicizzazione file per '{chapter_name}'...")
+
+        completed = 0
+        bytes_done = 0
+        start_time = time.time()
+
+        # I worker ereditano la scadenza del chiamante
+        caller_deadline = resilience.current_deadline()
+
+        # Metadati locali estratti in un pool di processi, in parallelo agli upload
+        # (solo per i file il cui contenuto non è già attivo nello store)
+        item_hashes = {item["path"]: self._item_hash(item) for item in items if Path(item["path"]).exists()}
+        to_extract = [
+            path for path, sha256 in item_hashes.items()
+            if not hash_manifest.find_active_document(store_name, sha256)
+        ]
+        extraction = doc_metadata.MetadataExtraction(to_extract, hashes=item_hashes)
+
+        def _worker(item):
+            with resilience.inherit_deadline(caller_deadline):
+                return self._upload_and_import(store_name, chapter_name, item["path"], journal, extraction,
+                                               part=item["part"])
+
+        with extraction, ThreadPoolExecutor(max_workers=min(self.max_workers, total_files)) as executor:
+            futures = {executor.submit(_worker, item): item["path"] for item in items}
+
+            # Gli aggiornamenti UI e del manifest avvengono solo nel thread dello script
+            for future in as_completed(futures):
+                file_name = Path(futures[future]).name
+                completed += 1
                 try:
-                    # Sanitizza il nome del file per l'API Google (max 40 caratteri)
-                    safe_file_name = file_name.lower()
-                    safe_file_name = ''.join(c if c.isalnum() else '-' for c in safe_file_name)
-                    safe_file_name = '-'.join(filter(None, safe_file_name.split('-')))
-
-                    # Tronca il nome per rispettare il limite di 40 caratteri
-                    # Considera anche il timestamp (6 caratteri + trattino)
-                    max_base_length = 33  # 40 - 6 (timestamp) - 1 (trattino)
-                    if len(safe_file_name) > max_base_length:
-                        safe_file_name = safe_file_name[:max_base_length]
-
-                    # Aggiungi timestamp per evitare conflitti
-                    file_timestamp = str(int(time.time()))[-6:]
-                    unique_safe_name = f"{safe_file_name}-{file_timestamp}"
-
-                    # Controllo finale per sicurezza
-                    if len(unique_safe_name) > 40:
-                        unique_safe_name = unique_safe_name[:40]
-
-                    sample_file = self.client.files.upload(
-                        file=file_path,
-                        config={
-                            'name': unique_safe_name,
-                            'display_name': file_name
-                        }
-                    )
+                    result = future.result()
+                    file_hashes[file_name] = result["sha256"]
+                    if result["skipped"]:
+                        _mark("skipped", file_name)
+                        index_journal.update_file(chapter_name, file_name, index_journal.FILE_ACTIVE)
+                        st.info(f"⏭️ {file_name} invariato, già presente nell'indice")
+                    elif result["resumed"]:
+                        uploaded_operations.append((file_name, result["operation"]))
+                        st.info(f"♻️ {file_name}: importazione già avviata, riprendo l'attesa")
+                    else:
+                        uploaded_operations.append((file_name, result["operation"]))
+                        bytes_done += result["size"]
+                        if result["remote_expires_at"]:
+                            hash_manifest.record_remote_file(
+                                result["sha256"], result["remote_file"], result["remote_expires_at"]
+                            )
+                        hash_manifest.record_store_document(
+                            store_name, result["sha256"], file_name,
+                            remote_file=result["remote_file"], state=hash_manifest.DOC_STATE_PENDING,
+                            parent_sha256=result["parent_sha256"]
+                        )
+                        st.success(f"✅ {file_name} uploadato in '{chapter_name}' ({result['elapsed']:.1f}s)")
+                except Exception as e:
+                    log_error_with_context(e, "upload e import file", {"file": file_name, "chapter": chapter_name})
+                    index_journal.update_file(chapter_name, file_name, index_journal.FILE_FAILED, error=str(e))
+                    _mark("failed", file_name)
+                    st.error(f"Errore processamento {file_name}: {str(e)}")
 
-                    # Import con chunking configuration e metadati
-                    import_config = {
-                        'chunking_config': self.chunking_config
-                    }
+                elapsed = max(time.time() - start_time, 1e-6)
+                my_bar.progress(
+                    completed / total_files,
+                    text=f"{completed}/{total_files} · {file_name} · {_format_rate(bytes_done / elapsed)}"
+                )
 
-                    # Aggiungi metadati specifici del capitolo
-                    metadata = self._extract_file_metadata(file_name, file_path)
-                    metadata.append({"key": "chapter", "string_value": chapter_name})
+        log_api_call("upload_import_pipeline", f"{len(uploaded_operations)}/{total_files}", time.time() - start_time)
+        my_bar.empty()
 
-                    if metadata:
-                        import_config['custom_metadata'] = metadata
+        if uploaded_operations:
+            # 3. Attesa completamento importazioni (polling unico, scadenza globale)
+            manager = OperationManager(refresh_fn=self._refresh_operation)
+            for file_name, operation in uploaded_operations:
+                manager.add(file_name, operation)
 
-                    operation = self.client.file_search_stores.import_file(
-                        file_search_store_name=file_search_store.name,
-                        file_name=sample_file.name,
-                        config=import_config
+            def _on_import_done(file_name, status, operation, error):
+                if status == STATUS_DONE:
+                    document_name = getattr(getattr(operation, 'response', None), 'document_name', None)
+                    hash_manifest.record_store_document(
+                        store_name, file_hashes[file_name], file_name, document_name=document_name
                     )
-                    uploaded_operations.append(operation)
-                    st.success(f"✅ {file_name} uploadato in '{chapter_name}'")
+                    index_journal.update_file(chapter_name, file_name, index_journal.FILE_ACTIVE,
+                                              document_name=document_name)
+                    _mark("imported", file_name)
+                    st.success(f"✅ {file_name} indicizzato con successo")
+                elif status == STATUS_TIMEOUT:
+                    # Resta 'import_started' nel journal: la prossima esecuzione riprende l'attesa
+                    _mark("failed", file_name)
+                    st.warning(f"⚠️ {file_name} - Timeout nell'indicizzazione")
+                else:
+                    hash_manifest.remove_store_document(store_name, file_hashes[file_name])
+                    index_journal.update_file(chapter_name, file_name, index_journal.FILE_FAILED, error=error)
+                    _mark("failed", file_name)
+                    st.error(f"❌ Errore importazione {file_name}: {error}")
 
-                except Exception as e:
-                    st.error(f"Errore processamento {file_name}: {str(e)}")
+            with st.spinner(f"Attesa indicizzazione file per '{chapter_name}'..."):
+                manager.wait_all(timeout=resilience.remaining(INDEXING_TIMEOUT), on_complete=_on_import_done)
+
+        # Un file diviso conta come importato solo se lo sono tutte le sue parti
+        for kind in ("imported", "skipped"):
+            summary[kind] = [name for name in summary[kind] if name not in summary["failed"]]
+        summary["skipped"] = [name for name in summary["skipped"] if name not in summary["imported"]]
+
+        # Il contenuto originale di un file diviso e completo risulta attivo nello store
+        for item in items:
+            part = item["part"]
+            if part and part["part_index"] == 1 and item["parent_file"] not in summary["failed"]:
+                hash_manifest.record_store_document(store_name, part["parent_sha256"], item["parent_file"])
+
+        if not summary["failed"]:
+            index_journal.complete_journal(chapter_name)
+        if summary["imported"]:
+            answer_cache.invalidate_store(store_name)
+            document_browser.invalidate(store_name)
+        return summary
+
+    @staticmethod
+    def _item_hash(item):
+        """Hash del contenuto da importare: le parti usano quello registrato in parts.json."""
+        return item["part"]["sha256"] if item["part"] else hash_manifest.get_file_hash(item["path"])
+
+    def _plan_import_items(self, store_name, local_file_paths):
+        """
+        Elenco dei documenti da caricare: i file oltre la soglia di divisione
+        (e non già attivi nello store) vengono sostituiti dalle loro parti.
+        """
+        items = []
+        for file_path in local_file_paths:
+            parent_file = Path(file_path).name
+            sha256 = hash_manifest.get_file_hash(file_path)
+            parts = []
+            if not hash_manifest.find_active_document(store_name, sha256) and doc_splitter.needs_split(file_path):
+                parts = doc_splitter.split_document(file_path, sha256)
+
+            if not parts:
+                items.append({"path": file_path, "parent_file": parent_file, "part": None})
+                continue
+            for part in parts:
+                items.append({
+                    "path": part["path"],
+                    "parent_file": parent_file,
+                    "part": dict(part, parent_file=parent_file, parent_sha256=sha256)
+                })
+        return items
 
-            my_bar.empty()
+    def list_store_documents(self, store_name):
+        """Elenca tutti i documenti di uno store (paginazione gestita dal client)."""
+        if not self.is_configured:
+            return []
+        return resilience.call(
+            "documents.list",
+            lambda: list(self.client.file_search_stores.documents.list(parent=store_name))
+        )
 
-            if not uploaded_operations:
-                st.error("Nessun file è stato caricato correttamente.")
-                return None
+    def delete_store_document(self, document_name):
+        """Elimina un singolo documento (e i suoi chunk) da uno store."""
+        if not self.is_configured:
+            return False
+        try:
+            resilience.call(
+                "documents.delete",
+                lambda: self.client.file_search_stores.documents.delete(name=document_name, config={'force': True})
+            )
+            return True
+        except Exception as e:
+            if resilience.is_not_found(e):
+                return True
+            log_error_with_context(e, "eliminazione documento", {"document_name": document_name})
+            return False
 
-            # 3. Attesa completamento importazioni
-            with st.spinner(f"Attesa indicizzazione file per '{chapter_name}'..."):
-                for i, operation in enumerate(uploaded_operations):
-                    file_name = Path(local_file_paths[i]).name
-
-                    max_wait_time = 300  # 5 minuti massimo per file
-                    start_time = time.time()
-
-                    while not operation.done and (time.time() - start_time) < max_wait_time:
-                        time.sleep(5)
-                        try:
-                            operation = self.client.operations.get(operation)
-                        except Exception:
-                            break
-
-                    # Controlla il risultato dell'operazione
-                    if hasattr(operation, 'result') and operation.result:
-                        st.success(f"✅ {file_name} indicizzato con successo")
-                    elif hasattr(operation, 'error') and operation.error:
-                        st.error(f"❌ Errore importazione {file_name}: {operation.error}")
+    @staticmethod
+    def _get_custom_metadata_value(document, key):
+        """Valore (stringa o numerico) di una voce di custom_metadata di un documento, o None."""
+        for item in getattr(document, 'custom_metadata', None) or []:
+            if getattr(item, 'key', None) == key:
+                value = getattr(item, 'string_value', None)
+                return value if value is not None else getattr(item, 'numeric_value', None)
+        return None
+
+    def sync_store_with_notebook(self, store_name, chapter_name, local_file_paths):
+        """
+        Sincronizzazione incrementale di uno store esistente con i file del quadernino:
+        importa solo i file nuovi o modificati ed elimina solo i documenti rimossi.
+        Ritorna un riepilogo con 'added', 'updated', 'removed', 'unchanged' e 'failed'.
+        """
+        summary = {"added": [], "updated": [], "removed": [], "unchanged": [], "failed": []}
+        if not self.is_configured:
+            return summary
+
+        with st.spinner("Confronto tra file del quadernino e documenti indicizzati..."):
+            documents = self.list_store_documents(store_name)
+
+            # Documenti nello store raggruppati per nome file originale
+            # (le parti di un file diviso contano come il file di origine).
+            # Un documento in indicizzazione (pending) conta come presente, così non
+            # viene importato di nuovo; quelli falliti vanno sempre sostituiti.
+            store_docs = {}
+            known_hashes = {}
+            present_parts = {}
+            legacy_names = set()
+            for doc in documents:
+                file_name = (self._get_custom_metadata_value(doc, "parent_file")
+                             or self._get_custom_metadata_value(doc, "file_name")
+                             or getattr(doc, 'display_name', ''))
+                sha256 = self._get_custom_metadata_value(doc, "content_sha256")
+                parent_sha = self._get_custom_metadata_value(doc, "parent_sha256")
+                state = getattr(getattr(doc, 'state', None), 'name', '')
+                failed = state == "STATE_FAILED"
+                store_docs.setdefault(file_name, []).append((doc, parent_sha or sha256, failed))
+                if failed:
+                    continue
+                if not sha256:
+                    # Indicizzato prima degli hash di contenuto: confrontato solo per nome
+                    legacy_names.add(file_name)
+                    continue
+                doc_state = hash_manifest.DOC_STATE_ACTIVE if state == "STATE_ACTIVE" else hash_manifest.DOC_STATE_PENDING
+                known_hashes[sha256] = {
+                    "file_name": file_name,
+                    "document_name": doc.name,
+                    "state": doc_state
+                }
+                if parent_sha:
+                    known_hashes[sha256]["parent_sha256"] = parent_sha
+                    part_count = int(self._get_custom_metadata_value(doc, "part_count") or 0)
+                    entry = present_parts.setdefault(parent_sha, [file_name, part_count, 0, True])
+                    entry[2] += 1
+                    entry[3] = entry[3] and doc_state == hash_manifest.DOC_STATE_ACTIVE
+
+            # Un file diviso è presente solo quando lo sono tutte le sue parti
+            # (attivo se tutte sono attive, altrimenti ancora in indicizzazione)
+            for parent_sha, (file_name, part_count, present, all_active) in present_parts.items():
+                if part_count and present >= part_count:
+                    known_hashes[parent_sha] = {
+                        "file_name": file_name,
+                        "state": hash_manifest.DOC_STATE_ACTIVE if all_active else hash_manifest.DOC_STATE_PENDING
+                    }
+
+            # Il manifest locale viene riallineato allo stato reale dello store
+            hash_manifest.replace_store_documents(store_name, known_hashes)
+
+            local_files = {Path(p).name: p for p in local_file_paths}
+            local_hashes = {name: hash_manifest.get_file_hash(path) for name, path in local_files.items()}
+            current_hashes = set(local_hashes.values())
+
+            # Un file è invariato se il suo contenuto è già nello store (o, per i
+            # documenti senza hash, se nello store c'è un documento con lo stesso nome)
+            to_import = []
+            for file_name, file_path in local_files.items():
+                if local_hashes[file_name] in known_hashes or file_name in legacy_names:
+                    summary["unchanged"].append(file_name)
+                else:
+                    to_import.append(file_path)
+
+            # Documenti da eliminare: contenuto non più presente tra i file locali
+            # (file rimossi dal quadernino o versioni superate di file modificati),
+            # documenti senza hash di file non più nel quadernino e documenti falliti
+            obsolete_docs = {}
+            for file_name, docs in store_docs.items():
+                for doc, doc_sha, failed in docs:
+                    if doc_sha is None:
+                        obsolete = failed or file_name not in local_files
                     else:
-                        if operation.done:
-                            st.success(f"✅ {file_name} indicizzato con successo")
-                        else:
-                            st.warning(f"⚠️ {file_name} - Timeout nell'indicizzazione")
+                        obsolete = failed or doc_sha not in current_hashes
+                    if obsolete:
+                        obsolete_docs.setdefault(file_name, []).append(doc)
+
+        log_info(f"Sync '{chapter_name}': {len(to_import)} da importare, "
+                 f"{sum(len(d) for d in obsolete_docs.values())} documenti da rimuovere, "
+                 f"{len(summary['unchanged'])} invariati")
+
+        # 1. Import dei soli file nuovi o modificati
+        if to_import:
+            result = self.import_files_to_store(store_name, chapter_name, to_import)
+            summary["failed"].extend(result["failed"])
+            for file_name in result["imported"] + result["skipped"]:
+                target = "updated" if file_name in store_docs else "added"
+                summary[target].append(file_name)
+
+        # 2. Eliminazione dei documenti obsoleti: le vecchie versioni di un file
+        #    restano nello store se la nuova versione non è stata importata
+        to_delete = []
+        for file_name, docs in obsolete_docs.items():
+            if file_name in summary["failed"]:
+                continue
+            to_delete.extend(docs)
+            if file_name not in local_files:
+                summary["removed"].append(file_name)
+
+        if to_delete:
+            with st.spinner(f"Rimozione di {len(to_delete)} documenti superati..."):
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_delete))) as executor:
+                    results = list(executor.map(lambda d: (d, self.delete_store_document(d.name)), to_delete))
+            for doc, ok in results:
+                if not ok:
+                    summary["failed"].append(getattr(doc, 'display_name', doc.name))
+                    continue
+                # Un documento fallito può avere lo stesso contenuto di quello appena reimportato
+                for key in ("content_sha256", "parent_sha256"):
+                    doc_sha = self._get_custom_metadata_value(doc, key)
+                    if doc_sha and doc_sha not in current_hashes:
+                        hash_manifest.remove_store_document(store_name, doc_sha)
+            answer_cache.invalidate_store(store_name)
+            document_browser.invalidate(store_name)
+
+        return summary
+
+    def _upload_and_import(self, store_name, chapter_name, file_path, journal=None, extraction=None, part=None):
+        """
+        Carica un singolo file (o una parte di un file diviso) e avvia la sua importazione nello store.
+        Se il contenuto è già attivo nello store il file viene saltato; se esiste
+        ancora un file remoto con lo stesso contenuto viene riusato senza upload;
+        se il journal riporta un'importazione già avviata, si riprende quella.
+        Eseguito nei thread del pool: NON deve chiamare funzioni Streamlit.
+        """
+        file_name = Path(file_path).name
+        start_time = time.time()
+        sha256 = part["sha256"] if part else hash_manifest.get_file_hash(file_path)
+
+        result = {
+            "sha256": sha256,
+            "parent_sha256": part["parent_sha256"] if part else None,
+            "skipped": False,
+            "resumed": False,
+            "operation": None,
+            "remote_file": None,
+            "remote_expires_at": None,
+            "size": 0,
+            "elapsed": 0.0
+        }
 
-            st.success(f"✅ Capitolo '{chapter_name}' creato con {len(uploaded_operations)} file!")
-            st.caption(f"📊 Chunking configurato: {self.chunking_config['white_space_config']['max_tokens_per_chunk']} tokens per chunk")
-            return file_search_store.name
+        entry = index_journal.get_file_entry(journal, file_name, sha256) or {}
+        if entry.get("state") == index_journal.FILE_ACTIVE or hash_manifest.find_active_document(store_name, sha256):
+            result["skipped"] = True
+            return result
+
+        if entry.get("state") == index_journal.FILE_IMPORT_STARTED and entry.get("operation"):
+            result.update({
+                "resumed": True,
+                "operation": types.ImportFileOperation(name=entry["operation"]),
+                "remote_file": entry.get("remote_file")
+            })
+            return result
+
+        index_journal.update_file(chapter_name, file_name, index_journal.FILE_HASHED, sha256=sha256)
+
+        remote_file = entry.get("remote_file") or hash_manifest.get_remote_file(sha256)
+        if not remote_file:
+            if not Path(file_path).exists():
+                raise FileNotFoundError(
+                    f"{file_name}: nessuna copia locale e file remoto scaduto, carica di nuovo il file"
+                )
+            sample_file = resilience.call("files.upload", lambda: self.client.files.upload(
+                file=file_path,
+                config={
+                    'name': _make_remote_file_name(file_name),
+                    'display_name': part["display_name"] if part else file_name
+                }
+            ))
+            remote_file = sample_file.name
+            expiration = getattr(sample_file, 'expiration_time', None)
+            result["remote_expires_at"] = expiration.isoformat() if hasattr(expiration, 'isoformat') else None
+            result["size"] = Path(file_path).stat().st_size
+            index_journal.update_file(chapter_name, file_name, index_journal.FILE_UPLOADED, remote_file=remote_file)
+
+        # Import con chunking configuration e metadati
+        profile, chunking_config = self.chunking_config_for(file_path)
+        import_config = {
+            'chunking_config': chunking_config
+        }
 
+        # Aggiungi metadati specifici del capitolo
+        metadata = self._extract_file_metadata(part["parent_file"] if part else file_name, file_path)
+        metadata.append({"key": "chapter", "string_value": chapter_name})
+        metadata.append({"key": "content_sha256", "string_value": sha256})
+        metadata.append({"key": "chunking_profile", "string_value": profile})
+        if part:
+            # Le citazioni di una parte rimandano al documento originale
+            metadata.append({"key": "parent_file", "string_value": part["parent_file"]})
+            metadata.append({"key": "parent_sha256", "string_value": part["parent_sha256"]})
+            metadata.append({"key": "part_index", "numeric_value": part["part_index"]})
+            metadata.append({"key": "part_count", "numeric_value": part["part_count"]})
+        if extraction is not None:
+            metadata.extend(doc_metadata.to_custom_metadata(extraction.get(file_path)))
+        # File Search accetta al massimo 20 voci per documento
+        metadata = metadata[:doc_metadata.MAX_CUSTOM_METADATA]
+
+        if metadata:
+            import_config['custom_metadata'] = metadata
+
+        try:
+            operation = resilience.call("file_search_stores.import_file", lambda: self.client.file_search_stores.import_file(
+                file_search_store_name=store_name,
+                file_name=remote_file,
+                config=import_config
+            ))
         except Exception as e:
-            st.error(f"❌ Errore durante la creazione del File Search Store per '{chapter_name}': {str(e)}")
-            return None
+            if result["size"] or resilience.is_retryable(e):
+                raise
+            # Il file remoto in cache non è più valido: dimenticalo e ricarica
+            hash_manifest.forget_remote_file(sha256)
+            return self._upload_and_import(store_name, chapter_name, file_path, extraction=extraction, part=part)
+
+        index_journal.update_file(chapter_name, file_name, index_journal.FILE_IMPORT_STARTED,
+                                  remote_file=remote_file, operation=operation.name)
+
+        result.update({
+            "operation": operation,
+            "remote_file": remote_file,
+            "elapsed": time.time() - start_time
+        })
+        return result
+
+    def chunking_config_for(self, file_path):
+        """Profilo e chunking_config da usare per un documento."""
+        if self.chunking_config is not None:
+            return "custom", self.chunking_config
+        profile = chunking_profiles.select_profile(file_path, self.chunking_profile)
+        return profile, chunking_profiles.chunking_config(profile)
+
+    def _chunking_description(self):
+        if self.chunking_config is not None:
+            return f"{self.chunking_config['white_space_config']['max_tokens_per_chunk']} tokens per chunk"
+        if self.chunking_profile == chunking_profiles.PROFILE_AUTO:
+            return "profilo automatico per ogni documento"
+        values = chunking_profiles.CHUNKING_PROFILES.get(self.chunking_profile, {})
+        return f"profilo '{self.chunking_profile}' ({values.get('max_tokens_per_chunk')} tokens per chunk)"
 
     def create_or_get_vector_store(self, local_file_paths):
         """
@@ -259,9 +799,98 @@ class GeminiHandler:
         """
         return self.create_vector_store_for_chapter("Generale", local_file_paths)
 
+    def _build_contents(self, prompt, history):
+        """
+        Contenuti della richiesta: cronologia entro il budget di token (turni vecchi
+        compattati in un riassunto) seguita dalla domanda corrente.
+        """
+        if not history or self.history_token_budget <= 0:
+            self.last_history_info = None
+            return prompt
+        contents, info = chat_history.build_contents(
+            self.client, self.model_name, prompt, history, self.history_token_budget
+        )
+        self.last_history_info = info
+        log_info(f"Cronologia inviata: {info['recent']} messaggi recenti, "
+                 f"{info['summarized']} riassunti, {info['dropped']} scartati, "
+                 f"~{info['history_tokens']} token")
+        return contents
+
+    @staticmethod
+    def _estimate_request_tokens(contents):
+        """Stima dei token di una richiesta (input + risposta attesa) per il rate limiter."""
+        if isinstance(contents, str):
+            text = contents
+        else:
+            text = "".join(part.text or "" for content in contents for part in (content.parts or []))
+        return chat_history.estimate_tokens(text) + rate_limiter.DEFAULT_OUTPUT_TOKENS
+
+    def _record_usage(self, operation, usage, latency, store_name=None):
+        """Aggiunge al registro locale i token reali di una risposta (con quadernino e store)."""
+        notebook = next((nb["name"] for nb in load_notebooks()
+                         if store_name and nb.get("store_name") == store_name), None)
+        usage_ledger.record(operation, self.model_name, usage, latency, notebook, store_name)
+
+    def _stream_generation(self, contents, config, label, store_name=None):
+        """
+        Inoltra i chunk di testo man mano che arrivano dall'endpoint di streaming.
+        Registra il time-to-first-token in self.last_ttft e nel log, e i token
+        reali della risposta nel registro di utilizzo.
+        Ritorna (come valore del generatore) l'ultimo chunk ricevuto, che contiene
+        i metadati finali (usage); i grounding_metadata di tutti i chunk sono
+        raccolti in self.last_grounding.
+        """
+        self.last_ttft = None
+        self.last_grounding = []
+        estimated_tokens = self._estimate_request_tokens(contents)
+        start_time = time.time()
+        last_chunk = None
+        has_text = False
+
+        def _open_stream():
+            # La richiesta parte al primo next(): i retry coprono l'attesa del primo chunk
+            stream = self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=contents,
+                config=config
+            )
+            return stream, next(stream, None)
+
+        # Scadenza solo fino al primo chunk: il blocco non attraversa i yield del generatore
+        with resilience.deadline(GENERATION_TIMEOUT):
+            stream, first_chunk = resilience.call(
+                "models.generate_content_stream", _open_stream,
+                model_name=self.model_name, tokens=estimated_tokens
+            )
+        chunks = itertools.chain([first_chunk], stream) if first_chunk is not None else stream
+
+        for chunk in chunks:
+            last_chunk = chunk
+            grounding = getattr(chunk.candidates[0], 'grounding_metadata', None) if chunk.candidates else None
+            if grounding is not None:
+                self.last_grounding.append(grounding)
+            text = chunk.text if chunk.candidates else None
+            if not text:
+                continue
+            if self.last_ttft is None:
+                self.last_ttft = time.time() - start_time
+                log_api_call(f"{label} (ttft)", "first_token", self.last_ttft)
+            has_text = True
+            yield text
+
+        usage = getattr(last_chunk, 'usage_metadata', None) if last_chunk is not None else None
+        rate_limiter.settle_model(self.model_name, estimated_tokens,
+                                  getattr(usage, 'total_token_count', None))
+        self._record_usage(label, usage, time.time() - start_time, store_name)
+
+        if not has_text:
+            yield "Nessuna risposta generata."
+        log_api_call(label, "success", time.time() - start_time)
+        return last_chunk
+
     def generate_response_stream(self, prompt, history=None, vector_store_name=None):
         """
-        Genera una risposta usando File Search come da documentazione ufficiale.
+        Genera una risposta in streaming usando File Search come da documentazione ufficiale.
         """
         if not self.is_configured:
             yield "⚠️ API Key mancante."
@@ -272,47 +901,100 @@ class GeminiHandler:
             return
 
         try:
-            # Usa il client con File Search come da documentazione ufficiale
-            config = types.GenerateContentConfig(
-                system_instruction="""
-                Sei Quadernino, un assistente di studio intelligente e preciso.
-                Il tuo compito è rispondere alle domande dell'utente basandoti ESCLUSIVAMENTE sui documenti forniti nello strumento di ricerca (File Search).
-                NON usare la tua conoscenza generale. Se la risposta non si trova nei documenti, dillo chiaramente: "Non ho trovato questa informazione nei documenti caricati."
-                Cita sempre le tue fonti in modo chiaro alla fine della risposta, usando il nome del file.
-                """
+            yield from self._generate_grounded(prompt, vector_store_name, history, None, "generate_response_stream")
+        except Exception as e:
+            yield _generation_error_message(e)
+
+    def _generate_grounded(self, prompt, vector_store_name, history, metadata_filter, label):
+        """
+        Generazione in streaming con File Search (ed eventuale filtro metadati),
+        servita dalla cache locale quando possibile.
+        Ritorna (come valore del generatore) l'ultimo chunk ricevuto, o None se
+        la risposta arriva dalla cache.
+        """
+        file_search_config = {'file_search_store_names': [vector_store_name]}
+        if metadata_filter:
+            file_search_config['metadata_filter'] = metadata_filter
+        config = types.GenerateContentConfig(
+            system_instruction=SYSTEM_INSTRUCTION,
+            tools=[types.Tool(file_search=types.FileSearch(**file_search_config))]
+        )
+
+        # Risposta già in cache per questo store/versione/modello/filtro: restituita subito.
+        # Le domande di seguito dipendono dalla conversazione: niente cache.
+        cache_key = None
+        if not history:
+            cache_key = answer_cache.make_key(
+                vector_store_name, hash_manifest.get_store_version(vector_store_name),
+                self.model_name, SYSTEM_INSTRUCTION, prompt, metadata_filter or ""
             )
+        cached = answer_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self.last_ttft = 0.0
+            self.last_from_cache = True
+            self.last_citations = cached["citations"]
+            log_api_call(label, "cache_hit", 0)
+            yield cached["answer"]
+            footer = citations.format_footer(self.last_citations)
+            if footer:
+                yield footer
+            return None
+
+        self.last_from_cache = False
+        self.last_citations = []
+        with resilience.deadline(GENERATION_TIMEOUT):
+            contents = self._build_contents(prompt, history)
+        chunks = []
+        response = yield from self._collect(self._stream_generation(contents, config, label, vector_store_name), chunks)
+
+        # Fonti come piè di pagina, ricavate dai grounding chunk (non scritte dal modello);
+        # in cache il testo e le citazioni restano separati
+        self.last_citations = self._extract_citations(self.last_grounding, vector_store_name)
+        footer = citations.format_footer(self.last_citations)
+        if footer:
+            yield footer
+
+        # Si mettono in cache solo risposte complete e non vuote
+        if cache_key and self.last_ttft is not None:
+            answer_cache.put(cache_key, vector_store_name, "".join(chunks), self.last_citations)
+        return response
+
+    def _extract_citations(self, grounding_list, store_name):
+        """
+        Citazioni strutturate di una risposta. I titoli che non riportano il file
+        di origine (es. parti di un file diviso) vengono risolti con la mappa dei
+        documenti dello store, letta una volta e tenuta in cache.
+        """
+        if not grounding_list:
+            return []
+
+        source_map = None
 
-            # Aggiungi File Search se disponibile
-            if vector_store_name:
+        def _resolve(title):
+            nonlocal source_map
+            if source_map is None:
                 try:
-                    # Configura il File Search con l'approccio corretto
-                    file_search_config = types.FileSearch(
-                        file_search_store_names=[vector_store_name]
+                    source_map = citations.get_source_map(
+                        store_name, hash_manifest.get_store_version(store_name),
+                        lambda: self.list_store_documents(store_name)
                     )
-                    config.tools = [
-                        types.Tool(file_search=file_search_config)
-                    ]
                 except Exception as e:
-                    log_error_with_context(e, "configurazione File Search")
-                    # Fallback senza tools
-                    pass
-
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=config
-            )
+                    log_warning(f"Impossibile risolvere i nomi dei documenti citati: {e}")
+                    source_map = {}
+            return source_map.get(title)
 
-            # Simula streaming per compatibilità con l'interfaccia esistente
-            if response.text:
-                for word in response.text.split():
-                    yield word + " "
-                    time.sleep(0.05)  # Simula streaming
-            else:
-                yield "Nessuna risposta generata."
+        return citations.extract_citations(grounding_list, _resolve)
 
-        except Exception as e:
-            yield f"❌ Errore durante la generazione: {str(e)}"
+    @staticmethod
+    def _collect(generator, chunks):
+        """Inoltra i chunk di un generatore salvandoli in `chunks`; ritorna il suo valore finale."""
+        while True:
+            try:
+                text = next(generator)
+            except StopIteration as stop:
+                return stop.value
+            chunks.append(text)
+            yield text
 
     def test_connection(self):
         """Testa la connessione all'API usando il nuovo client."""
@@ -323,12 +1005,23 @@ class GeminiHandler:
             return False
         try:
             # Usa il client per testare la connessione
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents="Test",
-                config=types.GenerateContentConfig(max_output_tokens=10)
+            estimated_tokens = chat_history.estimate_tokens("Test") + 10
+            start_time = time.time()
+            response = resilience.call(
+                "models.generate_content",
+                lambda: self.client.models.generate_content(
+                    model=self.model_name,
+                    contents="Test",
+                    config=types.GenerateContentConfig(max_output_tokens=10)
+                ),
+                model_name=self.model_name, tokens=estimated_tokens,
+                max_attempts=2
             )
-            log_api_call("test_connection", "success", 0)
+            latency = time.time() - start_time
+            usage = getattr(response, 'usage_metadata', None)
+            rate_limiter.settle_model(self.model_name, estimated_tokens, getattr(usage, 'total_token_count', None))
+            self._record_usage("test_connection", usage, latency)
+            log_api_call("test_connection", "success", latency)
             return True
         except Exception as e:
             log_error_with_context(e, "test_connection", {"model": self.model_name})
@@ -340,7 +1033,9 @@ class GeminiHandler:
             return {"has_context": False, "using_file_search": True}
         try:
             # Usa il nuovo client per ottenere le informazioni
-            store = self.client.file_search_stores.get(name=vector_store_name)
+            store = resilience.call(
+                "file_search_stores.get", lambda: self.client.file_search_stores.get(name=vector_store_name)
+            )
 
             # Prova diversi attributi per il conteggio file
             file_count = 0
@@ -377,7 +1072,7 @@ class GeminiHandler:
             return []
         try:
             stores = []
-            for store in self.client.file_search_stores.list():
+            for store in store_inventory.get_inventory(self.api_key).stores():
                 stores.append({
                     'name': store.name,
                     'display_name': getattr(store, 'display_name', store.name),
@@ -392,13 +1087,14 @@ class GeminiHandler:
         if not self.is_configured:
             return None
         try:
-            return self.client.file_search_stores.get(name=store_name)
+            return resilience.call(
+                "file_search_stores.get", lambda: self.client.file_search_stores.get(name=store_name)
+            )
         except Exception as e:
-            error_str = str(e)
             log_error_with_context(e, "recupero File Search store", {"store_name": store_name})
 
             # Se è un errore di permessi, restituisci un'informazione speciale
-            if "PERMISSION_DENIED" in error_str or "403" in error_str:
+            if resilience.is_permission_denied(e):
                 return {"permission_error": True, "store_name": store_name}
 
             return None
@@ -409,9 +1105,20 @@ class GeminiHandler:
             return False
         try:
             config = {'force': True} if force else {}
-            self.client.file_search_stores.delete(name=store_name, config=config)
+            resilience.call(
+                "file_search_stores.delete",
+                lambda: self.client.file_search_stores.delete(name=store_name, config=config)
+            )
+            hash_manifest.remove_store(store_name)
+            store_inventory.forget_store(self.api_key, store_name)
+            answer_cache.invalidate_store(store_name)
             return True
         except Exception as e:
+            if resilience.is_not_found(e):
+                # Già eliminato: basta allineare lo stato locale
+                hash_manifest.remove_store(store_name)
+                answer_cache.invalidate_store(store_name)
+                return True
             log_error_with_context(e, "eliminazione File Search store", {"store_name": store_name, "force": force})
             return False
 
@@ -447,7 +1154,8 @@ class GeminiHandler:
 
     def generate_response_with_metadata_filter(self, prompt, vector_store_name, metadata_filter=None, history=None):
         """
-        Genera una risposta usando File Search con filtro metadati.
+        Genera una risposta usando File Search con filtro metadati
+        (es. costruito da metadata_manager.build_metadata_filter).
         """
         if not self.is_configured:
             yield "⚠️ API Key mancante."
@@ -458,51 +1166,95 @@ class GeminiHandler:
             return
 
         try:
-            # Configura File Search con filtro metadati
-            file_search_config = {
-                'file_search_store_names': [vector_store_name]
-            }
+            yield from self._generate_grounded(
+                prompt, vector_store_name, history, metadata_filter, "generate_response_with_metadata_filter"
+            )
+        except Exception as e:
+            yield _generation_error_message(e)
 
-            if metadata_filter:
-                file_search_config['metadata_filter'] = metadata_filter
+    def answer_question(self, prompt, vector_store_name, metadata_filter=None):
+        """
+        Risposta completa (non in streaming) a una singola domanda sullo store.
+        Ritorna un dizionario con risposta, latenza e conteggio dei token.
+        """
+        file_search_config = {'file_search_store_names': [vector_store_name]}
+        if metadata_filter:
+            file_search_config['metadata_filter'] = metadata_filter
+        config = types.GenerateContentConfig(
+            system_instruction=SYSTEM_INSTRUCTION,
+            tools=[types.Tool(file_search=types.FileSearch(**file_search_config))]
+        )
+
+        estimated_tokens = self._estimate_request_tokens(prompt)
+        start_time = time.time()
+        response = resilience.call(
+            "models.generate_content",
+            lambda: self.client.models.generate_content(model=self.model_name, contents=prompt, config=config),
+            model_name=self.model_name, tokens=estimated_tokens
+        )
+        latency = time.time() - start_time
+
+        usage = getattr(response, 'usage_metadata', None)
+        rate_limiter.settle_model(self.model_name, estimated_tokens, getattr(usage, 'total_token_count', None))
+        self._record_usage("answer_question", usage, latency, vector_store_name)
+        log_api_call("answer_question", "success", latency)
+        grounding = getattr(response.candidates[0], 'grounding_metadata', None) if response.candidates else None
+        sources = self._extract_citations([grounding] if grounding else [], vector_store_name)
+        return {
+            "answer": (response.text if response.candidates else None) or "",
+            "sources": citations.sources_text(sources),
+            "latency_s": round(latency, 3),
+            "prompt_tokens": getattr(usage, 'prompt_token_count', None),
+            "output_tokens": getattr(usage, 'candidates_token_count', None),
+            "total_tokens": getattr(usage, 'total_token_count', None)
+        }
 
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    system_instruction="""
-                    Sei Quadernino, un assistente di studio intelligente e preciso.
-                    Il tuo compito è rispondere alle domande dell'utente basandoti ESCLUSIVAMENTE sui documenti forniti nello strumento di ricerca (File Search).
-                    NON usare la tua conoscenza generale. Se la risposta non si trova nei documenti, dillo chiaramente: "Non ho trovato questa informazione nei documenti caricati."
-                    Cita sempre le tue fonti in modo chiaro alla fine della risposta, usando il nome del file.
-                    """,
-                    tools=[
-                        types.Tool(
-                            file_search=types.FileSearch(**file_search_config)
-                        )
-                    ]
-                )
-            )
+    def run_batch(self, prompts, vector_store_name, run_id, max_workers=None):
+        """
+        Esegue una lista di domande sullo store con concorrenza limitata.
+        Restituisce (generatore) i risultati man mano che arrivano, già salvati
+        nel JSONL del run; le domande completate in un'esecuzione precedente
+        dello stesso run vengono saltate.
+        """
+        if not self.is_configured or not vector_store_name:
+            return
 
-            # Simula streaming per compatibilità
-            if response.text:
-                for word in response.text.split():
-                    yield word + " "
-                    time.sleep(0.05)
-            else:
-                yield "Nessuna risposta generata."
+        done = batch_qa.completed_ids(run_id)
+        pending = [(i, p) for i, p in enumerate(prompts) if batch_qa.question_id(p) not in done]
+        if done:
+            log_info(f"Batch {run_id}: ripresa con {len(done)} domande già completate, {len(pending)} da eseguire")
+        if not pending:
+            return
 
-            # Aggiungi citazioni se disponibili
-            if hasattr(response, 'candidates') and response.candidates:
-                for candidate in response.candidates:
-                    if hasattr(candidate, 'grounding_metadata'):
-                        yield f"\n\n📚 **Fonti:**\n"
-                        for citation in candidate.grounding_metadata:
-                            if hasattr(citation, 'file_name'):
-                                yield f"• {citation.file_name}\n"
+        workers = max(1, min(max_workers or batch_qa.DEFAULT_BATCH_WORKERS, len(pending)))
+        # Scadenza dell'intera esecuzione, applicata nei worker
+        batch_deadline = resilience.deadline_in(BATCH_TIMEOUT)
+
+        def _worker(prompt):
+            with resilience.inherit_deadline(batch_deadline):
+                return self.answer_question(prompt, vector_store_name)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_worker, prompt): (index, prompt) for index, prompt in pending}
+            for future in as_completed(futures):
+                index, prompt = futures[future]
+                record = {
+                    "index": index,
+                    "question_id": batch_qa.question_id(prompt),
+                    "prompt": prompt,
+                    "model": self.model_name,
+                    "error": None
+                }
+                try:
+                    record.update(future.result())
+                except Exception as e:
+                    log_error_with_context(e, "domanda batch", {"run_id": run_id, "index": index})
+                    record["error"] = str(e)
+                batch_qa.append_result(run_id, record)
+                yield record
 
-        except Exception as e:
-            yield f"❌ Errore durante la generazione: {str(e)}"
+        log_api_call("run_batch", f"{len(pending)} domande", time.time() - start_time)
 
     def cleanup_resources(self, vector_store_name):
         """Pulisce il File Search Store su Google usando i nuovi metodi."""
@@ -2,66 +2,108 @@
 Monitoraggio dell'utilizzo delle API Google Gemini e File Search
 Fornisce informazioni su consumo, limiti e occupazione memoria
 """
-import os
-from typing import Dict, List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
 from utils.logger import log_info, log_error, log_warning
+from utils import answer_cache, document_browser, hash_manifest, rate_limiter, resilience, usage_ledger
+from utils.client_pool import get_client
+from utils.store_inventory import get_inventory
 
 class GoogleMonitor:
     """Classe per monitorare l'utilizzo delle API Google"""
 
+    # Limiti noti delle API Google Gemini (2024)
+    LIMITS = {
+        "gemini_2.5_flash": {
+            "rpm_limit": 15,  # richieste per minuto
+            "tpm_limit": 1000000,  # token per minuto
+            "files_per_store": 500,  # max file per File Search store
+            "total_files": 10000  # max total files
+        },
+        "gemini_2.0_flash": {
+            "rpm_limit": 15,
+            "tpm_limit": 1000000,
+            "files_per_store": 500,
+            "total_files": 10000
+        },
+        "gemini_2.5_pro": {
+            "rpm_limit": 2,
+            "tpm_limit": 50000,
+            "files_per_store": 500,
+            "total_files": 10000
+        }
+    }
+
+    # Costi stimati (USD)
+    COSTS = {
+        "gemini_2.5_flash": {
+            "input_per_1m": 0.075,  # $0.075 per milione di token
+            "output_per_1m": 0.15
+        },
+        "gemini_2.0_flash": {
+            "input_per_1m": 0.075,
+            "output_per_1m": 0.15
+        },
+        "gemini_2.5_pro": {
+            "input_per_1m": 1.25,
+            "output_per_1m": 5.0
+        }
+    }
+
+    # Finestre del registro di utilizzo: giorni per la media/proiezione, storico, picco al minuto
+    USAGE_TREND_DAYS = 7
+    USAGE_HISTORY_DAYS = 30
+    PEAK_WINDOW_SECONDS = 3600
+
+    # Soglie (byte) della distribuzione per dimensione dei documenti
+    SMALL_FILE_BYTES = 1024 * 1024
+    LARGE_FILE_BYTES = 5 * 1024 * 1024
+
+    # Eliminazione di più store: concorrenza e verifica con backoff
+    DELETE_WORKERS = 4
+    DELETE_VERIFY_ATTEMPTS = 5
+    DELETE_VERIFY_BASE_DELAY = 0.5
+    DELETE_VERIFY_MAX_DELAY = 4.0
+
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.client = None
-
-        # Limiti noti delle API Google Gemini (2024)
-        self.LIMITS = {
-            "gemini_2.5_flash": {
-                "rpm_limit": 15,  # richieste per minuto
-                "tpm_limit": 1000000,  # token per minuto
-                "files_per_store": 500,  # max file per File Search store
-                "total_files": 10000  # max total files
-            },
-            "gemini_2.0_flash": {
-                "rpm_limit": 15,
-                "tpm_limit": 1000000,
-                "files_per_store": 500,
-                "total_files": 10000
-            },
-            "gemini_2.5_pro": {
-                "rpm_limit": 2,
-                "tpm_limit": 50000,
-                "files_per_store": 500,
-                "total_files": 10000
-            }
-        }
-
-        # Costi stimati (USD)
-        self.COSTS = {
-            "gemini_2.5_flash": {
-                "input_per_1m": 0.075,  # $0.075 per milione di token
-                "output_per_1m": 0.15
-            },
-            "gemini_2.0_flash": {
-                "input_per_1m": 0.075,
-                "output_per_1m": 0.15
-            },
-            "gemini_2.5_pro": {
-                "input_per_1m": 1.25,
-                "output_per_1m": 5.0
-            }
-        }
+        # Fotografia condivisa dell'elenco degli store (una lettura per refresh)
+        self.inventory = get_inventory(api_key)
 
     def _get_client(self):
         """Ottiene il client Google se non esiste"""
         if not self.client:
             try:
-                from google import genai
-                self.client = genai.Client(api_key=self.api_key)
+                self.client = get_client(self.api_key)
             except Exception as e:
                 log_error(f"Errore inizializzazione client Google: {e}")
                 return None
         return self.client
 
+    def _list_stores(self) -> List:
+        """Elenco degli store dall'inventario condiviso (riletto solo se scaduto)."""
+        return self.inventory.stores()
+
+    @staticmethod
+    def _to_mb(size_bytes: int) -> float:
+        return round(size_bytes / (1024 * 1024), 1)
+
+    def refresh_inventory(self):
+        """Forza la rilettura dell'elenco degli store alla prossima richiesta."""
+        self.inventory.invalidate()
+
+    def _get_store(self, store_id: str):
+        """Store per nome, o None se non esiste."""
+        client = self._get_client()
+        try:
+            return resilience.call("file_search_stores.get", lambda: client.file_search_stores.get(name=store_id))
+        except Exception as e:
+            if resilience.is_not_found(e):
+                return None
+            raise
+
     def get_file_search_stats(self) -> Dict:
         """
         Recupera statistiche sui File Search stores
@@ -79,12 +121,11 @@ class GoogleMonitor:
                 "quadernino_files": 0
             }
 
-            # Scansiona tutti i File Search stores
-            stores = list(client.file_search_stores.list())
+            # Scansiona tutti i File Search stores (occupazione reale dalla stessa fotografia)
+            stores = self._list_stores()
+            storage = self.inventory.storage()
             stats["total_stores"] = len(stores)
 
-            total_size_estimated = 0
-
             for store in stores:
                 store_display = getattr(store, 'display_name', '')
                 store_name = getattr(store, 'name', '')
@@ -96,7 +137,7 @@ class GoogleMonitor:
                                      store_display.startswith('Quadernino RAG Store') or
                                      'Quadernino' in store_display),
                     "file_count": 0,
-                    "size_estimate": 0
+                    "size_bytes": storage["stores"].get(store_name, {}).get("bytes", 0)
                 }
 
                 # Conta file (varie fonti possibili)
@@ -119,7 +160,6 @@ class GoogleMonitor:
 
                 store_info["file_count"] = file_count
                 stats["total_files"] += file_count
-                total_size_estimated += file_count * 1024 * 1024  # Stima 1MB per file
 
                 if store_info["is_quadernino"]:
                     stats["quadernino_stores"] += 1
@@ -127,7 +167,9 @@ class GoogleMonitor:
 
                 stats["stores"].append(store_info)
 
-            stats["total_size_estimate_mb"] = total_size_estimated // (1024 * 1024)
+            stats["total_size_bytes"] = storage["total_bytes"]
+            stats["total_size_mb"] = self._to_mb(storage["total_bytes"])
+            stats["notebooks"] = storage["notebooks"]
 
             log_info(f"Statistiche File Search: {stats['total_stores']} stores, {stats['total_files']} files totali")
             return stats
@@ -136,28 +178,65 @@ class GoogleMonitor:
             log_error(f"Errore recupero statistiche File Search: {e}")
             return {}
 
+    def _usage_cost(self, row: Dict) -> float:
+        """Costo (USD) di una riga aggregata del registro, con i prezzi del suo modello."""
+        costs = self.COSTS.get(rate_limiter.model_limits_key(row.get("model") or ""), self.COSTS["gemini_2.5_flash"])
+        input_tokens = (row["prompt_tokens"] or 0) + (row["tool_use_tokens"] or 0)
+        output_tokens = (row["candidates_tokens"] or 0) + (row["thoughts_tokens"] or 0)
+        return (input_tokens * costs["input_per_1m"] + output_tokens * costs["output_per_1m"]) / 1000000
+
     def get_usage_estimate(self, model_name: str) -> Dict:
         """
-        Stima l'utilizzo corrente e i limiti rimanenti
+        Utilizzo, costi e margine rispetto ai limiti, calcolati dal registro locale
+        dei token reali (utils.usage_ledger)
         """
         try:
             # Ottieni statistiche file
             file_stats = self.get_file_search_stats()
 
             # Estrai nome base modello
-            base_model = model_name.replace("models/", "").split("-")[0] + "_" + model_name.split("-")[1]
+            base_model = rate_limiter.model_limits_key(model_name)
 
             limits = self.LIMITS.get(base_model, self.LIMITS["gemini_2.5_flash"])
             costs = self.COSTS.get(base_model, self.COSTS["gemini_2.5_flash"])
 
             # Calcola occupazione memoria
-            memory_usage_mb = file_stats.get("total_size_estimate_mb", 0)
+            memory_usage_mb = file_stats.get("total_size_mb", 0)
             memory_limit_mb = limits["files_per_store"] * 10  # Stima 10MB per file
             memory_percentage = min(100, (memory_usage_mb / memory_limit_mb * 100)) if memory_limit_mb > 0 else 0
 
-            # Stima usage basato su file e conversazioni
-            estimated_daily_requests = len(file_stats.get("stores", [])) * 5  # 5 richieste per store al giorno
-            estimated_daily_tokens = file_stats.get("total_files", 0) * 1000  # 1000 token per file per chat
+            # Utilizzo reale: aggregazioni per giorno e modello, e per quadernino
+            today = usage_ledger.since_day(0)
+            trend_since = usage_ledger.since_day(self.USAGE_TREND_DAYS - 1)
+            by_day_model = usage_ledger.rollup(("day", "model"), since=usage_ledger.since_day(self.USAGE_HISTORY_DAYS - 1))
+            for row in by_day_model:
+                row["cost"] = self._usage_cost(row)
+
+            today_rows = [r for r in by_day_model if r["day"] == today]
+            trend_rows = [r for r in by_day_model if r["day"] >= trend_since]
+            model_key = model_name.replace("models/", "")
+            model_today = [r for r in today_rows if r["model"] == model_key]
+            model_trend = [r for r in trend_rows if r["model"] == model_key]
+
+            by_day = {}
+            for row in by_day_model:
+                day = by_day.setdefault(row["day"], {"day": row["day"], "requests": 0, "total_tokens": 0, "cost": 0.0})
+                day["requests"] += row["requests"]
+                day["total_tokens"] += row["total_tokens"] or 0
+                day["cost"] += row["cost"]
+
+            by_notebook = usage_ledger.rollup(("notebook", "model"), since=usage_ledger.since_day(self.USAGE_HISTORY_DAYS - 1))
+            notebooks = {}
+            for row in by_notebook:
+                name = row["notebook"] or "(senza quadernino)"
+                entry = notebooks.setdefault(name, {"notebook": name, "requests": 0, "total_tokens": 0, "cost": 0.0})
+                entry["requests"] += row["requests"]
+                entry["total_tokens"] += row["total_tokens"] or 0
+                entry["cost"] += self._usage_cost(row)
+
+            # Margine: picco al minuto dell'ultima ora rispetto ai limiti del modello
+            peak = usage_ledger.peak_minute(model_name, time.time() - self.PEAK_WINDOW_SECONDS)
+            trend_cost = sum(r["cost"] for r in trend_rows)
 
             return {
                 "model": model_name,
@@ -172,22 +251,35 @@ class GoogleMonitor:
                 "api_limits": {
                     "rpm_limit": limits["rpm_limit"],
                     "tpm_limit": limits["tpm_limit"],
-                    "daily_requests_est": estimated_daily_requests,
-                    "daily_tokens_est": estimated_daily_tokens
+                    "peak_rpm": peak["requests"],
+                    "peak_tpm": peak["tokens"],
+                    "rpm_headroom": max(0, limits["rpm_limit"] - peak["requests"]),
+                    "tpm_headroom": max(0, limits["tpm_limit"] - peak["tokens"]),
+                    "requests_today": sum(r["requests"] for r in model_today),
+                    "tokens_today": sum(r["total_tokens"] or 0 for r in model_today),
+                    "daily_requests_avg": round(sum(r["requests"] for r in model_trend) / self.USAGE_TREND_DAYS, 1),
+                    "daily_tokens_avg": round(sum(r["total_tokens"] or 0 for r in model_trend) / self.USAGE_TREND_DAYS)
                 },
                 "costs": {
                     "input_per_million": costs["input_per_1m"],
                     "output_per_million": costs["output_per_1m"],
-                    "estimated_monthly_cost": round(estimated_daily_tokens * costs["input_per_1m"] * 30 / 1000000, 2)
+                    "cost_today": round(sum(r["cost"] for r in today_rows), 4),
+                    "cost_last_30_days": round(sum(r["cost"] for r in by_day_model), 4),
+                    # Proiezione sul mese dalla media giornaliera degli ultimi giorni
+                    "estimated_monthly_cost": round(trend_cost / self.USAGE_TREND_DAYS * 30, 2)
+                },
+                "usage": {
+                    "by_day": sorted(by_day.values(), key=lambda d: d["day"]),
+                    "by_notebook": sorted(notebooks.values(), key=lambda n: n["total_tokens"], reverse=True)
                 },
-                "health_status": self._calculate_health_status(file_stats, limits)
+                "health_status": self._calculate_health_status(file_stats, limits, peak)
             }
 
         except Exception as e:
             log_error(f"Errore calcolo usage estimate: {e}")
             return {}
 
-    def _calculate_health_status(self, file_stats: Dict, limits: Dict) -> Dict:
+    def _calculate_health_status(self, file_stats: Dict, limits: Dict, peak: Optional[Dict] = None) -> Dict:
         """
         Calcola lo stato di salute del sistema
         """
@@ -216,82 +308,56 @@ class GoogleMonitor:
             status["issues"].append(f"Molti quadernini creati ({quadernino_stores})")
             status["recommendations"].append("Considera di consolidare o rimuovere quadernini vecchi")
 
+        # Controlla il picco reale di richieste/token al minuto (registro di utilizzo)
+        if peak:
+            if peak["requests"] > limits["rpm_limit"] * 0.8 or peak["tokens"] > limits["tpm_limit"] * 0.8:
+                if status["level"] == "good":
+                    status["level"] = "warning"
+                status["issues"].append(
+                    f"Picco vicino ai limiti al minuto ({peak['requests']}/{limits['rpm_limit']} richieste, "
+                    f"{peak['tokens']:,}/{limits['tpm_limit']:,} token)"
+                )
+                status["recommendations"].append("Riduci la concorrenza delle domande in blocco o scegli un modello con limiti più alti")
+
         return status
 
+    def get_store_documents_page(self, store_id: str, page_token: Optional[str] = None) -> Dict:
+        """
+        Una pagina di documenti dello store (paginazione lato server).
+        Ritorna {success, documents, next_page_token}; next_page_token è None sull'ultima pagina.
+        """
+        try:
+            page = document_browser.fetch_page(self.api_key, store_id, page_token)
+            documents = [dict(doc, type=self._get_file_type(doc["name"])) for doc in page["documents"]]
+            return {"success": True, "documents": documents, "next_page_token": page["next_page_token"]}
+        except Exception as e:
+            if resilience.is_not_found(e):
+                return {"success": False, "error": "Store non trovato", "documents": [], "next_page_token": None}
+            log_error(f"Errore lettura documenti store {store_id}: {e}")
+            return {"success": False, "error": str(e), "documents": [], "next_page_token": None}
+
     def get_store_files_detailed(self, store_id: str) -> Dict:
         """
-        Recupera informazioni dettagliate sui file in uno store specifico
+        Recupera informazioni dettagliate su tutti i file in uno store specifico
+        (elenco completo dei documenti, letto pagina per pagina)
         """
         try:
             client = self._get_client()
             if not client:
                 return {}
 
-            # Prova a ottenere lo store specifico
-            store = None
-            try:
-                store = client.file_search_stores.get(name=store_id)
-            except:
-                # Se non trova per nome, cerca nella lista
-                for s in list(client.file_search_stores.list()):
-                    if s.name == store_id:
-                        store = s
-                        break
+            store = self._get_store(store_id)
 
             if not store:
                 return {"error": "Store non trovato", "files": []}
 
-            # Estrai informazioni sui file
-            files_info = []
-            file_count = 0
             store_display = getattr(store, 'display_name', 'Store Sconosciuto')
+            file_count = int(getattr(store, 'active_documents_count', None) or 0)
 
-            # Metodo 1: active_documents_count (se disponibile)
-            if hasattr(store, 'active_documents_count'):
-                active_count = getattr(store, 'active_documents_count', 0)
-                if active_count is not None:
-                    file_count = int(active_count)
-
-            # Metodo 2: file_names (se disponibile)
-            file_names = []
-            if hasattr(store, 'file_names'):
-                try:
-                    file_names = list(getattr(store, 'file_names', []))
-                    file_count = len(file_names)
-                except (ValueError, TypeError):
-                    file_names = []
-
-            # Metodo 3: documenti (se disponibili)
-            documents = []
-            if hasattr(store, 'documents'):
-                try:
-                    documents = list(getattr(store, 'documents', []))
-                    file_count = len(documents)
-                except (ValueError, TypeError):
-                    documents = []
-
-            # Crea elenco file dettagliato
-            all_files = file_names if file_names else []
-
-            for i, file_name in enumerate(all_files):
-                files_info.append({
-                    "name": file_name,
-                    "index": i,
-                    "size_estimate": "1 MB",  # Stima
-                    "type": self._get_file_type(file_name),
-                    "status": "active"
-                })
-
-            # Aggiungi info dai documents se disponibili
-            if documents:
-                for doc in documents:
-                    doc_name = getattr(doc, 'name', f'Documento {len(files_info)}')
-                    files_info.append({
-                        "name": doc_name,
-                        "size_estimate": "1 MB",
-                        "type": self._get_file_type(doc_name),
-                        "status": "from_documents"
-                    })
+            files_info = [
+                dict(doc, type=self._get_file_type(doc["name"]))
+                for doc in document_browser.iter_documents(self.api_key, store_id)
+            ]
 
             return {
                 "store_id": store_id,
@@ -331,7 +397,8 @@ class GoogleMonitor:
             if not client:
                 return {}
 
-            stores = list(client.file_search_stores.list())
+            stores = self._list_stores()
+            storage = self.inventory.storage()
             stores_details = []
 
             for store in stores:
@@ -361,9 +428,9 @@ class GoogleMonitor:
                         except (ValueError, TypeError):
                             file_count = 0
 
-                # Calcola dimensione stimata
-                size_estimate = file_count * 1024 * 1024  # 1MB per file
-                size_mb = size_estimate // (1024 * 1024)
+                # Occupazione reale (size_bytes dello store o manifest locale)
+                store_storage = storage["stores"].get(store_name, {})
+                size_bytes = store_storage.get("bytes", 0)
 
                 store_details = {
                     "name": store_display,
@@ -374,7 +441,9 @@ class GoogleMonitor:
                                      'Quadernino' in store_display),
                     "file_count": file_count,
                     "file_list": file_list[:5],  # Primi 5 file
-                    "size_estimate_mb": size_mb,
+                    "size_bytes": size_bytes,
+                    "size_mb": self._to_mb(size_bytes),
+                    "size_source": store_storage.get("source", "none"),
                     "status": "active"
                 }
                 stores_details.append(store_details)
@@ -386,7 +455,7 @@ class GoogleMonitor:
                 "stores": stores_details,
                 "total_count": len(stores_details),
                 "total_files": sum(s['file_count'] for s in stores_details),
-                "total_size_mb": sum(s['size_estimate_mb'] for s in stores_details),
+                "total_size_mb": self._to_mb(sum(s['size_bytes'] for s in stores_details)),
                 "quadernino_count": sum(1 for s in stores_details if s['is_quadernino']),
                 "other_count": sum(1 for s in stores_details if not s['is_quadernino'])
             }
@@ -398,55 +467,108 @@ class GoogleMonitor:
     def delete_store(self, store_id: str, force: bool = False) -> Dict:
         """
         Cancella un File Search store specifico con verifica post-eliminazione
+        (lettura mirata dello store, senza rileggere l'elenco completo).
         """
         try:
             client = self._get_client()
             if not client:
-                return {"success": False, "error": "Client non disponibile"}
+                return {"success": False, "store_id": store_id, "error": "Client non disponibile"}
 
-            # Controlla se lo store esiste prima di eliminare
-            stores_before = list(client.file_search_stores.list())
-            store_exists_before = any(s.name == store_id for s in stores_before)
-
-            if not store_exists_before:
-                log_warning(f"Store {store_id} non trovato durante eliminazione")
-                return {"success": False, "error": "Store non trovato"}
-
-            # Prova a eliminare lo store
             log_info(f"Tentativo eliminazione store {store_id} (force={force})")
-            if force:
-                client.file_search_stores.delete(name=store_id, config={"force": True})
-            else:
-                client.file_search_stores.delete(name=store_id)
-
-            # Aspetta un momento per la propagazione
-            import time
-            time.sleep(2)
-
-            # Verifica che lo store sia stato eliminato
-            stores_after = list(client.file_search_stores.list())
-            store_exists_after = any(s.name == store_id for s in stores_after)
+            config = {"force": True} if force else None
+            already_deleted = False
+            try:
+                resilience.call(
+                    "file_search_stores.delete",
+                    lambda: client.file_search_stores.delete(name=store_id, config=config)
+                )
+            except Exception as e:
+                if not resilience.is_not_found(e):
+                    raise
+                # Eliminazione idempotente: lo store non esiste più
+                already_deleted = True
 
-            if store_exists_after:
+            if not already_deleted and not self._wait_until_deleted(store_id):
                 log_error(f"Store {store_id} ancora presente dopo eliminazione")
-                return {"success": False, "error": "Store non eliminato (ancora presente dopo tentativo)"}
+                return {"success": False, "store_id": store_id,
+                        "error": "Store non eliminato (ancora presente dopo tentativo)"}
 
+            hash_manifest.remove_store(store_id)
+            answer_cache.invalidate_store(store_id)
+            document_browser.invalidate(store_id)
+            self.inventory.forget(store_id)
             log_info(f"Store {store_id} eliminato con successo")
-            return {"success": True, "store_id": store_id}
+            return {"success": True, "store_id": store_id, "already_deleted": already_deleted}
 
         except Exception as e:
-            error_msg = str(e)
-            log_error(f"Errore eliminazione store {store_id}: {error_msg}")
-
-            # Gestisci errori comuni
-            if "not found" in error_msg.lower():
-                return {"success": False, "error": "Store non trovato o già eliminato"}
-            elif "permission" in error_msg.lower() or "403" in error_msg:
-                return {"success": False, "error": "Permessi insufficienti"}
-            elif "invalid" in error_msg.lower():
-                return {"success": False, "error": "Store ID non valido"}
-            else:
-                return {"success": False, "error": f"Errore: {error_msg}"}
+            log_error(f"Errore eliminazione store {store_id}: {e}")
+            return {"success": False, "store_id": store_id, "error": self._delete_error_message(e)}
+
+    def _wait_until_deleted(self, store_id: str) -> bool:
+        """Attende (backoff esponenziale) che lo store non sia più leggibile; True se eliminato."""
+        delay = self.DELETE_VERIFY_BASE_DELAY
+        for attempt in range(self.DELETE_VERIFY_ATTEMPTS):
+            if self._get_store(store_id) is None:
+                return True
+            if attempt < self.DELETE_VERIFY_ATTEMPTS - 1:
+                time.sleep(delay)
+                delay = min(delay * 2, self.DELETE_VERIFY_MAX_DELAY)
+        return False
+
+    @staticmethod
+    def _delete_error_message(error: Exception) -> str:
+        """Messaggio per un'eliminazione fallita (classificata dal codice HTTP)."""
+        category = resilience.classify_error(error)
+        if category == resilience.ERROR_PERMISSION:
+            return "Permessi insufficienti"
+        if category == resilience.ERROR_INVALID:
+            return "Store ID non valido"
+        if isinstance(error, resilience.CircuitOpenError) or category == resilience.ERROR_RETRYABLE:
+            return "Servizio Google momentaneamente non disponibile, riprova"
+        return f"Errore: {str(error)}"
+
+    def delete_stores(self, store_ids: List[str], force: bool = True, max_workers: Optional[int] = None,
+                      on_progress: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """
+        Eliminazione di più store in parallelo (concorrenza limitata).
+        `on_progress(completati, totale, risultato)` viene chiamata nel thread del
+        chiamante dopo ogni store, quindi può aggiornare la UI.
+        Ritorna un report con gli store eliminati e quelli falliti (con errore).
+        """
+        report = {"requested": len(store_ids), "deleted": [], "failed": [], "elapsed_s": 0.0}
+        if not store_ids:
+            report["success"] = True
+            return report
+
+        start_time = time.time()
+        workers = max(1, min(max_workers or self.DELETE_WORKERS, len(store_ids)))
+        caller_deadline = resilience.current_deadline()
+
+        def _worker(store_id):
+            with resilience.inherit_deadline(caller_deadline):
+                return self.delete_store(store_id, force=force)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_worker, store_id): store_id for store_id in store_ids}
+            for done, future in enumerate(as_completed(futures), start=1):
+                store_id = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "store_id": store_id, "error": self._delete_error_message(e)}
+                if result.get("success"):
+                    report["deleted"].append(store_id)
+                else:
+                    report["failed"].append({"store_id": store_id, "error": result.get("error", "Errore")})
+                if on_progress:
+                    on_progress(done, len(store_ids), result)
+
+        report["elapsed_s"] = round(time.time() - start_time, 2)
+        report["success"] = not report["failed"]
+        report["partial"] = bool(report["deleted"]) and bool(report["failed"])
+        log_info(f"Eliminazione multipla: {len(report['deleted'])}/{len(store_ids)} store eliminati "
+                 f"in {report['elapsed_s']}s")
+        return report
 
     def cleanup_old_stores(self, days_old: int = 30) -> Dict:
         """
@@ -457,7 +579,8 @@ class GoogleMonitor:
             if not client:
                 return {}
 
-            stores = list(client.file_search_stores.list())
+            stores = self._list_stores()
+            storage = self.inventory.storage()
             old_stores = []
 
             for store in stores:
@@ -471,7 +594,8 @@ class GoogleMonitor:
                         "name": store_display,
                         "store_id": getattr(store, 'name', ''),
                         "created_time": getattr(store, 'create_time', 'unknown'),
-                        "file_count": 0
+                        "file_count": 0,
+                        "size_bytes": storage["stores"].get(getattr(store, 'name', ''), {}).get("bytes", 0)
                     }
 
                     # Conta file per accuratezza
@@ -491,105 +615,187 @@ class GoogleMonitor:
                 "old_stores": old_stores,
                 "count": len(old_stores),
                 "total_files": total_files,
-                "potential_savings_mb": len(old_stores) * 10  # Stima 10MB per store
+                "potential_savings_mb": self._to_mb(sum(s["size_bytes"] for s in old_stores))
             }
 
         except Exception as e:
             log_error(f"Errore analisi cleanup stores: {e}")
             return {}
 
-    def recreate_store_without_files(self, store_id: str, files_to_exclude: List[str]) -> Dict:
+    def cleanup_non_quadernino_stores(self, on_progress: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """
+        Elimina in parallelo gli store non creati da Quadernino (quelli di cleanup_old_stores).
+        Il report di delete_stores viene completato con i nomi degli store ('labels')
+        e con i messaggi di errore pronti da mostrare ('errors').
+        """
+        candidates = self.cleanup_old_stores().get("old_stores", [])
+        labels = {s["store_id"]: s["name"] for s in candidates}
+        report = self.delete_stores(list(labels), force=True, on_progress=on_progress)
+        report["labels"] = labels
+        report["errors"] = [f"{labels.get(f['store_id'], f['store_id'])}: {f['error']}" for f in report["failed"]]
+        return report
+
+    def recreate_store_without_files(self, store_id: str, files_to_exclude: List[str], rebuild: bool = False,
+                                     on_progress: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
         """
-        Ricrea uno store escludendo i file specificati.
-        Funzionalità avanzata per rimozione selettiva di file.
+        Rimuove i file indicati da uno store.
+        Di default elimina in parallelo solo i documenti esclusi (riconosciuti dal
+        file di origine nei custom_metadata, parti comprese), lasciando intatti gli altri.
+        Con rebuild=True crea invece un nuovo store e vi reimporta i file da mantenere
+        dalle copie locali (fallback esplicito, es. per compattare lo store).
         """
         try:
             client = self._get_client()
             if not client:
                 return {"success": False, "error": "Client non disponibile"}
 
-            # Ottieni dettagli store corrente
-            current_store = None
-            try:
-                current_store = client.file_search_stores.get(name=store_id)
-            except:
-                for s in list(client.file_search_stores.list()):
-                    if s.name == store_id:
-                        current_store = s
-                        break
-
+            current_store = self._get_store(store_id)
             if not current_store:
                 return {"success": False, "error": "Store non trovato"}
 
-            # Estrai file correnti
-            current_files = []
-            if hasattr(current_store, 'file_names'):
-                try:
-                    current_files = list(getattr(current_store, 'file_names', []))
-                except (ValueError, TypeError):
-                    current_files = []
-
-            # Filtra file da mantenere (escludi quelli specificati)
-            files_to_keep = [f for f in current_files if f not in files_to_exclude]
+            excluded = set(files_to_exclude)
+            documents = list(document_browser.iter_documents(self.api_key, store_id))
+            to_delete = [d for d in documents if d["source_file"] in excluded or d["name"] in excluded]
 
-            if len(files_to_keep) == len(current_files):
+            if not to_delete:
                 return {"success": False, "error": "Nessun file da rimuovere trovato"}
 
-            if len(files_to_keep) == 0:
-                return {"success": False, "error": "Rimuovere tutti i file richiede eliminazione store completa"}
-
-            # Prepara dati per ricreazione
-            store_name = getattr(current_store, 'display_name', 'Store Ricostruito')
+            if rebuild:
+                kept = [d for d in documents if d not in to_delete]
+                if not kept:
+                    return {"success": False, "error": "Rimuovere tutti i file richiede eliminazione store completa"}
+                return self._rebuild_store(current_store, documents, kept)
+            return self._delete_documents(client, store_id, documents, to_delete, on_progress)
 
-            log_info(f"Ricreazione store '{store_name}': {len(current_files)} -> {len(files_to_keep)} file")
+        except Exception as e:
+            error_msg = str(e)
+            log_error(f"Errore ricreazione store {store_id}: {error_msg}")
+            return {"success": False, "error": f"Errore ricreazione store: {error_msg}"}
 
-            # Crea nuovo store
-            try:
-                new_store = client.file_search_stores.create(
-                    display_name=f"{store_name} (Ricostruito)"
-                )
-                new_store_id = new_store.name
-                log_info(f"Nuovo store creato: {new_store_id}")
-            except Exception as e:
-                return {"success": False, "error": f"Creazione nuovo store fallita: {str(e)}"}
+    def _delete_documents(self, client, store_id: str, documents: List[Dict], to_delete: List[Dict],
+                          on_progress: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """Elimina in parallelo i documenti indicati (una chiamata per documento)."""
+        deleted, failed = [], []
+        workers = max(1, min(self.DELETE_WORKERS, len(to_delete)))
+        caller_deadline = resilience.current_deadline()
 
-            # Tenta di recuperare e ricreare i file da mantenere
-            recreated_files = []
-            failed_files = []
+        def _worker(document):
+            with resilience.inherit_deadline(caller_deadline):
+                try:
+                    resilience.call(
+                        "documents.delete",
+                        lambda: client.file_search_stores.documents.delete(
+                            name=document["document_id"], config={'force': True}
+                        )
+                    )
+                except Exception as e:
+                    if not resilience.is_not_found(e):
+                        raise
 
-            for file_name in files_to_keep:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_worker, doc): doc for doc in to_delete}
+            for done, future in enumerate(as_completed(futures), start=1):
+                document = futures[future]
                 try:
-                    # NOTA: Google File Search API non permette di recuperare direttamente i file
-                    # Questa è una funzione placeholder che richiede implementazione più complessa
-                    # che coinvolge il re-upload dei file locali se disponibili
-                    log_info(f"File da mantenere (implementazione richiesta): {file_name}")
-                    recreated_files.append(file_name)
+                    future.result()
+                    deleted.append(document)
+                    result = {"success": True, "name": document["name"]}
                 except Exception as e:
-                    log_error(f"Errore gestione file {file_name}: {e}")
-                    failed_files.append(file_name)
+                    log_error(f"Errore eliminazione documento {document['document_id']}: {e}")
+                    failed.append({"name": document["name"], "error": str(e)})
+                    result = {"success": False, "name": document["name"], "error": str(e)}
+                if on_progress:
+                    on_progress(done, len(to_delete), result)
+
+        # Allinea lo stato locale: manifest, cache delle risposte e delle pagine, inventario
+        for document in deleted:
+            for sha in (document.get("content_sha256"), document.get("parent_sha256")):
+                if sha:
+                    hash_manifest.remove_store_document(store_id, sha)
+        if deleted:
+            answer_cache.invalidate_store(store_id)
+            document_browser.invalidate(store_id)
+            self.inventory.invalidate()
+
+        removed_files = sorted({d["source_file"] for d in deleted})
+        log_info(f"Rimozione selettiva da {store_id}: {len(deleted)}/{len(to_delete)} documenti eliminati")
+        return {
+            "success": not failed,
+            "mode": "in_place",
+            "store_id": store_id,
+            "original_files": len(documents),
+            "removed_files": len(deleted),
+            "kept_files": len(documents) - len(deleted),
+            "removed": removed_files,
+            "failed_files": failed,
+            "api_calls": len(to_delete),
+            "error": f"{len(failed)} documenti non eliminati" if failed else None,
+            "message": f"Rimossi {len(deleted)} documenti ({len(removed_files)} file) dallo store"
+        }
 
-            # Elimina vecchio store
-            try:
-                client.file_search_stores.delete(name=store_id, config={"force": True})
-                log_info(f"Vecchio store eliminato: {store_id}")
-            except Exception as e:
-                log_warning(f"Eliminazione vecchio store fallita: {e}")
+    def _rebuild_store(self, current_store, documents: List[Dict], kept: List[Dict]) -> Dict:
+        """
+        Fallback: nuovo store con i soli file da mantenere, reimportati dalle copie
+        locali con la pipeline concorrente di GeminiHandler. Il vecchio store viene
+        eliminato solo se tutti i file sono stati reimportati.
+        """
+        # Import locali: gemini_handler dipende da streamlit e dalla UI di indicizzazione
+        from utils.env_manager import load_notebooks, update_notebook_store_name
+        from utils.file_manager import UPLOAD_DIR
+        from utils.gemini_handler import GeminiHandler
+
+        store_id = current_store.name
+        kept_files = sorted({d["source_file"] for d in kept})
+        paths, missing = [], []
+        for file_name in kept_files:
+            path = UPLOAD_DIR / file_name
+            entry = hash_manifest.get_local_file_entry(file_name)
+            remote_available = bool(entry and entry.get("remote_only") and hash_manifest.get_remote_file(entry["sha256"]))
+            if path.exists() or remote_available:
+                paths.append(str(path))
+            else:
+                missing.append(file_name)
+        if missing:
+            return {"success": False, "error": f"Copie locali mancanti, ricostruzione impossibile: {', '.join(missing)}"}
 
-            return {
-                "success": True,
-                "new_store_id": new_store_id,
-                "original_files": len(current_files),
-                "kept_files": len(files_to_keep),
-                "removed_files": len(files_to_exclude),
-                "recreated_files": len(recreated_files),
-                "failed_files": failed_files,
-                "message": f"Store ricostruito con {len(files_to_keep)} file (rimossi {len(files_to_exclude)})"
-            }
+        notebook = next((nb for nb in load_notebooks() if nb.get("store_name") == store_id), None)
+        store_display = getattr(current_store, 'display_name', None) or 'Store Ricostruito'
+        chapter_name = notebook["name"] if notebook else store_display
 
+        try:
+            new_store = resilience.call("file_search_stores.create", lambda: self._get_client().file_search_stores.create(
+                config={'display_name': store_display}
+            ))
         except Exception as e:
-            error_msg = str(e)
-            log_error(f"Errore ricreazione store {store_id}: {error_msg}")
-            return {"success": False, "error": f"Errore ricreazione store: {error_msg}"}
+            return {"success": False, "error": f"Creazione nuovo store fallita: {str(e)}"}
+        new_store_id = new_store.name
+        self.inventory.invalidate()
+        log_info(f"Ricostruzione '{store_display}': {len(kept_files)} file da reimportare in {new_store_id}")
+
+        handler = GeminiHandler(self.api_key, chunking_profile=(notebook or {}).get("chunking_profile"))
+        summary = handler.import_files_to_store(new_store_id, chapter_name, paths)
+        if summary["failed"]:
+            # Il vecchio store resta intatto: si scarta la copia incompleta
+            self.delete_store(new_store_id, force=True)
+            return {"success": False, "error": f"Reimport fallito per: {', '.join(summary['failed'])}"}
+
+        if notebook:
+            update_notebook_store_name(notebook["name"], new_store_id)
+        old_deleted = self.delete_store(store_id, force=True)
+        if not old_deleted.get("success"):
+            log_warning(f"Eliminazione vecchio store fallita: {old_deleted.get('error')}")
+
+        return {
+            "success": True,
+            "mode": "rebuild",
+            "store_id": store_id,
+            "new_store_id": new_store_id,
+            "original_files": len(documents),
+            "kept_files": len(kept),
+            "removed_files": len(documents) - len(kept),
+            "failed_files": [],
+            "message": f"Store ricostruito con {len(kept_files)} file"
+        }
 
     def get_file_analysis_summary(self, store_id: str) -> Dict:
         """
@@ -605,49 +811,64 @@ class GoogleMonitor:
                 "total_files": len(files),
                 "file_types": {},
                 "size_distribution": {"small": 0, "medium": 0, "large": 0},
-                "file_list": []
+                "file_list": [],
+                "failed_files": [],
+                "duplicates": []
             }
 
-            total_size_est = 0
+            # Dimensioni reali dai documenti; se Google non le riporta, dal manifest locale (file interi)
+            local_sizes = hash_manifest.get_storage_summary()["files"]
+            total_size = 0
+            seen = {}
             for file_info in files:
                 file_name = file_info.get('name', 'unknown')
                 file_type = file_info.get('type', 'unknown')
+                size_bytes = file_info.get('size_bytes') or 0
+                if not size_bytes and file_info.get('source_file') == file_name:
+                    size_bytes = local_sizes.get(file_name, 0)
 
                 # Analisi tipi file
                 analysis["file_types"][file_type] = analysis["file_types"].get(file_type, 0) + 1
-
-                # Stima dimensione (logica semplificata)
-                size_est = 1024 * 1024  # 1MB default
-                if "pdf" in file_name.lower():
-                    size_est = 2 * 1024 * 1024  # 2MB per PDF
-                elif "docx" in file_name.lower() or "doc" in file_name.lower():
-                    size_est = 512 * 1024  # 512KB per Word
-
-                total_size_est += size_est
+                total_size += size_bytes
 
                 # Classificazione dimensione
-                if size_est < 1024 * 1024:  # < 1MB
+                if size_bytes < self.SMALL_FILE_BYTES:
                     analysis["size_distribution"]["small"] += 1
-                elif size_est < 5 * 1024 * 1024:  # < 5MB
+                elif size_bytes < self.LARGE_FILE_BYTES:
                     analysis["size_distribution"]["medium"] += 1
                 else:
                     analysis["size_distribution"]["large"] += 1
 
-                analysis["file_list"].append({
+                entry = {
                     "name": file_name,
+                    "document_id": file_info.get('document_id'),
                     "type": file_type,
-                    "size_estimate": f"{size_est // (1024 * 1024)} MB",
+                    "size_bytes": size_bytes,
                     "status": file_info.get('status', 'unknown')
-                })
+                }
+                analysis["file_list"].append(entry)
+                if entry["status"] == "failed":
+                    analysis["failed_files"].append(entry)
+
+                # Stesso documento importato più volte (stesso nome e dimensione)
+                key = (file_name, size_bytes)
+                if key in seen:
+                    analysis["duplicates"].append(entry)
+                else:
+                    seen[key] = entry
 
-            analysis["total_size_estimate_mb"] = total_size_est // (1024 * 1024)
-            analysis["average_file_size_mb"] = analysis["total_size_estimate_mb"] // len(files) if files > 0 else 0
+            analysis["total_size_bytes"] = total_size
+            analysis["total_size_mb"] = self._to_mb(total_size)
+            analysis["average_file_size_mb"] = self._to_mb(total_size // len(files)) if files else 0
+            analysis["largest_files"] = sorted(
+                analysis["file_list"], key=lambda f: f["size_bytes"], reverse=True
+            )[:5]
 
             # Raccomandazioni
             recommendations = []
             if analysis["size_distribution"]["large"] > 0:
                 recommendations.append(f"{analysis['size_distribution']['large']} file grandi trovati - considera compressione")
-            if analysis["total_size_estimate_mb"] > 50:
+            if analysis["total_size_mb"] > 50:
                 recommendations.append("Store di grandi dimensioni - considera cleanup")
             if len(analysis["file_types"]) > 5:
                 recommendations.append("Molti tipi di file differenti - verifica rilevanza")
@@ -670,39 +891,48 @@ class GoogleMonitor:
             if not analysis.get("success"):
                 return analysis
 
+            total_mb = analysis["total_size_mb"]
             suggestions = {
                 "actions": [],
                 "priorities": [],
                 "potential_savings": 0,
-                "estimated_new_size": analysis["total_size_estimate_mb"]
+                "estimated_new_size": total_mb
             }
 
-            # Analizza file per suggerimenti
-            file_types = analysis.get("file_types", {})
+            # Risparmio reale: copie duplicate e documenti non indicizzati
+            duplicates = analysis.get("duplicates", [])
+            if duplicates:
+                duplicate_mb = self._to_mb(sum(f["size_bytes"] for f in duplicates))
+                suggestions["actions"].append(f"{len(duplicates)} documenti duplicati ({duplicate_mb} MB) - elimina le copie")
+                suggestions["priorities"].append("high")
+                suggestions["potential_savings"] += duplicate_mb
+
+            failed = analysis.get("failed_files", [])
+            if failed:
+                failed_mb = self._to_mb(sum(f["size_bytes"] for f in failed))
+                suggestions["actions"].append(f"{len(failed)} documenti con import fallito ({failed_mb} MB) - rimuovili e reimporta")
+                suggestions["priorities"].append("medium")
+                suggestions["potential_savings"] += failed_mb
+
+            # File grandi: quanto pesano davvero sul totale
+            large_files = [f for f in analysis["file_list"] if f["size_bytes"] >= self.LARGE_FILE_BYTES]
+            if large_files and analysis["total_size_bytes"]:
+                large_bytes = sum(f["size_bytes"] for f in large_files)
+                share = large_bytes * 100 / analysis["total_size_bytes"]
+                suggestions["actions"].append(
+                    f"{len(large_files)} file grandi occupano {self._to_mb(large_bytes)} MB ({share:.0f}% dello store) - "
+                    "valuta se sono tutti necessari"
+                )
+                suggestions["priorities"].append("high" if share >= 50 else "medium")
 
             # Suggerimenti per tipi file
+            file_types = analysis.get("file_types", {})
             if file_types.get("Text", 0) > analysis["total_files"] * 0.5:
                 suggestions["actions"].append("Molti file di testo - considera consolidazione")
-                suggestions["priorities"].append("medium")
-                suggestions["potential_savings"] += analysis["total_size_estimate_mb"] * 0.1
-
-            # Suggerimenti per file grandi
-            if analysis["size_distribution"]["large"] > 0:
-                suggestions["actions"].append(f"{analysis['size_distribution']['large']} file grandi - ottimizza comprimendo")
-                suggestions["priorities"].append("high")
-                suggestions["potential_savings"] += analysis["total_size_estimate_mb"] * 0.2
-
-            # Suggerimenti generali
-            if analysis["total_size_estimate_mb"] > 20:
-                suggestions["actions"].append("Store di grandi dimensioni - considera rimozione file non essenziali")
-                suggestions["priorities"].append("high")
-                suggestions["potential_savings"] += analysis["total_size_estimate_mb"] * 0.3
+                suggestions["priorities"].append("low")
 
-            # Calcola nuova dimensione stimata
-            suggestions["estimated_new_size"] = max(
-                1,
-                analysis["total_size_estimate_mb"] - suggestions["potential_savings"]
-            )
+            suggestions["potential_savings"] = round(suggestions["potential_savings"], 1)
+            suggestions["estimated_new_size"] = round(max(0, total_mb - suggestions["potential_savings"]), 1)
 
             # Ordina azioni per priorità
             if suggestions["actions"]:
@@ -711,6 +941,7 @@ class GoogleMonitor:
                 priority_order = {"high": 0, "medium": 1, "low": 2}
                 actions_with_priority.sort(key=lambda x: priority_order.get(x[1], 3))
                 suggestions["actions"] = [action for action, _ in actions_with_priority]
+                suggestions["priorities"] = [priority for _, priority in actions_with_priority]
 
             suggestions["success"] = True
             return suggestions
@@ -720,5 +951,7 @@ class GoogleMonitor:
             return {"success": False, "error": str(e)}
 
 def get_google_monitor(api_key: str) -> GoogleMonitor:
-    """Factory function per ottenere il monitor"""
-    return GoogleMonitor(api_key)
\ No newline at end of file
+    """Factory function per ottenere il monitor (con client preso dal registro condiviso)"""
+    monitor = GoogleMonitor(api_key)
+    monitor._get_client()
+    return monitor
\ No newline at end of file
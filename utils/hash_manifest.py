@@ -0,0 +1,326 @@
+"""
+Manifest locale degli hash SHA-256 dei file.
+Collega il contenuto di ogni file locale ai file remoti (Files API) e ai documenti
+già importati in ciascun File Search Store, per evitare upload ripetuti.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from filelock import FileLock, Timeout
+from utils.logger import log_info, log_error
+
+MANIFEST_FILE = Path("hash_manifest.json")
+MANIFEST_LOCK = Path("hash_manifest.json.lock")
+
+# Dimensione dei blocchi letti durante il calcolo dell'hash (1 MB)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Stati di un documento nello store
+DOC_STATE_PENDING = "pending"
+DOC_STATE_ACTIVE = "active"
+
+# Durata di un file della Files API, se Google non riporta la scadenza
+REMOTE_FILE_TTL_HOURS = 48
+
+
+def _empty_manifest() -> Dict:
+    return {"files": {}, "remote_files": {}, "stores": {}}
+
+
+def _read_manifest_unlocked() -> Dict:
+    if not MANIFEST_FILE.exists():
+        return _empty_manifest()
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for key, value in _empty_manifest().items():
+            data.setdefault(key, value)
+        return data
+    except (IOError, json.JSONDecodeError) as e:
+        log_error(f"Errore lettura hash_manifest.json: {e}")
+        return _empty_manifest()
+
+
+def _load_manifest() -> Dict:
+    """Carica il manifest dal file JSON in modo sicuro (con lock)."""
+    lock = FileLock(str(MANIFEST_LOCK), timeout=10)
+    try:
+        with lock:
+            return _read_manifest_unlocked()
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su hash_manifest.json per la lettura")
+        return _empty_manifest()
+
+
+def _update_manifest(update_fn: Callable[[Dict], None]) -> bool:
+    """Legge, modifica e riscrive il manifest sotto un unico lock (niente aggiornamenti persi)."""
+    lock = FileLock(str(MANIFEST_LOCK), timeout=10)
+    try:
+        with lock:
+            data = _read_manifest_unlocked()
+            update_fn(data)
+            with open(MANIFEST_FILE, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+            return True
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su hash_manifest.json per la scrittura")
+        return False
+    except IOError as e:
+        log_error(f"Errore scrittura hash_manifest.json: {e}")
+        return False
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# --- Hash dei file locali ---
+
+def compute_file_hash(file_path) -> str:
+    """Calcola lo SHA-256 di un file leggendolo a blocchi (memoria costante)."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compute_buffer_hash(buffer) -> str:
+    """Calcola lo SHA-256 di un buffer in memoria a blocchi, senza copiarlo (memoryview)."""
+    view = memoryview(buffer)
+    sha = hashlib.sha256()
+    for offset in range(0, len(view), HASH_CHUNK_SIZE):
+        sha.update(view[offset:offset + HASH_CHUNK_SIZE])
+    return sha.hexdigest()
+
+
+def record_local_hash(file_name: str, sha256: str, size: int, mtime: float) -> bool:
+    """Registra l'hash di un file locale appena salvato."""
+    def _update(data):
+        data["files"][file_name] = {"sha256": sha256, "size": size, "mtime": mtime}
+    return _update_manifest(_update)
+
+
+def record_remote_only_file(file_name: str, sha256: str, size: int) -> bool:
+    """Registra un file caricato direttamente su Google senza conservarne una copia locale."""
+    def _update(data):
+        data["files"][file_name] = {
+            "sha256": sha256, "size": size, "mtime": None, "remote_only": True, "uploaded_at": _now()
+        }
+    return _update_manifest(_update)
+
+
+def _remote_only_available(data: Dict, entry: Dict, now: datetime) -> bool:
+    """
+    True se il file remoto di una voce senza copia locale è ancora utilizzabile:
+    registrato, non scaduto e caricato da meno di REMOTE_FILE_TTL_HOURS ore.
+    """
+    if not _remote_entry_valid(data["remote_files"].get(entry.get("sha256")), now):
+        return False
+    uploaded_at = entry.get("uploaded_at")
+    if not uploaded_at:
+        return True
+    try:
+        return datetime.fromisoformat(uploaded_at) + timedelta(hours=REMOTE_FILE_TTL_HOURS) > now
+    except ValueError:
+        return False
+
+
+def list_remote_only_files(include_expired: bool = False) -> Dict[str, Dict]:
+    """
+    File registrati senza copia locale (nome -> voce del manifest). Senza
+    `include_expired` restano esclusi quelli il cui file remoto è scaduto.
+    """
+    data = _load_manifest()
+    now = datetime.now(timezone.utc)
+    return {
+        name: entry for name, entry in data["files"].items()
+        if entry.get("remote_only") and (include_expired or _remote_only_available(data, entry, now))
+    }
+
+
+def list_expired_remote_only_files() -> List[str]:
+    """Nomi dei file senza copia locale il cui file remoto è scaduto (non più indicizzabili)."""
+    data = _load_manifest()
+    now = datetime.now(timezone.utc)
+    return sorted(
+        name for name, entry in data["files"].items()
+        if entry.get("remote_only") and not _remote_only_available(data, entry, now)
+    )
+
+
+def forget_local_file(file_name: str) -> bool:
+    """Dimentica la voce di un file (es. un file senza copia locale eliminato dall'utente)."""
+    def _update(data):
+        data["files"].pop(file_name, None)
+    return _update_manifest(_update)
+
+
+def purge_expired_remote_only_files() -> List[str]:
+    """Rimuove dal manifest i file senza copia locale ormai scaduti; ritorna i nomi rimossi."""
+    removed = []
+
+    def _update(data):
+        now = datetime.now(timezone.utc)
+        for name, entry in list(data["files"].items()):
+            if entry.get("remote_only") and not _remote_only_available(data, entry, now):
+                del data["files"][name]
+                removed.append(name)
+
+    if not _update_manifest(_update):
+        return []
+    if removed:
+        log_info(f"Manifest hash: dimenticati {len(removed)} file remoti scaduti")
+    return removed
+
+
+def get_file_hash(file_path) -> str:
+    """
+    Restituisce l'hash di un file locale, riusando il valore registrato se
+    dimensione e data di modifica non sono cambiate. Per i file caricati senza
+    copia locale restituisce l'hash registrato al momento dell'upload.
+    """
+    path = Path(file_path)
+    entry = _load_manifest()["files"].get(path.name)
+    if not path.exists() and entry and entry.get("remote_only"):
+        return entry["sha256"]
+
+    stat = path.stat()
+    if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        return entry["sha256"]
+
+    sha256 = compute_file_hash(path)
+    record_local_hash(path.name, sha256, stat.st_size, stat.st_mtime)
+    return sha256
+
+
+def get_local_file_entry(file_name: str) -> Optional[Dict]:
+    """Voce registrata per un file locale (sha256, size, mtime) o None."""
+    return _load_manifest()["files"].get(file_name)
+
+
+def get_storage_summary() -> Dict[str, Dict[str, int]]:
+    """
+    Byte noti localmente: dimensione di ogni file (nome -> byte) e, per ogni
+    store, la somma delle dimensioni dei documenti registrati con contenuto noto.
+    Un file diviso conta una sola volta, con la dimensione del file originale:
+    le sue parti (documenti con `parent_sha256`) non vengono sommate.
+    """
+    data = _load_manifest()
+    file_sizes = {name: entry.get("size") or 0 for name, entry in data["files"].items()}
+    sha_sizes = {entry["sha256"]: entry.get("size") or 0 for entry in data["files"].values() if entry.get("sha256")}
+    store_sizes = {
+        store_name: sum(sha_sizes.get(sha, 0) for sha, document in documents.items()
+                        if not document.get("parent_sha256"))
+        for store_name, documents in data["stores"].items()
+    }
+    return {"files": file_sizes, "stores": store_sizes}
+
+
+# --- File remoti (Files API, scadono dopo ~48 ore) ---
+
+def _remote_entry_valid(entry: Optional[Dict], now: datetime) -> bool:
+    if not entry:
+        return False
+    expires_at = entry.get("expires_at")
+    if expires_at:
+        try:
+            if datetime.fromisoformat(expires_at) <= now:
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def get_remote_file(sha256: str) -> Optional[str]:
+    """Nome di un file remoto ancora valido con questo contenuto, o None."""
+    entry = _load_manifest()["remote_files"].get(sha256)
+    if not _remote_entry_valid(entry, datetime.now(timezone.utc)):
+        return None
+    return entry.get("name")
+
+
+def record_remote_file(sha256: str, remote_name: str, expires_at: Optional[str]) -> bool:
+    def _update(data):
+        data["remote_files"][sha256] = {"name": remote_name, "expires_at": expires_at}
+    return _update_manifest(_update)
+
+
+def forget_remote_file(sha256: str) -> bool:
+    def _update(data):
+        data["remote_files"].pop(sha256, None)
+    return _update_manifest(_update)
+
+
+# --- Documenti negli store ---
+
+def get_store_documents(store_name: str) -> Dict[str, Dict]:
+    """Mappa sha256 -> documento per uno store."""
+    return _load_manifest()["stores"].get(store_name, {})
+
+
+def get_store_version(store_name: str) -> str:
+    """
+    Versione dei contenuti di uno store: hash degli SHA-256 dei documenti attivi.
+    Cambia automaticamente quando lo store viene reindicizzato con contenuti diversi.
+    """
+    documents = get_store_documents(store_name)
+    active = sorted(sha for sha, entry in documents.items() if entry.get("state") == DOC_STATE_ACTIVE)
+    if not active:
+        return "unversioned"
+    return hashlib.sha256("".join(active).encode('utf-8')).hexdigest()[:16]
+
+
+def find_active_document(store_name: str, sha256: str) -> Optional[Dict]:
+    """Documento attivo con questo contenuto nello store, o None."""
+    entry = get_store_documents(store_name).get(sha256)
+    if entry and entry.get("state") == DOC_STATE_ACTIVE:
+        return entry
+    return None
+
+
+def record_store_document(store_name: str, sha256: str, file_name: str,
+                          remote_file: Optional[str] = None, document_name: Optional[str] = None,
+                          state: str = DOC_STATE_ACTIVE, parent_sha256: Optional[str] = None) -> bool:
+    """
+    Registra (o aggiorna) un documento importato in uno store.
+    Le parti di un file diviso riportano `parent_sha256`, l'hash del file originale.
+    """
+    def _update(data):
+        store = data["stores"].setdefault(store_name, {})
+        entry = store.setdefault(sha256, {})
+        entry.update({
+            "file_name": file_name,
+            "state": state,
+            "updated_at": _now()
+        })
+        if remote_file:
+            entry["remote_file"] = remote_file
+        if document_name:
+            entry["document_name"] = document_name
+        if parent_sha256:
+            entry["parent_sha256"] = parent_sha256
+    return _update_manifest(_update)
+
+
+def remove_store_document(store_name: str, sha256: str) -> bool:
+    def _update(data):
+        data["stores"].get(store_name, {}).pop(sha256, None)
+    return _update_manifest(_update)
+
+
+def replace_store_documents(store_name: str, documents: Dict[str, Dict]) -> bool:
+    """Sostituisce i documenti noti di uno store con quelli letti dall'API (riconciliazione)."""
+    def _update(data):
+        data["stores"][store_name] = documents
+    return _update_manifest(_update)
+
+
+def remove_store(store_name: str) -> bool:
+    """Dimentica tutti i documenti di uno store eliminato."""
+    def _update(data):
+        if data["stores"].pop(store_name, None) is not None:
+            log_info(f"Manifest hash: rimosso store {store_name}")
+    return _update_manifest(_update)
@@ -0,0 +1,155 @@
+"""
+Journal di indicizzazione per quadernino.
+Registra lo stato di ogni file durante l'indicizzazione, così che un'esecuzione
+interrotta (browser chiuso, riavvio del server) possa riprendere da dove si era fermata.
+"""
+import json
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from filelock import FileLock, Timeout
+from utils.logger import log_info, log_error
+
+JOURNAL_DIR = Path("index_journals")
+
+# Stati di un file nel journal, in ordine di avanzamento
+FILE_HASHED = "hashed"
+FILE_UPLOADED = "uploaded"
+FILE_IMPORT_STARTED = "import_started"
+FILE_ACTIVE = "active"
+FILE_FAILED = "failed"
+
+# Stati del journal
+JOURNAL_RUNNING = "running"
+JOURNAL_COMPLETED = "completed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _journal_path(notebook_name: str) -> Path:
+    slug = re.sub(r'[^a-z0-9]+', '-', notebook_name.lower()).strip('-') or "quadernino"
+    return JOURNAL_DIR / f"{slug}.json"
+
+
+def _read_unlocked(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, json.JSONDecodeError) as e:
+        log_error(f"Errore lettura journal {path}: {e}")
+        return None
+
+
+def _update_journal(notebook_name: str, update_fn: Callable[[Optional[Dict]], Optional[Dict]]) -> bool:
+    """Legge, modifica e riscrive il journal di un quadernino sotto un unico lock."""
+    JOURNAL_DIR.mkdir(exist_ok=True)
+    path = _journal_path(notebook_name)
+    lock = FileLock(str(path) + ".lock", timeout=10)
+    try:
+        with lock:
+            journal = update_fn(_read_unlocked(path))
+            if journal is None:
+                return False
+            journal["updated_at"] = _now()
+            # Scrittura atomica: un crash a metà non corrompe il journal
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(journal, f, indent=4)
+            tmp_path.replace(path)
+            return True
+    except Timeout:
+        log_error(f"Timeout: Impossibile acquisire il lock sul journal di '{notebook_name}'")
+        return False
+    except IOError as e:
+        log_error(f"Errore scrittura journal di '{notebook_name}': {e}")
+        return False
+
+
+def load_journal(notebook_name: str) -> Optional[Dict]:
+    """Carica il journal di un quadernino (o None se non esiste)."""
+    path = _journal_path(notebook_name)
+    lock = FileLock(str(path) + ".lock", timeout=10)
+    try:
+        with lock:
+            return _read_unlocked(path)
+    except Timeout:
+        log_error(f"Timeout: Impossibile acquisire il lock sul journal di '{notebook_name}'")
+        return None
+
+
+def get_incomplete_journal(notebook_name: str) -> Optional[Dict]:
+    """Journal di un'indicizzazione interrotta, da riprendere, o None."""
+    journal = load_journal(notebook_name)
+    if journal and journal.get("status") == JOURNAL_RUNNING and journal.get("store_name"):
+        return journal
+    return None
+
+
+def start_journal(notebook_name: str, store_name: str) -> bool:
+    """
+    Apre (o riapre) il journal per un'indicizzazione sullo store indicato.
+    Le voci dei file vengono mantenute solo se lo store è lo stesso.
+    """
+    def _update(journal):
+        if not journal or journal.get("store_name") != store_name:
+            journal = {
+                "notebook": notebook_name,
+                "store_name": store_name,
+                "started_at": _now(),
+                "files": {}
+            }
+        journal["status"] = JOURNAL_RUNNING
+        return journal
+
+    log_info(f"Journal indicizzazione aperto per '{notebook_name}' ({store_name})")
+    return _update_journal(notebook_name, _update)
+
+
+def update_file(notebook_name: str, file_name: str, state: str, **fields) -> bool:
+    """Aggiorna lo stato (e i campi opzionali: sha256, remote_file, operation, ...) di un file."""
+    def _update(journal):
+        if journal is None:
+            return None
+        entry = journal["files"].setdefault(file_name, {})
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        entry["state"] = state
+        entry["updated_at"] = _now()
+        return journal
+    return _update_journal(notebook_name, _update)
+
+
+def get_file_entry(journal: Optional[Dict], file_name: str, sha256: str) -> Optional[Dict]:
+    """Voce del journal per un file, solo se riferita allo stesso contenuto."""
+    if not journal:
+        return None
+    entry = journal.get("files", {}).get(file_name)
+    if entry and entry.get("sha256") == sha256:
+        return entry
+    return None
+
+
+def complete_journal(notebook_name: str) -> bool:
+    """Segna l'indicizzazione come conclusa: la prossima esecuzione non riprenderà."""
+    def _update(journal):
+        if journal is None:
+            return None
+        journal["status"] = JOURNAL_COMPLETED
+        return journal
+    return _update_journal(notebook_name, _update)
+
+
+def discard_journal(notebook_name: str) -> bool:
+    """Elimina il journal (es. quando lo store viene cancellato)."""
+    path = _journal_path(notebook_name)
+    try:
+        if path.exists():
+            path.unlink()
+        return True
+    except OSError as e:
+        log_error(f"Errore eliminazione journal di '{notebook_name}': {e}")
+        return False
@@ -1,7 +1,7 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Set
-from utils.logger import log_info, log_error
+from typing import List, Dict, Optional, Set
+from utils.logger import log_info, log_warning, log_error
 
 METADATA_FILE = Path("metadata.json")
 # Usiamo un file di lock anche qui per sicurezza
@@ -131,4 +131,41 @@ def get_all_tags_for_notebook(notebook_name: str) -> List[str]:
     for file_data in files.values():
         for tag in file_data.get("tags", []):
             all_tags.add(tag)
-    return sorted(list(all_tags))
\ No newline at end of file
+    return sorted(list(all_tags))
+
+
+def get_files_with_tags(notebook_name: str, tags: List[str]) -> List[str]:
+    """File del quadernino che hanno almeno uno dei tag indicati."""
+    wanted = set(tags)
+    return sorted(
+        file_name for file_name, file_data in get_notebook_files(notebook_name).items()
+        if wanted.intersection(file_data.get("tags", []))
+    )
+
+
+# Sequenze di escape per i valori stringa nelle espressioni metadata_filter
+_FILTER_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def _quote(value: str) -> str:
+    """Letterale stringa per metadata_filter: backslash, virgolette e a capo vengono escapati."""
+    return '"' + value.translate(_FILTER_ESCAPES) + '"'
+
+
+def build_metadata_filter(notebook_name: str, tags: Optional[List[str]] = None,
+                          file_names: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Espressione `metadata_filter` di File Search che limita la ricerca ai file
+    scelti e a quelli con i tag indicati, es. 'file_name = "a.pdf" OR file_name = "b.pdf"'.
+    I tag sono locali: vengono risolti nei nomi file, che sono nei custom_metadata
+    di ogni documento indicizzato. Ritorna None se non c'è alcun ambito, oppure
+    una stringa vuota se i tag scelti non corrispondono ad alcun file.
+    """
+    if not tags and not file_names:
+        return None
+    selected = set(file_names or [])
+    if tags:
+        selected.update(get_files_with_tags(notebook_name, tags))
+    if not selected:
+        return ""
+    return " OR ".join(f"file_name = {_quote(name)}" for name in sorted(selected))
@@ -0,0 +1,150 @@
+"""
+Catalogo dei modelli Gemini con cache su disco e aggiornamento in background.
+Per ogni modello memorizza le capacità rilevanti per Quadernino
+(supporto a generateContent e compatibilità con File Search).
+"""
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+from filelock import FileLock, Timeout
+from utils.logger import log_info, log_error, log_error_with_context
+from utils import resilience
+from utils.client_pool import get_client
+
+CATALOG_FILE = Path("model_catalog.json")
+CATALOG_LOCK = Path("model_catalog.json.lock")
+
+# Dopo questo intervallo il catalogo viene aggiornato in background
+CATALOG_TTL_SECONDS = 24 * 3600
+
+# Famiglie di modelli compatibili con lo strumento File Search
+FILE_SEARCH_MODEL_PREFIXES = ("gemini-2.5-pro", "gemini-2.5-flash")
+
+_refresh_lock = threading.Lock()
+_refreshing = set()
+
+
+def _key_id(api_key: str) -> str:
+    """Identificativo della API key nel file di cache (mai la chiave in chiaro)."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def supports_file_search(model_name: str) -> bool:
+    """True se il modello appartiene a una famiglia compatibile con File Search."""
+    base_name = model_name.replace("models/", "")
+    return base_name.startswith(FILE_SEARCH_MODEL_PREFIXES)
+
+
+def _fetch_models(api_key: str) -> List[Dict]:
+    """Scarica l'elenco dei modelli dall'API e ne calcola le capacità."""
+    client = get_client(api_key)
+    catalog = []
+    for model in resilience.call("models.list", lambda: list(client.models.list())):
+        name = getattr(model, 'name', '') or ''
+        if 'gemini' not in name:
+            continue
+
+        # Controlla sia supported_generation_methods (vecchio) che supported_actions (nuovo)
+        methods = getattr(model, 'supported_generation_methods', None) or getattr(model, 'supported_actions', None) or []
+        supports_generate = 'generateContent' in methods
+
+        catalog.append({
+            "name": name,
+            "display_name": getattr(model, 'display_name', None) or name,
+            "supports_generate_content": supports_generate,
+            "supports_file_search": supports_generate and supports_file_search(name)
+        })
+    return sorted(catalog, key=lambda m: m["name"], reverse=True)
+
+
+def _read_cache() -> Dict:
+    if not CATALOG_FILE.exists():
+        return {}
+    lock = FileLock(str(CATALOG_LOCK), timeout=5)
+    try:
+        with lock:
+            with open(CATALOG_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su model_catalog.json per la lettura")
+        return {}
+    except (IOError, json.JSONDecodeError) as e:
+        log_error(f"Errore lettura model_catalog.json: {e}")
+        return {}
+
+
+def _write_cache(key_id: str, models: List[Dict]):
+    lock = FileLock(str(CATALOG_LOCK), timeout=5)
+    try:
+        with lock:
+            data = {}
+            if CATALOG_FILE.exists():
+                try:
+                    with open(CATALOG_FILE, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (IOError, json.JSONDecodeError):
+                    data = {}
+            data[key_id] = {"fetched_at": time.time(), "models": models}
+            with open(CATALOG_FILE, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4)
+    except Timeout:
+        log_error("Timeout: Impossibile acquisire il lock su model_catalog.json per la scrittura")
+    except IOError as e:
+        log_error(f"Errore scrittura model_catalog.json: {e}")
+
+
+def refresh_catalog(api_key: str) -> List[Dict]:
+    """Aggiorna subito il catalogo dall'API e lo salva su disco."""
+    try:
+        models = _fetch_models(api_key)
+    except Exception as e:
+        log_error_with_context(e, "aggiornamento catalogo modelli", {"api_key_present": bool(api_key)})
+        return []
+    if models:
+        _write_cache(_key_id(api_key), models)
+        log_info(f"Catalogo modelli aggiornato: {len(models)} modelli")
+    return models
+
+
+def _refresh_in_background(api_key: str):
+    """Avvia un aggiornamento in un thread separato (al massimo uno per API key)."""
+    key_id = _key_id(api_key)
+    with _refresh_lock:
+        if key_id in _refreshing:
+            return
+        _refreshing.add(key_id)
+
+    def _worker():
+        try:
+            refresh_catalog(api_key)
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key_id)
+
+    threading.Thread(target=_worker, name="model-catalog-refresh", daemon=True).start()
+
+
+def get_model_catalog(api_key: str) -> List[Dict]:
+    """
+    Restituisce il catalogo dei modelli. Se in cache viene servito subito
+    (e aggiornato in background quando scaduto); altrimenti viene scaricato.
+    """
+    if not api_key:
+        return []
+    entry = _read_cache().get(_key_id(api_key))
+    if entry and entry.get("models"):
+        if time.time() - entry.get("fetched_at", 0) > CATALOG_TTL_SECONDS:
+            _refresh_in_background(api_key)
+        return entry["models"]
+    return refresh_catalog(api_key)
+
+
+def get_model_info(api_key: str, model_name: str) -> Dict:
+    """Voce del catalogo per un modello (vuota se sconosciuto)."""
+    for model in get_model_catalog(api_key):
+        if model["name"] == model_name:
+            return model
+    return {}
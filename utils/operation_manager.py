@@ -0,0 +1,133 @@
+"""
+Gestione centralizzata delle operazioni a lunga durata (long-running operations)
+Controlla tutte le operazioni in sospeso in un unico ciclo di polling, con backoff
+esponenziale, jitter e una scadenza globale condivisa.
+"""
+import random
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+from utils import resilience
+from utils.logger import log_info, log_warning
+
+# Stati possibili di un'operazione monitorata
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+
+
+def operation_status(operation) -> str:
+    """Stato di default per le operazioni dell'SDK google-genai (done / error)."""
+    if not getattr(operation, 'done', False):
+        return STATUS_PENDING
+    if getattr(operation, 'error', None):
+        return STATUS_FAILED
+    return STATUS_DONE
+
+
+class OperationManager:
+    """
+    Monitora più operazioni contemporaneamente.
+
+    `refresh_fn(operation)` restituisce la versione aggiornata dell'operazione,
+    `status_fn(operation)` la classifica in pending / done / failed.
+    Il tempo totale di attesa dipende dall'operazione più lenta, non dalla somma.
+    """
+
+    def __init__(self, refresh_fn: Callable[[Any], Any],
+                 status_fn: Callable[[Any], str] = operation_status,
+                 initial_delay: float = 1.0, max_delay: float = 15.0,
+                 multiplier: float = 1.6, jitter: float = 0.25,
+                 max_refresh_errors: int = 5):
+        self.refresh_fn = refresh_fn
+        self.status_fn = status_fn
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_refresh_errors = max_refresh_errors
+
+        self._pending: Dict[Hashable, Any] = {}
+        self._errors: Dict[Hashable, int] = {}
+        self.results: Dict[Hashable, Dict] = {}
+
+    def add(self, key: Hashable, operation: Any):
+        """Aggiunge un'operazione da monitorare, identificata da `key`."""
+        self._pending[key] = operation
+        self._errors[key] = 0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _next_delay(self, delay: float) -> float:
+        """Calcola l'attesa successiva (backoff esponenziale con jitter)."""
+        delay = min(self.max_delay, delay * self.multiplier)
+        spread = delay * self.jitter
+        return max(0.1, delay + random.uniform(-spread, spread))
+
+    def _finish(self, key: Hashable, status: str, operation: Any, error: Optional[str],
+                on_complete: Optional[Callable[[Hashable, str, Any, Optional[str]], None]]):
+        """Registra il risultato finale di un'operazione e notifica il chiamante."""
+        self._pending.pop(key, None)
+        self._errors.pop(key, None)
+        self.results[key] = {"status": status, "operation": operation, "error": error}
+        if on_complete:
+            on_complete(key, status, operation, error)
+
+    def wait_all(self, timeout: float = 300,
+                 on_complete: Optional[Callable[[Hashable, str, Any, Optional[str]], None]] = None
+                 ) -> Dict[Hashable, Dict]:
+        """
+        Attende il completamento di tutte le operazioni entro `timeout` secondi totali.
+        `on_complete(key, status, operation, error)` viene chiamato appena ogni
+        operazione termina, nel thread del chiamante (sicuro per Streamlit).
+        """
+        deadline = time.monotonic() + timeout
+        delay = self.initial_delay
+        start_time = time.monotonic()
+
+        # Le operazioni già concluse al momento dell'aggiunta vengono notificate subito
+        for key, operation in list(self._pending.items()):
+            status = self.status_fn(operation)
+            if status != STATUS_PENDING:
+                self._finish(key, status, operation, self._error_message(operation, status), on_complete)
+
+        while self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+
+            for key, operation in list(self._pending.items()):
+                try:
+                    operation = self.refresh_fn(operation)
+                    self._pending[key] = operation
+                    self._errors[key] = 0
+                except Exception as e:
+                    self._errors[key] += 1
+                    log_warning(f"Controllo stato fallito per {key} ({self._errors[key]}/{self.max_refresh_errors}): {e}")
+                    # Gli errori non transitori (es. operazione inesistente) non si risolvono riprovando
+                    if self._errors[key] >= self.max_refresh_errors or not resilience.is_retryable(e):
+                        self._finish(key, STATUS_FAILED, operation, str(e), on_complete)
+                    continue
+
+                status = self.status_fn(operation)
+                if status != STATUS_PENDING:
+                    self._finish(key, status, operation, self._error_message(operation, status), on_complete)
+
+            delay = self._next_delay(delay)
+
+        # Tutto ciò che resta oltre la scadenza globale va in timeout
+        for key, operation in list(self._pending.items()):
+            self._finish(key, STATUS_TIMEOUT, operation, "Timeout", on_complete)
+
+        log_info(f"OperationManager: {len(self.results)} operazioni concluse in {time.monotonic() - start_time:.1f}s")
+        return self.results
+
+    @staticmethod
+    def _error_message(operation: Any, status: str) -> Optional[str]:
+        if status != STATUS_FAILED:
+            return None
+        error = getattr(operation, 'error', None)
+        return str(error) if error else "Elaborazione fallita"
@@ -0,0 +1,202 @@
+"""
+Rate limiter lato client condiviso dall'intero processo.
+Un token bucket per le richieste (RPM) e uno per i token (TPM) per ogni modello,
+con i limiti presi da GoogleMonitor.LIMITS. Chi supera il limite viene messo in
+coda (FIFO) invece di ricevere un errore 429 dall'API.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from utils.logger import log_info, log_warning
+
+# Chiave del limiter per le chiamate di gestione (file, store, operazioni)
+MANAGEMENT_KEY = "file_search_api"
+
+# Limiti per le chiamate di gestione, non coperti da GoogleMonitor.LIMITS
+try:
+    MANAGEMENT_RPM = int(os.getenv("MANAGEMENT_RPM", 300))
+except ValueError:
+    MANAGEMENT_RPM = 300
+
+DEFAULT_LIMITS_KEY = "gemini_2.5_flash"
+
+# Token di output stimati per una risposta (corretti a posteriori con usage_metadata)
+DEFAULT_OUTPUT_TOKENS = 1000
+
+# Attese più lunghe di questa soglia vengono segnalate nel log
+SLOW_WAIT_SECONDS = 5.0
+
+
+def model_limits_key(model_name: str) -> str:
+    """
+    Chiave di GoogleMonitor.LIMITS per un modello:
+    'models/gemini-2.5-flash-lite' -> 'gemini_2.5_flash'.
+    """
+    from utils.google_monitor import GoogleMonitor
+
+    parts = (model_name or "").replace("models/", "").split("-")
+    if len(parts) >= 3:
+        key = "_".join(parts[:3])
+        if key in GoogleMonitor.LIMITS:
+            return key
+    return DEFAULT_LIMITS_KEY
+
+
+class TokenBucket:
+    """Bucket con capacità `capacity` che si ricarica di `capacity` unità al minuto."""
+
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Secondi necessari perché il bucket contenga `amount` unità (0 se già disponibili)."""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Corregge il livello (positivo = rimborso, negativo = addebito extra)."""
+        self.refill()
+        self.level = min(self.capacity, self.level + delta)
+
+
+class ModelLimiter:
+    """Coppia di bucket RPM/TPM con coda FIFO dei chiamanti in attesa."""
+
+    def __init__(self, key: str, rpm_limit: int, tpm_limit: int):
+        self.key = key
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit) if tpm_limit else None
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._next_ticket = 0
+        self.total_wait = 0.0
+        self.total_calls = 0
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = self.requests.wait_time(1)
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> float:
+        """
+        Blocca finché c'è capacità per una richiesta da `tokens` token.
+        Ritorna i secondi di attesa; solleva TimeoutError se `timeout` scade.
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            try:
+                while True:
+                    wait = self._wait_time(tokens) if self._queue[0] == ticket else None
+                    if wait == 0.0:
+                        break
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start)
+                        if remaining <= 0:
+                            raise TimeoutError(f"Rate limit {self.key}: attesa oltre {timeout}s")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+
+                self.requests.consume(1)
+                if self.tokens is not None and tokens:
+                    self.tokens.consume(tokens)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.total_wait += waited
+            self.total_calls += 1
+        if waited > SLOW_WAIT_SECONDS:
+            log_warning(f"Rate limiter {self.key}: richiesta in coda per {waited:.1f}s")
+        return waited
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Allinea il bucket TPM ai token effettivamente consumati dalla risposta."""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._cond:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def status(self) -> Dict:
+        with self._cond:
+            self.requests.refill()
+            status = {
+                "rpm_limit": int(self.requests.capacity),
+                "requests_available": round(self.requests.level, 1),
+                "queue_depth": len(self._queue),
+                "total_calls": self.total_calls,
+                "avg_wait_s": round(self.total_wait / self.total_calls, 3) if self.total_calls else 0.0
+            }
+            fills = [self.requests.level / self.requests.capacity]
+            if self.tokens is not None:
+                self.tokens.refill()
+                status["tpm_limit"] = int(self.tokens.capacity)
+                status["tokens_available"] = int(self.tokens.level)
+                fills.append(self.tokens.level / self.tokens.capacity)
+            # Livello di riempimento: la risorsa più scarsa tra richieste e token
+            status["fill_level"] = round(max(0.0, min(fills)), 3)
+            return status
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_lock = threading.Lock()
+
+
+def get_limiter(key: str) -> ModelLimiter:
+    """Limiter condiviso per una chiave di GoogleMonitor.LIMITS (o MANAGEMENT_KEY)."""
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            if key == MANAGEMENT_KEY:
+                limiter = ModelLimiter(key, MANAGEMENT_RPM, 0)
+            else:
+                from utils.google_monitor import GoogleMonitor
+                limits = GoogleMonitor.LIMITS.get(key, GoogleMonitor.LIMITS[DEFAULT_LIMITS_KEY])
+                limiter = ModelLimiter(key, limits["rpm_limit"], limits["tpm_limit"])
+            _limiters[key] = limiter
+            log_info(f"Rate limiter creato per {key}: {limiter.requests.capacity:.0f} RPM")
+        return limiter
+
+
+def acquire_model(model_name: str, tokens: int = 0, timeout: Optional[float] = None) -> float:
+    """Attende la capacità per una chiamata di generazione sul modello indicato."""
+    return get_limiter(model_limits_key(model_name)).acquire(tokens, timeout)
+
+
+def settle_model(model_name: str, estimated_tokens: int, actual_tokens: Optional[int]):
+    """Corregge il consumo di token stimato con quello reale della risposta."""
+    get_limiter(model_limits_key(model_name)).settle(estimated_tokens, actual_tokens)
+
+
+def acquire_management(timeout: Optional[float] = None) -> float:
+    """Attende la capacità per una chiamata di gestione (file, store, operazioni)."""
+    return get_limiter(MANAGEMENT_KEY).acquire(0, timeout)
+
+
+def get_status() -> Dict[str, Dict]:
+    """Stato di tutti i limiter attivi (riempimento e coda) per la dashboard."""
+    with _lock:
+        limiters = list(_limiters.values())
+    return {limiter.key: limiter.status() for limiter in limiters}
@@ -0,0 +1,273 @@
+"""
+Livello unico di resilienza per le chiamate alle API Google.
+Classifica gli errori (ritentabili o no), ritenta con backoff esponenziale e jitter,
+apre un circuit breaker per endpoint dopo errori ripetuti e rispetta una scadenza
+(deadline) propagata a tutte le chiamate annidate dello stesso thread.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+from utils import rate_limiter
+from utils.logger import log_info, log_warning
+
+# Categorie di errore
+ERROR_RETRYABLE = "retryable"      # 429, 5xx, timeout, errori di rete
+ERROR_NOT_FOUND = "not_found"      # 404
+ERROR_PERMISSION = "permission"    # 401, 403
+ERROR_INVALID = "invalid"          # altri 4xx
+ERROR_FATAL = "fatal"              # tutto il resto
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Politica di retry di default
+DEFAULT_MAX_ATTEMPTS = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 20.0
+
+# Circuit breaker: dopo N errori ritentabili consecutivi l'endpoint viene sospeso
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+
+class CircuitOpenError(Exception):
+    """L'endpoint è sospeso dopo troppi errori consecutivi."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """La scadenza dell'operazione è stata superata."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, 'response', None)
+    code = getattr(response, 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """Categoria dell'errore, basata sul codice HTTP e sul tipo di eccezione."""
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return ERROR_FATAL
+    code = _status_code(error)
+    if code is not None:
+        if code in RETRYABLE_STATUS_CODES or code >= 500:
+            return ERROR_RETRYABLE
+        if code == 404:
+            return ERROR_NOT_FOUND
+        if code in (401, 403):
+            return ERROR_PERMISSION
+        if 400 <= code < 500:
+            return ERROR_INVALID
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return ERROR_RETRYABLE
+    try:
+        import httpx
+        if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+            return ERROR_RETRYABLE
+    except ImportError:
+        pass
+    return ERROR_FATAL
+
+
+def is_retryable(error: Exception) -> bool:
+    return classify_error(error) == ERROR_RETRYABLE
+
+
+def is_not_found(error: Exception) -> bool:
+    return classify_error(error) == ERROR_NOT_FOUND
+
+
+def is_permission_denied(error: Exception) -> bool:
+    return classify_error(error) == ERROR_PERMISSION
+
+
+# --- Deadline propagata per thread ---
+
+_local = threading.local()
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Imposta una scadenza per tutte le chiamate eseguite nel blocco (anche annidate).
+    Una scadenza esterna più stretta resta valida.
+    """
+    previous = getattr(_local, 'deadline', None)
+    new_deadline = time.monotonic() + seconds
+    _local.deadline = min(previous, new_deadline) if previous is not None else new_deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Secondi rimanenti prima della scadenza corrente (o `default` se non c'è scadenza)."""
+    current = getattr(_local, 'deadline', None)
+    if current is None:
+        return default
+    left = current - time.monotonic()
+    return max(0.0, left) if default is None else max(0.0, min(left, default))
+
+
+def current_deadline() -> Optional[float]:
+    """Scadenza assoluta (time.monotonic) del thread corrente, da passare ai worker."""
+    return getattr(_local, 'deadline', None)
+
+
+def deadline_in(seconds: float) -> float:
+    """
+    Scadenza assoluta tra `seconds` secondi (o quella corrente, se più vicina).
+    Per i generatori, che non possono tenere aperto `deadline()` tra un yield e l'altro:
+    il valore va passato ai worker con inherit_deadline.
+    """
+    current = current_deadline()
+    new_deadline = time.monotonic() + seconds
+    return min(current, new_deadline) if current is not None else new_deadline
+
+
+@contextmanager
+def inherit_deadline(absolute_deadline: Optional[float]):
+    """Riapplica in un thread worker la scadenza ricevuta dal thread chiamante."""
+    if absolute_deadline is None:
+        yield
+        return
+    with deadline(max(0.0, absolute_deadline - time.monotonic())):
+        yield
+
+
+# --- Circuit breaker per endpoint ---
+
+class CircuitBreaker:
+    """Chiuso → aperto dopo N errori consecutivi → semiaperto dopo il timeout (una chiamata di prova)."""
+
+    def __init__(self, endpoint: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                raise CircuitOpenError(f"Servizio {self.endpoint} temporaneamente sospeso dopo errori ripetuti")
+            self._trial_running = True
+
+    def release_trial(self):
+        """Libera la chiamata di prova senza esito (es. scadenza in coda al rate limiter)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log_info(f"Circuit breaker {self.endpoint}: chiuso")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log_warning(f"Circuit breaker {self.endpoint}: aperto dopo {self.failures} errori consecutivi")
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def get_breaker_states() -> Dict[str, str]:
+    """Stato dei circuit breaker per endpoint (per diagnostica)."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.endpoint: b.state for b in breakers}
+
+
+# --- Chiamata protetta ---
+
+def _backoff_delay(attempt: int) -> float:
+    delay = min(MAX_DELAY, BASE_DELAY * (2 ** (attempt - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+def call(endpoint: str, fn: Callable[[], object], model_name: Optional[str] = None,
+         tokens: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+    """
+    Esegue `fn()` passando dal rate limiter (modello o chiamate di gestione),
+    ritentando gli errori transitori con backoff e jitter entro la deadline corrente.
+    I token stimati vengono riservati una sola volta: i tentativi successivi
+    occupano solo una richiesta. Gli errori non ritentabili vengono rilanciati
+    subito, invariati, senza contare né come successo né come errore del servizio.
+    """
+    breaker = get_breaker(endpoint)
+    attempt = 0
+    while True:
+        attempt += 1
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"Scadenza superata prima di {endpoint}")
+
+        breaker.before_call()
+        try:
+            if model_name:
+                rate_limiter.acquire_model(model_name, tokens if attempt == 1 else 0, timeout=left)
+            else:
+                rate_limiter.acquire_management(timeout=left)
+        except TimeoutError as e:
+            # La chiamata non è partita: la prova del semiaperto resta disponibile
+            breaker.release_trial()
+            raise DeadlineExceeded(str(e)) from e
+
+        try:
+            result = fn()
+        except Exception as e:
+            category = classify_error(e)
+            if category != ERROR_RETRYABLE:
+                # Errore della richiesta, non del servizio: non dice nulla sul suo stato
+                # (un 4xx nella prova del semiaperto non deve richiudere il breaker)
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+            if attempt >= max_attempts or breaker.state == "open":
+                raise
+            delay = _backoff_delay(attempt)
+            left = remaining()
+            if left is not None and delay >= left:
+                raise
+            log_warning(f"{endpoint}: errore transitorio ({e}), tentativo {attempt + 1}/{max_attempts} tra {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        breaker.record_success()
+        return result
@@ -0,0 +1,153 @@
+"""
+Inventario condiviso dei File Search Store.
+Un'unica fotografia dell'elenco degli store per API key, riusata da tutte le
+letture (dashboard, monitor, ripristino quadernini) finché non scade il TTL o
+finché una creazione/eliminazione non la invalida: un render della dashboard
+elenca gli store una sola volta invece di 4-6.
+Sulla stessa fotografia vengono calcolati (una volta) i byte occupati per store
+e per quadernino.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from utils import hash_manifest, resilience
+from utils.client_pool import get_client
+from utils.logger import log_info
+
+# Durata (secondi) della fotografia degli store (sovrascrivibile da .env)
+try:
+    INVENTORY_TTL = int(os.getenv("INVENTORY_TTL", 60))
+except ValueError:
+    INVENTORY_TTL = 60
+
+
+class StoreInventory:
+    """
+    Fotografia dell'elenco degli store di una API key, con TTL.
+    Thread-safe: se più sessioni la richiedono scaduta, l'elenco viene letto una volta sola.
+    """
+
+    def __init__(self, api_key: str, ttl: int = INVENTORY_TTL):
+        self.api_key = api_key
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stores: Optional[List] = None
+        self._taken_at = 0.0
+        self._storage: Optional[Dict] = None
+        self._generation = 0  # cambia a ogni modifica della fotografia
+        self.refresh_count = 0
+
+    def _is_fresh(self) -> bool:
+        return self._stores is not None and time.time() - self._taken_at < self.ttl
+
+    def stores(self, force: bool = False) -> List:
+        """Elenco degli store (dalla fotografia, riletto se scaduto o se force=True)."""
+        with self._lock:
+            if force or not self._is_fresh():
+                client = get_client(self.api_key)
+                self._stores = resilience.call(
+                    "file_search_stores.list", lambda: list(client.file_search_stores.list())
+                )
+                self._taken_at = time.time()
+                self._storage = None
+                self._generation += 1
+                self.refresh_count += 1
+                log_info(f"Inventario store aggiornato: {len(self._stores)} store")
+            return list(self._stores)
+
+    def get(self, store_id: str):
+        """Store con questo nome nella fotografia, o None."""
+        return next((s for s in self.stores() if getattr(s, 'name', None) == store_id), None)
+
+    def age(self) -> Optional[float]:
+        """Età (secondi) della fotografia, o None se non ancora letta."""
+        with self._lock:
+            return time.time() - self._taken_at if self._stores is not None else None
+
+    def invalidate(self):
+        """Scarta la fotografia: la prossima lettura rilegge l'elenco (es. dopo una creazione)."""
+        with self._lock:
+            self._stores = None
+            self._storage = None
+            self._generation += 1
+
+    def forget(self, store_id: str):
+        """Rimuove uno store eliminato dalla fotografia, senza rileggere l'elenco."""
+        with self._lock:
+            if self._stores is not None:
+                self._stores = [s for s in self._stores if getattr(s, 'name', None) != store_id]
+            self._storage = None
+            self._generation += 1
+
+    def storage(self) -> Dict:
+        """
+        Occupazione reale calcolata sulla fotografia corrente (e riusata finché non cambia):
+        {stores: {store_id: {bytes, source, documents}}, notebooks: {nome: {...}}, total_bytes}.
+        I byte vengono da size_bytes dello store; se Google non li riporta, dal manifest locale.
+        """
+        stores = self.stores()
+        with self._lock:
+            if self._storage is not None:
+                return self._storage
+            generation = self._generation
+
+        manifest = hash_manifest.get_storage_summary()
+        per_store = {}
+        for store in stores:
+            store_id = getattr(store, 'name', '')
+            api_bytes = int(getattr(store, 'size_bytes', None) or 0)
+            local_bytes = manifest["stores"].get(store_id, 0)
+            per_store[store_id] = {
+                "bytes": api_bytes or local_bytes,
+                "source": "api" if api_bytes else ("manifest" if local_bytes else "none"),
+                "documents": int(getattr(store, 'active_documents_count', None) or 0)
+            }
+
+        # Import locale: env_manager importa questo modulo
+        from utils.env_manager import load_notebooks
+        per_notebook = {}
+        for notebook in load_notebooks():
+            store_id = notebook.get("store_name") or ""
+            files = notebook.get("files", [])
+            per_notebook[notebook["name"]] = {
+                "store_id": store_id,
+                "indexed_bytes": per_store.get(store_id, {}).get("bytes", 0),
+                "local_bytes": sum(manifest["files"].get(name, 0) for name in files),
+                "files": len(files)
+            }
+
+        summary = {
+            "stores": per_store,
+            "notebooks": per_notebook,
+            "total_bytes": sum(s["bytes"] for s in per_store.values())
+        }
+        with self._lock:
+            # Se nel frattempo la fotografia è cambiata, il calcolo vale solo per questa lettura
+            if self._generation == generation:
+                self._storage = summary
+        return summary
+
+
+_inventories: Dict[str, StoreInventory] = {}
+_registry_lock = threading.Lock()
+
+
+def get_inventory(api_key: str) -> StoreInventory:
+    """Inventario condiviso per l'API key (uno per processo)."""
+    with _registry_lock:
+        inventory = _inventories.get(api_key)
+        if inventory is None:
+            inventory = StoreInventory(api_key)
+            _inventories[api_key] = inventory
+        return inventory
+
+
+def invalidate(api_key: str):
+    """Invalida l'inventario di una API key (dopo la creazione di uno store)."""
+    get_inventory(api_key).invalidate()
+
+
+def forget_store(api_key: str, store_id: str):
+    """Aggiorna l'inventario di una API key dopo l'eliminazione di uno store."""
+    get_inventory(api_key).forget(store_id)
@@ -0,0 +1,166 @@
+"""
+Registro locale (append-only) dell'utilizzo reale delle API di generazione.
+Ogni risposta di generate_content / generate_content_stream aggiunge una riga
+con i token riportati da usage_metadata (prompt, risposta, tool, cache),
+latenza, modello, quadernino e store. Le statistiche della dashboard sono
+aggregazioni indicizzate per giorno, modello e quadernino.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from utils.logger import log_error
+
+LEDGER_FILE = Path("usage_ledger.sqlite3")
+
+# Colonne su cui è possibile aggregare (nomi fissi: entrano nella query SQL)
+GROUP_COLUMNS = ("day", "model", "notebook", "store", "operation")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    model TEXT NOT NULL,
+    notebook TEXT,
+    store TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    candidates_tokens INTEGER NOT NULL DEFAULT 0,
+    tool_use_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    thoughts_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_s REAL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_day_model ON usage (day, model);
+CREATE INDEX IF NOT EXISTS idx_usage_notebook_day ON usage (notebook, day);
+CREATE INDEX IF NOT EXISTS idx_usage_model_ts ON usage (model, ts);
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Connessione al registro (una per chiamata: sicura tra thread e processi)."""
+    global _schema_ready
+    conn = sqlite3.connect(str(LEDGER_FILE), timeout=10)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+    return conn
+
+
+def _count(usage, field: str) -> int:
+    return int(getattr(usage, field, None) or 0)
+
+
+def record(operation: str, model: str, usage, latency_s: Optional[float] = None,
+           notebook: Optional[str] = None, store: Optional[str] = None) -> bool:
+    """
+    Aggiunge una riga con i token di `usage` (usage_metadata della risposta).
+    Non solleva mai eccezioni: un errore del registro non deve fermare la chat.
+    """
+    if usage is None:
+        return False
+    now = time.time()
+    row = (
+        now, datetime.fromtimestamp(now).strftime("%Y-%m-%d"), operation,
+        (model or "").replace("models/", ""), notebook, store,
+        _count(usage, 'prompt_token_count'), _count(usage, 'candidates_token_count'),
+        _count(usage, 'tool_use_prompt_token_count'), _count(usage, 'cached_content_token_count'),
+        _count(usage, 'thoughts_token_count'), _count(usage, 'total_token_count'),
+        round(latency_s, 3) if latency_s is not None else None
+    )
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO usage (ts, day, operation, model, notebook, store, prompt_tokens, "
+                    "candidates_tokens, tool_use_tokens, cached_tokens, thoughts_tokens, total_tokens, latency_s) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row
+                )
+        finally:
+            conn.close()
+        return True
+    except sqlite3.Error as e:
+        log_error(f"Errore scrittura usage_ledger: {e}")
+        return False
+
+
+def since_day(days: int) -> str:
+    """Data (YYYY-MM-DD) di `days` giorni fa, per filtrare le aggregazioni."""
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def rollup(group_by: tuple = ("day",), since: Optional[str] = None, model: Optional[str] = None) -> List[Dict]:
+    """
+    Somme di richieste, token e latenza media raggruppate per le colonne indicate
+    (tra GROUP_COLUMNS), dal giorno `since` (incluso) ed eventualmente per un modello.
+    """
+    columns = [c for c in group_by if c in GROUP_COLUMNS]
+    where, params = [], []
+    if since:
+        where.append("day >= ?")
+        params.append(since)
+    if model:
+        where.append("model = ?")
+        params.append(model.replace("models/", ""))
+
+    select = ", ".join(columns + [
+        "COUNT(*) AS requests",
+        "SUM(prompt_tokens) AS prompt_tokens",
+        "SUM(candidates_tokens) AS candidates_tokens",
+        "SUM(tool_use_tokens) AS tool_use_tokens",
+        "SUM(cached_tokens) AS cached_tokens",
+        "SUM(thoughts_tokens) AS thoughts_tokens",
+        "SUM(total_tokens) AS total_tokens",
+        "AVG(latency_s) AS avg_latency_s"
+    ])
+    query = f"SELECT {select} FROM usage"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    if columns:
+        query += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+
+    if not LEDGER_FILE.exists():
+        return []
+    try:
+        conn = _connect()
+        try:
+            return [dict(r) for r in conn.execute(query, params) if r["requests"]]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log_error(f"Errore lettura usage_ledger: {e}")
+        return []
+
+
+def peak_minute(model: str, since_ts: float) -> Dict[str, int]:
+    """Massimo di richieste e di token in un singolo minuto per un modello, da `since_ts`."""
+    if not LEDGER_FILE.exists():
+        return {"requests": 0, "tokens": 0}
+    query = ("SELECT COUNT(*) AS requests, SUM(total_tokens) AS tokens FROM usage "
+             "WHERE model = ? AND ts >= ? GROUP BY CAST(ts / 60 AS INTEGER)")
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute(query, (model.replace("models/", ""), since_ts)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log_error(f"Errore lettura usage_ledger: {e}")
+        return {"requests": 0, "tokens": 0}
+    return {
+        "requests": max((r["requests"] for r in rows), default=0),
+        "tokens": max((r["tokens"] or 0 for r in rows), default=0)
+    }